@@ -4,29 +4,622 @@ Handles AI-powered tutoring using OpenAI GPT-4o with curriculum alignment
 """
 
 import os
-import openai
-import requests
+import ast
+import bisect
+import asyncio
 import json
+import logging
+import operator
 import re
-from typing import Dict, List, Optional
-from datetime import datetime
+import copy
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed
+from typing import Callable, Dict, Generator, Iterator, List, Optional, Tuple
 import random
-from dotenv import load_dotenv
+import orjson
+from cachetools import TTLCache
+
+from http_pool import shared_session, use_for_openai_sdk
+
+log = logging.getLogger('smartlearn.tutor')
+
+
+class LLMCache:
+    """Exact-match cache for generated answers.
+
+    Keys are a SHA-256 of (subject, normalized question, model). Answers are
+    sampled at temperature 0.7, so entries expire after a TTL rather than
+    living forever. Backend is selected with SMARTLEARN_CACHE_BACKEND
+    ('memory' (default), 'sqlite', 'redis' or 'none'). The sqlite backend
+    survives restarts so new workers start warm. The sqlite and redis
+    backends sit behind a small in-process LRU (l1_size entries) so hot
+    questions skip the disk/network read and deserialization.
+    """
+
+    SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS answers (
+        key TEXT PRIMARY KEY,
+        payload BLOB NOT NULL,
+        ts INTEGER NOT NULL
+    );
+    """
+
+    # Seconds a counted Redis size is reused; see _redis_size
+    REDIS_SIZE_TTL = 60
+
+    def __init__(self, backend: str = 'memory', ttl: int = 86400, maxsize: int = 10_000,
+                 path: str = 'answer_cache.db', l1_size: int = 1024):
+        self.backend = backend
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.stats = {'hits': 0, 'misses': 0, 'l1_hits': 0}
+        self._l1 = None
+        self._lock = threading.Lock()
+        self._memory = None
+        self._redis = None
+        self._sqlite = None
+        self._writes_since_prune = 0
+        self._redis_size_value = 0
+        self._redis_size_at = float('-inf')
+
+        if backend == 'sqlite':
+            try:
+                self._sqlite = sqlite3.connect(path, check_same_thread=False)
+                self._sqlite.execute(self.SQLITE_SCHEMA)
+                self._sqlite.commit()
+                self._prune_sqlite()
+            except Exception as e:
+                log.warning("SQLite cache unavailable, falling back to memory: %s", e)
+                self._sqlite = None
+                self.backend = 'memory'
+
+        if backend == 'redis':
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+                self._redis.ping()
+            except Exception as e:
+                log.warning("Redis cache unavailable, falling back to memory: %s", e)
+                self._redis = None
+                self.backend = 'memory'
+
+        if self.backend == 'memory':
+            self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        elif self.backend in ('sqlite', 'redis') and l1_size > 0:
+            self._l1 = TTLCache(maxsize=l1_size, ttl=ttl)
+
+    @classmethod
+    def from_env(cls) -> 'LLMCache':
+        """Build a cache from SMARTLEARN_CACHE_* environment variables."""
+        backend = os.getenv('SMARTLEARN_CACHE_BACKEND', 'memory').lower()
+        # Persistent backends default to a week; in-memory entries to a day
+        default_ttl = '604800' if backend == 'sqlite' else '86400'
+        return cls(
+            backend=backend,
+            ttl=int(os.getenv('SMARTLEARN_CACHE_TTL', default_ttl)),
+            maxsize=int(os.getenv('SMARTLEARN_CACHE_MAXSIZE', '10000')),
+            path=os.getenv('SMARTLEARN_CACHE_PATH', 'answer_cache.db'),
+            l1_size=int(os.getenv('SMARTLEARN_CACHE_L1_SIZE', '1024'))
+        )
+
+    @staticmethod
+    def make_key(subject: str, question: str, model: str) -> str:
+        payload = json.dumps({
+            'subject': subject,
+            # Case and whitespace runs don't change the question; casefold
+            # matches lower() for ASCII so existing keys stay valid
+            'question': ' '.join(question.split()).casefold(),
+            'model': model
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return a private copy of the cached answer, or None on a miss."""
+        if self._l1 is not None:
+            with self._lock:
+                cached = self._l1.get(key)
+                if cached is not None:
+                    self.stats['hits'] += 1
+                    self.stats['l1_hits'] += 1
+            if cached is not None:
+                return copy.deepcopy(cached)
+
+        value = None
+        try:
+            if self._redis is not None:
+                raw = self._redis.get(f"smartlearn:answer:{key}")
+                value = orjson.loads(raw) if raw else None
+            elif self._sqlite is not None:
+                with self._lock:
+                    row = self._sqlite.execute(
+                        "SELECT payload FROM answers WHERE key=? AND ts>=?",
+                        (key, int(time.time()) - self.ttl)
+                    ).fetchone()
+                value = orjson.loads(row[0]) if row else None
+            elif self._memory is not None:
+                with self._lock:
+                    cached = self._memory.get(key)
+                value = copy.deepcopy(cached) if cached is not None else None
+        except Exception as e:
+            log.warning("Cache read failed: %s", e)
+            value = None
+
+        with self._lock:
+            self.stats['hits' if value is not None else 'misses'] += 1
+            if value is not None and self._l1 is not None:
+                self._l1[key] = copy.deepcopy(value)
+        return value
+
+    def set(self, key: str, value: Dict):
+        if self._l1 is not None:
+            with self._lock:
+                self._l1[key] = copy.deepcopy(value)
+        try:
+            if self._redis is not None:
+                self._redis.setex(f"smartlearn:answer:{key}", self.ttl, orjson.dumps(value))
+            elif self._sqlite is not None:
+                with self._lock:
+                    self._sqlite.execute(
+                        "INSERT OR REPLACE INTO answers(key,payload,ts) VALUES (?,?,?)",
+                        (key, orjson.dumps(value), int(time.time()))
+                    )
+                    self._sqlite.commit()
+                self._writes_since_prune += 1
+                if self._writes_since_prune >= 100:
+                    self._prune_sqlite()
+            elif self._memory is not None:
+                with self._lock:
+                    self._memory[key] = copy.deepcopy(value)
+        except Exception as e:
+            log.warning("Cache write failed: %s", e)
+
+    def _prune_sqlite(self):
+        """Drop expired rows, then the oldest rows beyond maxsize."""
+        self._writes_since_prune = 0
+        with self._lock:
+            self._sqlite.execute("DELETE FROM answers WHERE ts<?", (int(time.time()) - self.ttl,))
+            self._sqlite.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY ts DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,)
+            )
+            self._sqlite.commit()
+
+    def __len__(self) -> int:
+        if self._redis is not None:
+            return self._redis_size()
+        if self._sqlite is not None:
+            with self._lock:
+                return self._sqlite.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        if self._memory is not None:
+            with self._lock:
+                return len(self._memory)
+        return 0
+
+    def _redis_size(self) -> int:
+        """Approximate Redis entry count, recounted at most every REDIS_SIZE_TTL seconds.
+
+        SCAN rather than KEYS so a large keyspace doesn't block Redis; the
+        count can be up to a minute old and SCAN may miss keys written meanwhile.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._redis_size_at < self.REDIS_SIZE_TTL:
+                return self._redis_size_value
+        try:
+            size = sum(1 for _ in self._redis.scan_iter(match="smartlearn:answer:*", count=1000))
+        except Exception as e:
+            log.warning("Cache size count failed: %s", e)
+            return self._redis_size_value
+        with self._lock:
+            self._redis_size_value, self._redis_size_at = size, now
+        return size
+
+
+# Questions containing these words usually depend on earlier context, so a
+# "similar" cached answer is likely wrong for them.
+_DEICTIC_WORDS = frozenset({'it', 'this', 'that', 'these', 'those', 'change'})
+
+# Questions asking for reasoning or derivation always get the full model
+_COMPLEX_QUESTION_RE = re.compile(
+    r"\b(?:why|how|explain|derive|prove|compare|describe|evaluate|discuss)\b", re.IGNORECASE)
+
+# "Key Points" header as models actually write it: plain "Key Points:",
+# "**Key Points:**", "**Key Points**:", "# Key Points", "1. Key Points:"
+_KEY_POINTS_RE = re.compile(
+    r"^[ \t]*(?:(?:#{1,3}[ \t]*|\d+\.[ \t]*)?(?:\*\*)?key[ \t]*points[ \t]*(?::[ \t]*(?:\*\*)?|(?:\*\*)?[ \t]*:)"
+    r"|#{1,3}[ \t]*key[ \t]*points[ \t]*$)",
+    re.IGNORECASE | re.MULTILINE)
+
+# Any sign the model already structured its answer
+_STRUCTURE_KEYWORDS_RE = re.compile(r'key points|explanation|example', re.IGNORECASE)
+
+# Bold section headers rewritten to markdown headings in one pass
+_SECTION_HEADINGS = {
+    'Explanation': '### Step-by-Step Explanation:',
+    'Real-world Example': '### Real-world Example:',
+    'Common Mistakes': '### Common Mistakes:',
+    'Additional Tips': '### Additional Tips:',
+}
+_BOLD_HEADER_RE = re.compile(r'\*\*(' + '|'.join(map(re.escape, _SECTION_HEADINGS)) + r'):\*\*')
+
+# Patterns used when parsing and repairing model output / fallback answers
+_RE_WORDS = re.compile(r"[a-z']+")
+_RE_JSON_BLOCK = re.compile(r"\{[\s\S]*\}")
+_RE_JSON_BLOCK_NONGREEDY = re.compile(r"\{[\s\S]*?\}")
+_RE_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_RE_SQ_KEY = re.compile(r"'(\w+)':")
+_RE_SQ_VAL = re.compile(r"'([^']*)'")
+_RE_MATH_CLEAN = re.compile(r"[^0-9+\-*/().^ ]")
+
+_OPENAI_CHAT_URL = 'https://api.openai.com/v1/chat/completions'
+
+# Substrings of OpenAI errors worth retrying: timeouts, rate limits, 5xx, dropped connections
+_RETRYABLE = ('timeout', 'timed out', '429', '500', '502', '503', '504', '524', 'connection')
+
+
+_ALLOWED_BINOPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+    ast.Mod: operator.mod,
+}
+_ALLOWED_UNARYOPS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+# Largest integer _safe_eval will build; float arithmetic is constant-time
+# and overflows on its own
+_MAX_RESULT_BITS = 4096
+
+
+def _safe_eval(expr: str):
+    """Evaluate a plain arithmetic expression without compiling Python code.
+
+    Only numeric literals, + - * / % ** and unary +/- are accepted; anything
+    else raises ValueError. Integer powers and products are refused before
+    they exceed _MAX_RESULT_BITS, so neither '9**9**9' nor a nested
+    '((9**99)**99)**99' can hang a worker.
+    """
+    return _eval_node(ast.parse(expr, mode='eval').body)
+
+
+def _eval_node(node):
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in _ALLOWED_BINOPS:
+        left, right = _eval_node(node.left), _eval_node(node.right)
+        if (isinstance(node.op, ast.Pow) and type(left) is int and type(right) is int
+                and abs(left).bit_length() * abs(right) > _MAX_RESULT_BITS):
+            raise ValueError("result too large")
+        result = _ALLOWED_BINOPS[type(node.op)](left, right)
+        if isinstance(node.op, ast.Mult) and type(result) is int and result.bit_length() > _MAX_RESULT_BITS:
+            raise ValueError("result too large")
+        return result
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _ALLOWED_UNARYOPS:
+        return _ALLOWED_UNARYOPS[type(node.op)](_eval_node(node.operand))
+    raise ValueError(f"unsupported expression: {type(node).__name__}")
+
+# Bare arithmetic, optionally phrased as "what is ...?" / "calculate ..."
+_RE_ARITHMETIC_QUESTION = re.compile(
+    r"^(?:what\s+is|what's|calculate|compute|evaluate)?\s*([0-9+\-*/().^ ]*\d[0-9+\-*/().^ ]*?)\s*[=?]*$",
+    re.IGNORECASE)
+_RE_ARITHMETIC_OPERATOR = re.compile(r"\d\s*[-+*/^]\s*[-+(]*\d")
+# Longest expression handed to _safe_eval; also keeps the AST shallow
+_MAX_ARITHMETIC_LEN = 200
+
+
+def _arithmetic_answer(text: str):
+    """The value of questions like '2+3*4' or 'What is 12 / 4?', or None if _safe_eval can't answer."""
+    if len(text) > _MAX_ARITHMETIC_LEN + 20:  # room for a "what is ...?" wrapper
+        return None
+    match = _RE_ARITHMETIC_QUESTION.match(text)
+    if (not match or len(match.group(1)) > _MAX_ARITHMETIC_LEN
+            or not _RE_ARITHMETIC_OPERATOR.search(match.group(1))):
+        return None
+    try:
+        return _safe_eval(match.group(1).replace('^', '**'))
+    except Exception:
+        return None
+
+
+_last_ts = (0, '')
+
+
+def _now_iso() -> str:
+    """UTC ISO-8601 timestamp, formatted at most once per second."""
+    global _last_ts
+    now = int(time.time())
+    cached = _last_ts
+    if cached[0] != now:
+        # Rebinding a tuple keeps concurrent readers from seeing a torn pair
+        cached = _last_ts = (now, time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now)))
+    return cached[1]
+
+
+_ENCODERS = {}
+_ENCODER_LOCK = threading.Lock()
+
+
+def _load_encoder(model_name: str):
+    """Process-wide sentence encoder, imported and loaded on first use.
+
+    Workers that never reach the semantic layer don't pay for torch and the
+    model weights; concurrent first lookups load the model only once.
+    """
+    with _ENCODER_LOCK:
+        encoder = _ENCODERS.get(model_name)
+        if encoder is None:
+            # Avoid tokenizer thread pools that misbehave after gunicorn forks
+            os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+            import torch
+            from sentence_transformers import SentenceTransformer
+            # Questions are encoded one short string at a time; intra-op threads only add contention
+            torch.set_num_threads(1)
+            encoder = _ENCODERS[model_name] = SentenceTransformer(model_name, device='cpu')
+        return encoder
+
+
+class SemanticCache:
+    """Near-duplicate answer cache using sentence-embedding cosine similarity.
+
+    Enabled with SMARTLEARN_SEMANTIC_CACHE=true; requires the optional
+    sentence-transformers package. Embeddings are L2-normalized so a dot
+    product against the per-subject matrix is the cosine similarity.
+    Entries older than ttl seconds are swept on each lookup/add.
+    """
+
+    def __init__(self, threshold: float = 0.92, model_name: str = 'all-MiniLM-L6-v2',
+                 max_entries_per_subject: int = 5000, ttl: int = 604800):
+        self.threshold = threshold
+        self.model_name = model_name
+        self.max_entries_per_subject = max_entries_per_subject
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0}
+        self.available = True
+        self._encoder = None
+        self._vectors = {}   # subject -> numpy matrix (n, dim)
+        self._answers = {}   # subject -> list of answer dicts, parallel to _vectors
+        self._added = {}     # subject -> list of insert times, parallel (and ascending)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional['SemanticCache']:
+        if os.getenv('SMARTLEARN_SEMANTIC_CACHE', 'false').lower() != 'true':
+            return None
+        return cls(threshold=float(os.getenv('SMARTLEARN_SEMANTIC_THRESHOLD', '0.92')),
+                   ttl=int(os.getenv('SMARTLEARN_SEMANTIC_TTL', '604800')))
+
+    @staticmethod
+    def is_contextual(question: str) -> bool:
+        return any(word in _DEICTIC_WORDS for word in _RE_WORDS.findall(question.lower()))
+
+    def _encode(self, text: str):
+        if self._encoder is None:
+            try:
+                self._encoder = _load_encoder(self.model_name)
+            except Exception as e:
+                log.warning("Semantic cache disabled, encoder unavailable: %s", e)
+                self.available = False
+                return None
+        return self._encoder.encode([text], normalize_embeddings=True)[0]
+
+    def lookup(self, subject: str, question: str):
+        """Return (answer or None, embedding). The embedding is reused by add()."""
+        if not self.available or self.is_contextual(question):
+            return None, None
+        embedding = self._encode(question)
+        if embedding is None:
+            return None, None
+
+        answer = None
+        with self._lock:
+            self._expire(subject)
+            matrix = self._vectors.get(subject)
+            if matrix is not None and len(matrix):
+                scores = matrix @ embedding
+                best = int(scores.argmax())
+                if scores[best] >= self.threshold:
+                    answer = copy.deepcopy(self._answers[subject][best])
+            self.stats['hits' if answer is not None else 'misses'] += 1
+        return answer, embedding
+
+    def add(self, subject: str, embedding, answer: Dict):
+        if embedding is None:
+            return
+        import numpy as np
+        with self._lock:
+            self._expire(subject)
+            matrix = self._vectors.get(subject)
+            answers = self._answers.setdefault(subject, [])
+            added = self._added.setdefault(subject, [])
+            row = np.asarray(embedding, dtype=np.float32)[None, :]
+            matrix = row if matrix is None else np.vstack((matrix, row))
+            answers.append(copy.deepcopy(answer))
+            added.append(time.time())
+            if len(answers) > self.max_entries_per_subject:
+                matrix = matrix[1:]
+                del answers[0]
+                del added[0]
+            self._vectors[subject] = matrix
+
+    def _expire(self, subject: str):
+        """Drop the subject's entries older than ttl. Caller holds the lock."""
+        added = self._added.get(subject)
+        if not added:
+            return
+        # Insert times ascend, so the expired entries are a prefix
+        stale = bisect.bisect_left(added, time.time() - self.ttl)
+        if stale:
+            self._vectors[subject] = self._vectors[subject][stale:]
+            del self._answers[subject][:stale]
+            del added[:stale]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(answers) for answers in self._answers.values())
 
 
 class SmartLearnTutor:
+    # Fixed attribute layout: no per-instance __dict__, and a typo'd
+    # self.attr assignment fails loudly. Add new instance state here.
+    __slots__ = (
+        'client', '_openai', 'openai_api_key', 'openai_via_http',
+        '_openai_model', '_openai_model_light', '_stream_openai',
+        'huggingface_api_key', 'use_huggingface',
+        '_openai_disabled_until', '_circuit_state', '_circuit_cooldown',
+        '_circuit_trial_at', '_circuit_lock', '_err_times',
+        'cache', 'semantic_cache', 'route_stats',
+        '_http', '_ahttp', '_ahttp_loop', '_llm_sem', '_llm_max_async', '_io_pool', '_hf_pool', '_providers',
+        'teaching_styles', 'curriculum_frameworks', '_general_style', '_prompt_by_subject',
+    )
+
+    # Teaching prompt; everything except {question} is fixed per subject
+    _PROMPT_TEMPLATE = """You are SmartLearn, an expert {subject} tutor for African high school students.
+
+STUDENT QUESTION: {question}
+
+IMPORTANT: You MUST provide a COMPLETE and DETAILED explanation of the concept asked about. Do NOT give generic responses or acknowledgments. Actually TEACH the student about the topic.
+
+TEACHING REQUIREMENTS:
+- Subject: {subject}
+- Teaching Style: {teaching_style}
+- Curriculum: {curriculum}
+- Target Audience: African high school students (ages 14-18)
+
+RESPONSE STRUCTURE:
+You MUST structure your response exactly as follows:
+
+Key Points:
+- [List 3-4 main concepts related to the question]
+
+Step-by-Step Explanation:
+[Provide a COMPLETE explanation of the concept. Break it down in simple, clear terms that a high school student can understand. Use examples and analogies.]
+
+Real-world Example:
+[Give a specific, practical example relevant to African context or daily life]
+
+Common Mistakes:
+[Highlight 2-3 common errors students make when learning this concept and how to avoid them]
+
+Additional Tips:
+[Provide 1-2 helpful study tips or memory aids for this topic]
+
+CRITICAL: Your response must be EDUCATIONAL and INFORMATIVE. Do not just acknowledge the question - actually explain the concept in detail. The student should learn something new from your response."""
+
+    # System prompt for single answers (_generate_openai_response)
+    _SYSTEM_PROMPT = (
+        "You are SmartLearn, an expert tutor for African high school students. Provide clear, deep, engaging explanations aligned with KCSE/WAEC curricula. "
+        "ALWAYS output a detailed explanation. First output a JSON object ONLY with the schema: {\\n"
+        "  'key_points': string[], 'step_by_step': string, 'real_world_example': string, 'common_mistakes': string[], 'additional_tips': string[]\\n} "
+        "No markdown, no prose outside JSON. After the JSON, add a markdown version starting with '---\nMARKDOWN:' for display."
+    )
+
+    # System prompt for multi-question requests (_generate_openai_response_batch)
+    _BATCH_SYSTEM_PROMPT = (
+        "You are SmartLearn, an expert tutor for African high school students. Provide clear, deep, engaging "
+        "explanations aligned with KCSE/WAEC curricula. Respond with a JSON object of the form "
+        "{\"answers\": [...]} holding one entry per numbered question, in order. Each entry has the schema: "
+        "{'key_points': string[], 'step_by_step': string, 'real_world_example': string, "
+        "'common_mistakes': string[], 'additional_tips': string[]}"
+    )
+
+    # Canned practice question per subject (options are tuples: shared and immutable)
+    _PRACTICE_QUESTIONS = {
+        'Mathematics': {
+            'question': 'What is the value of x in the equation 2x + 5 = 13?',
+            'options': ('x = 3', 'x = 4', 'x = 5', 'x = 6'),
+            'correct_answer': 'x = 4'
+        },
+        'Physics': {
+            'question': 'What is the SI unit of force?',
+            'options': ('Newton (N)', 'Joule (J)', 'Watt (W)', 'Pascal (Pa)'),
+            'correct_answer': 'Newton (N)'
+        },
+        'Biology': {
+            'question': 'What is the powerhouse of the cell?',
+            'options': ('Mitochondria', 'Nucleus', 'Golgi apparatus', 'Endoplasmic reticulum'),
+            'correct_answer': 'Mitochondria'
+        },
+        'Chemistry': {
+            'question': 'What is the chemical symbol for gold?',
+            'options': ('Ag', 'Au', 'Fe', 'Cu'),
+            'correct_answer': 'Au'
+        },
+        'History': {
+            'question': 'What is the capital of Kenya?',
+            'options': ('Nairobi', 'Mombasa', 'Kisumu', 'Nakuru'),
+            'correct_answer': 'Nairobi'
+        },
+        'Geography': {
+            'question': 'What is the largest desert in Africa?',
+            'options': ('Sahara', 'Kalahari', 'Namib', 'Libyan'),
+            'correct_answer': 'Sahara'
+        },
+        'English': {
+            'question': 'Which of these is a proper noun?',
+            'options': ('city', 'London', 'river', 'mountain'),
+            'correct_answer': 'London'
+        }
+    }
+
+    # Hugging Face fallback models, queried in parallel
+    _HF_MODELS = (
+        "microsoft/DialoGPT-medium",
+        "gpt2",
+        "distilgpt2"
+    )
+
+    # OpenAI circuit breaker: failures within the window that open it, and base cooldown (s)
+    CIRCUIT_FAILURES = 5
+    CIRCUIT_WINDOW = 60
+    CIRCUIT_COOLDOWN = 120
+
+    # Questions packed into one OpenAI request by generate_answer_batch
+    _OPENAI_BATCH_SIZE = 10
+
+    # System prompt for stream_answer: display markdown directly, no JSON preamble
+    _STREAM_SYSTEM_PROMPT = (
+        "You are SmartLearn, an expert tutor for African high school students. Provide clear, deep, engaging "
+        "explanations aligned with KCSE/WAEC curricula. Answer in markdown using the section headings from "
+        "the response structure, with no JSON."
+    )
+
     def __init__(self):
         """Initialize providers, teaching styles, and curriculum frameworks (clean)."""
-        load_dotenv()
+        # Deployed environments inject config directly and can skip .env parsing
+        if os.getenv('SMARTLEARN_SKIP_DOTENV') != '1':
+            from dotenv import load_dotenv
+            load_dotenv()
 
         # Provider / state
         self.client = None
-        self.huggingface_api_key = os.getenv('HUGGINGFACE_API_KEY')
-        self.use_huggingface = os.getenv('USE_HUGGINGFACE', 'false').lower() == 'true'
+        self._openai = None  # openai module, imported on first client init
+        self.reload_config()
         self._openai_disabled_until = None
+        self._circuit_state = 'closed'   # closed -> open -> half-open -> closed
+        self._circuit_cooldown = self.CIRCUIT_COOLDOWN
+        self._circuit_trial_at = 0.0
+        self._circuit_lock = threading.Lock()
+        self._err_times = deque(maxlen=20)
+        self.cache = LLMCache.from_env()
+        self.semantic_cache = SemanticCache.from_env()
+        self._http = shared_session()  # keep-alive pool shared with the quiz generator
+        self._ahttp = None  # httpx.AsyncClient for the async path, see _async_http
+        self._ahttp_loop = None
+        self._llm_sem = None  # asyncio.Semaphore(LLM_MAX_ASYNC), rebuilt with _ahttp
+        self.route_stats = {'light': 0, 'full': 0}
+        self._io_pool = ThreadPoolExecutor(
+            max_workers=int(os.getenv('SMARTLEARN_IO_WORKERS', '16')),
+            thread_name_prefix='tutor-io'
+        )
+        self._hf_pool = ThreadPoolExecutor(max_workers=len(self._HF_MODELS) * 4, thread_name_prefix='hf')
 
         # Initialize OpenAI first
         self._initialize_client()
+        self._providers = self._build_provider_chain()
 
         # Subject-specific teaching styles
         self.teaching_styles = {
@@ -47,21 +640,79 @@ class SmartLearnTutor:
             'IGCSE': 'International General Certificate of Secondary Education'
         }
 
+        self._general_style = self.teaching_styles['General']
+
+        # Pre-rendered prompt frames for the known subjects
+        self._prompt_by_subject = {
+            subject: self._build_prompt_frame(subject) for subject in self.teaching_styles
+        }
+
+    def _async_http(self) -> 'httpx.AsyncClient':
+        """HTTP/2 pooled client for the async path, bound to the running loop.
+
+        An AsyncClient's connections belong to the loop that opened them, so a
+        fresh client is built when called from a different loop (e.g. after
+        another asyncio.run). Status retries are left to the callers.
+        """
+        loop = asyncio.get_running_loop()
+        if self._ahttp is None or self._ahttp_loop is not loop:
+            import httpx
+            transport = httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=2,  # connect failures only
+                limits=httpx.Limits(max_keepalive_connections=50, max_connections=100)
+            )
+            self._ahttp = httpx.AsyncClient(transport=transport, timeout=30,
+                                            headers={'Content-Type': 'application/json'})
+            self._llm_sem = asyncio.Semaphore(self._llm_max_async)
+            self._ahttp_loop = loop
+        return self._ahttp
+
+    async def aclose(self):
+        """Release the async HTTP client; call from the loop that used it."""
+        if self._ahttp is not None:
+            await self._ahttp.aclose()
+            self._ahttp = None
+            self._ahttp_loop = None
+
+    def close(self):
+        """Release I/O worker threads (the shared HTTP pool stays open for other users)."""
+        self._io_pool.shutdown(wait=False)
+        self._hf_pool.shutdown(wait=False, cancel_futures=True)
+
+    def reload_config(self):
+        """(Re)read provider settings from the environment.
+
+        Runs once at construction so the hot path never touches os.environ;
+        call again after changing env vars (e.g. in tests). The OpenAI client
+        itself is not rebuilt.
+        """
+        self.openai_api_key = os.getenv('OPENAI_API_KEY')
+        self._openai_model = os.getenv('OPENAI_MODEL') or 'gpt-3.5-turbo'
+        self._openai_model_light = os.getenv('OPENAI_MODEL_LIGHT', 'gpt-4o-mini')
+        self._stream_openai = os.getenv('SMARTLEARN_STREAM_OPENAI', '0') == '1'
+        self.huggingface_api_key = os.getenv('HUGGINGFACE_API_KEY')
+        self.use_huggingface = os.getenv('USE_HUGGINGFACE', 'false').lower() == 'true'
+        # In-flight OpenAI calls one event loop may have open (async path)
+        self._llm_max_async = int(os.getenv('LLM_MAX_ASYNC', '20'))
+
     def _initialize_client(self):
         """Initialize OpenAI client with error handling"""
         try:
-            api_key = os.getenv('OPENAI_API_KEY')
+            api_key = self.openai_api_key
             if api_key and api_key.startswith('sk-'):
+                import openai
+                self._openai = openai
+                use_for_openai_sdk(openai)
                 try:
                     self.client = openai.OpenAI(api_key=api_key)
-                    print("✅ OpenAI client initialized successfully")
+                    log.info("OpenAI client initialized successfully")
                     # Test the connection
                     self._test_openai_connection()
                 except Exception as e:
                     # Fallback: avoid relying on SDK internals. Use HTTP fallback.
-                    print(f"⚠️  OpenAI SDK init failed, enabling HTTP fallback: {e}")
+                    log.warning("OpenAI SDK init failed, enabling HTTP fallback: %s", e)
                     openai.api_key = api_key
-                    self.openai_api_key = api_key
                     # Keep client truthy so code prefers OpenAI path, but mark HTTP usage
                     self.client = True
                     self.openai_via_http = True
@@ -71,10 +722,10 @@ class SmartLearnTutor:
                     except Exception:
                         pass
             else:
-                print("⚠️  OPENAI_API_KEY not found or invalid in environment variables")
+                log.warning("OPENAI_API_KEY not found or invalid in environment variables")
                 self.client = None
         except Exception as e:
-            print(f"❌ Error initializing OpenAI client: {str(e)}")
+            log.error("Error initializing OpenAI client: %s", e)
             self.client = None
 
     def _test_openai_connection(self):
@@ -85,62 +736,302 @@ class SmartLearnTutor:
                 resp = self._call_openai_chat(messages=[{"role": "user", "content": "Hello"}], model="gpt-3.5-turbo", max_tokens=10, temperature=0.0, timeout=10)
                 text = self._get_response_text(resp)
                 if text is not None:
-                    print("✅ OpenAI connection test successful")
+                    log.info("OpenAI connection test successful")
         except Exception as e:
-            print(f"⚠️  OpenAI connection test failed: {str(e)}")
+            log.warning("OpenAI connection test failed: %s", e)
 
     def generate_answer(self, subject: str, question: str) -> Dict:
         """Generate AI-powered answer with curriculum alignment"""
 
-        print(
-            f"🔍 generate_answer called for subject: {subject}, question: {question}")
-        print(f"🔍 OpenAI client status: {self.client is not None}")
-        print(f"🔍 Hugging Face enabled: {self.use_huggingface}")
-
-        # Try OpenAI first (even if self.client is just the HTTP fallback flag)
-        from time import time
-        if self.client and not self._is_openai_temporarily_disabled():
-            try:
-                print("🚀 Attempting OpenAI API call...")
-                return self._generate_openai_response(subject, question)
-            except Exception as e:
-                print(f"❌ OpenAI failed: {type(e).__name__}: {e}")
-                # Capture reason in diagnostic field for front-end visibility
-                error_reason = str(e)
-                # Classify & potentially disable provider for cooldown
-                self._maybe_disable_openai(error_reason)
-        else:
-            if self._is_openai_temporarily_disabled():
-                error_reason = "OpenAI temporarily disabled after repeated errors"
-            else:
-                error_reason = "OpenAI client not initialized"
-
-        # Fallback to Hugging Face if enabled
-        if self.use_huggingface and self.huggingface_api_key:
-            try:
-                print("🚀 Attempting Hugging Face API call...")
-                return self._generate_huggingface_response(subject, question)
-            except Exception as e:
-                print(f"❌ Hugging Face failed: {str(e)}")
+        log.debug("generate_answer subject=%s qlen=%d openai=%s huggingface=%s",
+                  subject, len(question), self.client is not None, self.use_huggingface)
+
+        # Inputs that need no model at all
+        fast = self._fast_path(subject, question)
+        if fast is not None:
+            return fast
+
+        # Serve repeated (subject, question) pairs without another provider round-trip
+        cache_key = self._cache_key(subject, question)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            log.debug("Answer cache hit")
+            cached['cache_hit'] = 'exact'
+            return cached
+
+        # Near-duplicate phrasing of an already answered question
+        embedding = None
+        if self.semantic_cache is not None:
+            similar, embedding = self.semantic_cache.lookup(subject, question)
+            if similar is not None:
+                log.debug("Semantic cache hit")
+                similar['cache_hit'] = 'semantic'
+                return similar
+
+        # Walk the provider chain (SMARTLEARN_PROVIDER_ORDER); first answer wins
+        tried = []
+        error_reason = None
+        for name, generate, unavailable in self._providers:
+            reason = unavailable()
+            if reason is None:
+                tried.append(name)
+                try:
+                    log.debug("Attempting %s", name)
+                    result = generate(subject, question)
+                except Exception as e:
+                    log.warning("%s failed: %s: %s", name, type(e).__name__, e)
+                    reason = str(e)
+                else:
+                    if not result.get('fallback'):
+                        self._remember_answer(cache_key, subject, embedding, result)
+                    result['fallback_chain_tried'] = tried
+                    return result
+            # Capture the primary provider's reason for front-end visibility
+            if error_reason is None:
+                error_reason = reason
 
         # Final fallback to generic response
-        print("⚠️  All AI services failed, using fallback response")
+        log.warning("All AI services failed, using fallback response")
         fallback = self._generate_fallback_response(subject, question)
         # Surface diagnostic info (non-sensitive) if available
         if 'error_reason' not in fallback:
-            fallback['error_reason'] = error_reason if 'error_reason' in locals() else 'unknown'
+            fallback['error_reason'] = error_reason or 'no AI provider configured'
+        fallback['fallback_chain_tried'] = tried
         return fallback
 
+    def _build_provider_chain(self) -> List[Tuple[str, Callable[[str, str], Dict], Callable[[], Optional[str]]]]:
+        """(name, generate, unavailable) per provider, in SMARTLEARN_PROVIDER_ORDER.
+
+        unavailable() returns a reason string when the provider must be
+        skipped, or None when it can be tried.
+        """
+        registry = {
+            'openai': (self._openai_provider, self._openai_unavailable),
+            'huggingface': (self._generate_huggingface_response, self._huggingface_unavailable),
+        }
+        chain = []
+        for name in os.getenv('SMARTLEARN_PROVIDER_ORDER', 'openai,huggingface').split(','):
+            name = name.strip().lower()
+            if name in registry:
+                chain.append((name, *registry[name]))
+            elif name:
+                log.warning("Unknown provider %r in SMARTLEARN_PROVIDER_ORDER, ignoring", name)
+        return chain
+
+    def _openai_provider(self, subject: str, question: str) -> Dict:
+        """OpenAI answer with circuit-breaker bookkeeping."""
+        try:
+            result = self._generate_openai_response(subject, question)
+        except Exception as e:
+            # Classify & potentially disable provider for cooldown
+            self._maybe_disable_openai(str(e))
+            raise
+        self._record_openai_success()
+        return result
+
+    def _openai_unavailable(self) -> Optional[str]:
+        # self.client may just be the HTTP fallback flag; that still counts
+        if not self.client:
+            return "OpenAI client not initialized"
+        if self._is_openai_temporarily_disabled():
+            return "OpenAI temporarily disabled after repeated errors"
+        return None
+
+    def _huggingface_unavailable(self) -> Optional[str]:
+        if not (self.use_huggingface and self.huggingface_api_key):
+            return "Hugging Face not enabled"
+        return None
+
+    def _fast_path(self, subject: str, question: str) -> Optional[Dict]:
+        """Answer trivial inputs locally, or return None to use the providers.
+
+        Covers near-empty questions, bare arithmetic in Mathematics, and the
+        canonical practice questions whose answers we already hold.
+        """
+        text = ' '.join(question.split())
+        if len(text) < 3:
+            message = "Please ask a fuller question so I can explain the topic properly."
+            result = self._generate_fallback_response(subject, question, structured={
+                'key_points': [message],
+                'step_by_step': "Write out the whole question, e.g. 'What is photosynthesis?'",
+                'real_world_example': '',
+                'common_mistakes': [],
+                'additional_tips': []
+            })
+        elif (subject.lower() in ('mathematics', 'math', 'arithmetic')
+              and (value := _arithmetic_answer(text)) is not None):
+            result = self._generate_fallback_response(
+                subject, question, structured=self._rule_based_generation(subject, question, value))
+            result['fallback'] = False
+        else:
+            practice = self._PRACTICE_QUESTIONS.get(subject) or self._PRACTICE_QUESTIONS['Mathematics']
+            if practice['question'].lower().rstrip('?') not in text.lower():
+                return None
+            correct = practice['correct_answer']
+            result = self._generate_fallback_response(subject, question, structured={
+                'key_points': [f"{practice['question']} The answer is {correct}."],
+                'step_by_step': f"The correct answer is {correct}.",
+                'real_world_example': '',
+                'common_mistakes': [f"Choosing {option} instead of {correct}"
+                                    for option in practice['options'] if option != correct][:2],
+                'additional_tips': ["Review this topic in your notes and try a quiz to check your understanding."]
+            })
+            result['fallback'] = False
+
+        log.debug("Fast path answer for subject=%s", subject)
+        result['ai_provider'] = 'fast_path'
+        result['fast_path'] = True
+        return result
+
+    async def agenerate_answer(self, subject: str, question: str) -> Dict:
+        """Async twin of generate_answer for event-loop callers.
+
+        Same cascade, caches and circuit breaker as the sync path, but the
+        provider calls go over a shared HTTP/2 pool (see _async_http) instead
+        of holding a thread each, so one ASGI worker can keep hundreds of
+        students' requests in flight. Cache backends and embeddings may block,
+        so they run on a worker thread.
+        """
+        fast = self._fast_path(subject, question)
+        if fast is not None:
+            return fast
+
+        cache_key = self._cache_key(subject, question)
+        cached = await asyncio.to_thread(self.cache.get, cache_key)
+        if cached is not None:
+            log.debug("Answer cache hit")
+            cached['cache_hit'] = 'exact'
+            return cached
+
+        embedding = None
+        if self.semantic_cache is not None:
+            similar, embedding = await asyncio.to_thread(self.semantic_cache.lookup, subject, question)
+            if similar is not None:
+                log.debug("Semantic cache hit")
+                similar['cache_hit'] = 'semantic'
+                return similar
+
+        async_generators = {
+            'openai': self._aopenai_provider,
+            'huggingface': self._agenerate_huggingface_response,
+        }
+        tried = []
+        error_reason = None
+        for name, _, unavailable in self._providers:
+            reason = unavailable()
+            if reason is None:
+                tried.append(name)
+                try:
+                    log.debug("Attempting %s (async)", name)
+                    result = await async_generators[name](subject, question)
+                except Exception as e:
+                    log.warning("%s failed: %s: %s", name, type(e).__name__, e)
+                    reason = str(e)
+                else:
+                    if not result.get('fallback'):
+                        await asyncio.to_thread(self._remember_answer, cache_key, subject, embedding, result)
+                    result['fallback_chain_tried'] = tried
+                    return result
+            if error_reason is None:
+                error_reason = reason
+
+        log.warning("All AI services failed, using fallback response")
+        fallback = self._generate_fallback_response(subject, question)
+        if 'error_reason' not in fallback:
+            fallback['error_reason'] = error_reason or 'no AI provider configured'
+        fallback['fallback_chain_tried'] = tried
+        return fallback
+
+    async def _aopenai_provider(self, subject: str, question: str) -> Dict:
+        """Async _openai_provider."""
+        try:
+            result = await self._agenerate_openai_response(subject, question)
+        except Exception as e:
+            self._maybe_disable_openai(str(e))
+            raise
+        self._record_openai_success()
+        return result
+
+    async def agenerate_batch(self, items: List[Tuple[str, str]], max_concurrent: int = 20) -> List[Dict]:
+        """Answer many (subject, question) pairs concurrently, in input order.
+
+        max_concurrent bounds in-flight provider calls to stay under OpenAI
+        rate limits.
+        """
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        async def _answer(subject: str, question: str) -> Dict:
+            async with semaphore:
+                return await self.agenerate_answer(subject, question)
+
+        return await asyncio.gather(*(_answer(subject, question) for subject, question in items))
+
+    def generate_answer_batch(self, items: List[Tuple[str, str]]) -> List[Dict]:
+        """Answer many (subject, question) pairs on the I/O pool, in input order.
+
+        Sync counterpart of agenerate_batch. When OpenAI is available, uncached
+        questions are packed _OPENAI_BATCH_SIZE to a request; anything a batch
+        could not answer goes through generate_answer, with provider calls
+        overlapping across the pool's workers.
+        """
+        items = list(items)
+        results: List[Optional[Dict]] = [None] * len(items)
+
+        if self.client and not self._is_openai_temporarily_disabled():
+            pending = []
+            for i, (subject, question) in enumerate(items):
+                cached = self.cache.get(self._cache_key(subject, question))
+                if cached is not None:
+                    cached['cache_hit'] = 'exact'
+                    results[i] = cached
+                else:
+                    pending.append(i)
+
+            size = self._OPENAI_BATCH_SIZE
+            chunks = [pending[j:j + size] for j in range(0, len(pending), size)]
+            for chunk, answers in zip(chunks, self._io_pool.map(
+                    lambda chunk: self._try_openai_batch([items[i] for i in chunk]), chunks)):
+                for i, result in zip(chunk, answers):
+                    if result is not None:
+                        subject, question = items[i]
+                        self.cache.set(self._cache_key(subject, question), result)
+                        results[i] = result
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        for i, result in zip(missing, self._io_pool.map(lambda i: self.generate_answer(*items[i]), missing)):
+            results[i] = result
+        return results
+
+    def _try_openai_batch(self, items: List[Tuple[str, str]]) -> List[Optional[Dict]]:
+        """Batched OpenAI call that degrades to 'nothing answered' on error."""
+        if len(items) < 2:
+            # A lone question gains nothing from the batch contract
+            return [None] * len(items)
+        try:
+            results = self._generate_openai_response_batch(items)
+            self._record_openai_success()
+            return results
+        except Exception as e:
+            log.warning("OpenAI batch of %d failed: %s: %s", len(items), type(e).__name__, e)
+            self._maybe_disable_openai(str(e))
+            return [None] * len(items)
+
+    def _remember_answer(self, cache_key: str, subject: str, embedding, result: Dict):
+        """Store a successful provider answer in the exact and semantic caches."""
+        self.cache.set(cache_key, result)
+        if self.semantic_cache is not None:
+            self.semantic_cache.add(subject, embedding, result)
+
     def _generate_openai_response(self, subject: str, question: str) -> Dict:
         """Generate response using OpenAI with improved error handling"""
         try:
             # Create structured prompt
             prompt = self._create_teaching_prompt(subject, question)
-            print(f"📝 Generated prompt length: {len(prompt)} characters")
+            log.debug("Generated prompt length: %d characters", len(prompt))
 
-            # Dynamically select an available model (legacy SDK friendliness)
-            model = self._select_openai_model()
-            print(f"🔧 Using OpenAI model: {model}")
+            # Cheaper model and budget for simple questions
+            model, max_tokens = self._route_model(question)
+            log.debug("Using OpenAI model: %s (max_tokens=%d)", model, max_tokens)
 
             # Call OpenAI API with retry logic
             max_retries = 3
@@ -149,202 +1040,413 @@ class SmartLearnTutor:
                     response = self._call_openai_chat(
                         model=model,
                         messages=[
-                            {"role": "system", "content": (
-                                "You are SmartLearn, an expert tutor for African high school students. Provide clear, deep, engaging explanations aligned with KCSE/WAEC curricula. "
-                                "ALWAYS output a detailed explanation. First output a JSON object ONLY with the schema: {\\n"
-                                "  'key_points': string[], 'step_by_step': string, 'real_world_example': string, 'common_mistakes': string[], 'additional_tips': string[]\\n} "
-                                "No markdown, no prose outside JSON. After the JSON, add a markdown version starting with '---\nMARKDOWN:' for display." )},
+                            {"role": "system", "content": self._SYSTEM_PROMPT},
                             {"role": "user", "content": prompt}
                         ],
-                        max_tokens=1500,
+                        max_tokens=max_tokens,
                         temperature=0.7,
                         timeout=30
                     )
                     break  # Success, exit retry loop
                 except Exception as e:
-                    if attempt == max_retries - 1:
-                        raise e  # Last attempt failed
-                    print(
-                        f"⚠️  OpenAI attempt {attempt + 1} failed, retrying...")
-                    import time
-                    time.sleep(1)  # Wait before retry
-
-            print("✅ OpenAI API call successful!")
-
-            # Extract the response content
-            ai_response = self._get_response_text(response) or ""
-            print(f"📄 AI response length: {len(ai_response)} characters")
-
-            # Validate response
-            if not ai_response or len(ai_response.strip()) < 50:
-                raise Exception("AI response too short or empty")
-
-            # Phase 1: attempt to grab JSON block (first pass)
-            structured_obj = self._attempt_parse_with_repair(ai_response, subject, question)
-
-            if structured_obj is None:
-                # Final fallback to legacy parsing (string markdown)
-                answer_markdown = self._parse_ai_response(ai_response, subject)
-                answer_structured = None
-            else:
-                answer_structured = structured_obj
-                answer_markdown = self._structured_to_markdown(structured_obj)
-
-            # Generate practice question
-            practice_question = self._generate_practice_question(subject, question)
-
-            return {
-                'answer': answer_markdown,                 # markdown version (backward compatibility)
-                'answer_markdown': answer_markdown,        # explicit markdown
-                'answer_structured': answer_structured,    # dict or None
-                'quiz_question': practice_question['question'],
-                'quiz_options': practice_question['options'],
-                'quiz_answer': practice_question['correct_answer'],
-                'subject': subject,
-                'timestamp': datetime.now().isoformat(),
-                'ai_provider': 'openai',
-                'fallback': False if answer_structured or answer_markdown else True
-            }
+                    delay = self._openai_retry_delay(e, attempt, max_retries)
+                    if delay is None:
+                        raise e
+                    log.warning("OpenAI attempt %d failed (%s), retrying in %.1fs", attempt + 1, e, delay)
+                    time.sleep(delay)
+
+            log.debug("OpenAI API call successful")
+
+            return self._openai_answer_from_response(subject, question, response)
 
         except Exception as e:
-            print(f"❌ OpenAI response generation failed: {str(e)}")
+            log.error("OpenAI response generation failed: %s", e)
             raise e
 
-    def _generate_huggingface_response(self, subject: str, question: str) -> Dict:
-        """Generate response using Hugging Face Inference API with better error handling"""
+    async def _agenerate_openai_response(self, subject: str, question: str) -> Dict:
+        """Async _generate_openai_response over the REST API."""
         try:
-            print("🔄 Using Hugging Face Inference API")
+            prompt = self._create_teaching_prompt(subject, question)
+            model, max_tokens = self._route_model(question)
+            log.debug("Using OpenAI model: %s (max_tokens=%d, async)", model, max_tokens)
 
-            # Create a more structured prompt
-            prompt = f"""You are SmartLearn, an expert {subject} tutor for African high school students.
+            max_retries = 3
+            for attempt in range(max_retries):
+                try:
+                    response = await self._acall_openai_chat(
+                        model=model,
+                        messages=[
+                            {"role": "system", "content": self._SYSTEM_PROMPT},
+                            {"role": "user", "content": prompt}
+                        ],
+                        max_tokens=max_tokens,
+                        temperature=0.7,
+                        timeout=30
+                    )
+                    break
+                except Exception as e:
+                    delay = self._openai_retry_delay(e, attempt, max_retries)
+                    if delay is None:
+                        raise e
+                    log.warning("OpenAI attempt %d failed (%s), retrying in %.1fs", attempt + 1, e, delay)
+                    await asyncio.sleep(delay)
 
-Question: {question}
+            return self._openai_answer_from_response(subject, question, response)
 
-Provide a clear explanation with:
-1. Key concepts
-2. Simple explanation
-3. One example
-4. Study tip
+        except Exception as e:
+            log.error("OpenAI response generation failed: %s", e)
+            raise e
 
-Answer:"""
+    def _openai_retry_delay(self, error: Exception, attempt: int, max_retries: int) -> Optional[float]:
+        """Seconds to wait before the next OpenAI attempt, or None to give up."""
+        message = str(error).lower()
+        # Last attempt, or an error another try won't fix (auth, bad request, quota)
+        retryable = 'quota' not in message and any(token in message for token in _RETRYABLE)
+        if attempt == max_retries - 1 or not retryable:
+            return None
+        # Jittered, growing wait so rate-limited workers don't retry in lockstep
+        return random.uniform(2, 4) * (attempt + 1)
+
+    def _openai_answer_from_response(self, subject: str, question: str, response) -> Dict:
+        """Validate and parse a chat completion into the /ask payload."""
+        # Extract the response content
+        ai_response = self._get_response_text(response) or ""
+        log.debug("AI response length: %d characters", len(ai_response))
+
+        # Validate response
+        if not ai_response or len(ai_response.strip()) < 50:
+            raise Exception("AI response too short or empty")
+
+        # Phase 1: attempt to grab JSON block (first pass)
+        structured_obj = self._attempt_parse_with_repair(ai_response, subject, question)
+
+        if structured_obj is None:
+            # Final fallback to legacy parsing (string markdown)
+            answer_markdown = self._parse_ai_response(ai_response, subject)
+            answer_structured = None
+        else:
+            answer_structured = structured_obj
+            answer_markdown = self._structured_to_markdown(structured_obj)
 
-            headers = {"Authorization": f"Bearer {self.huggingface_api_key}"}
+        return self._build_openai_result(subject, question, answer_markdown, answer_structured)
 
-            # Try a more reliable model
-            models_to_try = [
-                "microsoft/DialoGPT-medium",
-                "gpt2",
-                "distilgpt2"
-            ]
+    def stream_answer(self, subject: str, question: str) -> Generator[str, None, Dict]:
+        """Yield answer text as it is generated; return the full answer dict.
 
+        OpenAI answers stream token by token. Cache hits and the Hugging Face /
+        rule-based fallbacks yield their whole answer at once. The returned dict
+        (StopIteration.value) has the same shape as generate_answer's and is the
+        authoritative answer if a stream broke off part-way.
+        """
+        fast = self._fast_path(subject, question)
+        if fast is not None:
+            yield fast['answer']
+            return fast
+
+        cache_key = self._cache_key(subject, question)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            cached['cache_hit'] = 'exact'
+            yield cached['answer']
+            return cached
 
-            ai_response = ""
-            for model in models_to_try:
-                try:
-                    payload = {
-                        "inputs": prompt,
-                        "parameters": {
-                            "max_length": 200,
-                            "temperature": 0.7,
-                            "do_sample": True
-                        }
-                    }
-
-                    response = requests.post(
-                        f"https://api-inference.huggingface.co/models/{model}",
-                        headers=headers,
-                        json=payload,
-                        timeout=20
-                    )
+        if self.client and not self._is_openai_temporarily_disabled():
+            model, max_tokens = self._route_model(question)
+            parts = []
+            try:
+                for delta in self._stream_openai_chat(
+                        model=model,
+                        messages=[
+                            {"role": "system", "content": self._STREAM_SYSTEM_PROMPT},
+                            {"role": "user", "content": self._create_teaching_prompt(subject, question)}
+                        ],
+                        max_tokens=max_tokens,
+                        temperature=0.7,
+                        timeout=30):
+                    parts.append(delta)
+                    yield delta
+            except Exception as e:
+                log.warning("OpenAI stream failed after %d chunks: %s", len(parts), e)
+                self._maybe_disable_openai(str(e))
+            else:
+                self._record_openai_success()
+                text = "".join(parts)
+                if len(text.strip()) >= 50:
+                    result = self._build_openai_result(
+                        subject, question, self._parse_ai_response(text, subject), None)
+                    self.cache.set(cache_key, result)
+                    return result
+
+        result = self.generate_answer(subject, question)
+        yield result['answer']
+        return result
+
+    def _stream_openai_chat(self, **kwargs) -> Iterator[str]:
+        """Streaming counterpart of _call_openai_chat; yields content deltas."""
+        if self.client and hasattr(self.client, 'chat') and hasattr(self.client.chat, 'completions'):
+            for chunk in self.client.chat.completions.create(stream=True, **kwargs):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            return
 
-                    print(f"📊 Model {model} - Status: {response.status_code}")
+        if hasattr(self._openai, 'ChatCompletion'):
+            for chunk in self._openai.ChatCompletion.create(stream=True, **kwargs):
+                content = chunk['choices'][0]['delta'].get('content') if chunk['choices'] else None
+                if content:
+                    yield content
+            return
 
-                    if response.status_code == 200:
-                        result = response.json()
-                        print(f"📊 Raw response: {result}")
+        headers, payload = self._openai_http_request(kwargs)
+        payload['stream'] = True
+        with self._http.post(_OPENAI_CHAT_URL, headers=headers, json=payload,
+                             timeout=kwargs.get('timeout', 30), stream=True) as resp:
+            if resp.status_code != 200:
+                raise Exception(f'HTTP {resp.status_code}: {resp.text[:300]}')
+            for line in resp.iter_lines():
+                if not line.startswith(b'data: '):
+                    continue
+                data = line[6:]
+                if data == b'[DONE]':
+                    break
+                choices = orjson.loads(data).get('choices') or []
+                content = choices[0].get('delta', {}).get('content') if choices else None
+                if content:
+                    yield content
+
+    def _build_openai_result(self, subject: str, question: str, answer_markdown: str,
+                             answer_structured: Optional[dict]) -> Dict:
+        """Assemble the /ask payload for an OpenAI-generated answer."""
+        # Generate practice question
+        practice_question = self._generate_practice_question(subject, question)
 
-                        if isinstance(result, list) and len(result) > 0:
-                            generated = result[0].get('generated_text', '')
-                            if generated and len(generated) > len(prompt):
-                                ai_response = generated.replace(
-                                    prompt, "").strip()
-                                if len(ai_response) > 20:
-                                    print(f"✅ Model {model} successful!")
-                                    break
+        return {
+            'answer': answer_markdown,                 # markdown version (backward compatibility)
+            'answer_markdown': answer_markdown,        # explicit markdown
+            'answer_structured': answer_structured,    # dict or None
+            'quiz_question': practice_question['question'],
+            'quiz_options': practice_question['options'],
+            'quiz_answer': practice_question['correct_answer'],
+            'subject': subject,
+            'timestamp': _now_iso(),
+            'ai_provider': 'openai',
+            'fallback': False if answer_structured or answer_markdown else True
+        }
 
-                except Exception as e:
-                    print(f"⚠️  Model {model} failed: {str(e)}")
-                    continue
+    def _generate_openai_response_batch(self, items: List[Tuple[str, str]]) -> List[Optional[Dict]]:
+        """Answer several (subject, question) pairs with a single chat completion.
 
-            # Validate response
-            if not ai_response or len(ai_response.strip()) < 20:
-                raise Exception(
-                    "No valid response from any Hugging Face model")
+        The system prompt and request overhead are paid once for the whole
+        chunk. Returns one result per item, in order; entries the model left
+        out or got wrong are None so the caller can retry them individually.
+        """
+        numbered = "\n".join(
+            f"{i}) [{subject}] {question}" for i, (subject, question) in enumerate(items, 1)
+        )
+        response = self._call_openai_chat(
+            model=self._select_openai_model(),
+            messages=[
+                {"role": "system", "content": self._BATCH_SYSTEM_PROMPT},
+                {"role": "user", "content": (
+                    f"Answer each of these {len(items)} numbered questions as a separate "
+                    f"object in 'answers', in the same order:\n{numbered}")}
+            ],
+            max_tokens=1500 * len(items),
+            temperature=0.7,
+            response_format={"type": "json_object"},
+            timeout=60
+        )
+        data = self._extract_json_from_text(self._get_response_text(response) or "") or {}
+        answers = data.get('answers') if isinstance(data.get('answers'), list) else []
+
+        results: List[Optional[Dict]] = []
+        for i, (subject, question) in enumerate(items):
+            obj = answers[i] if i < len(answers) else None
+            if self._validate_ai_answer_schema(obj):
+                results.append(self._build_openai_result(
+                    subject, question, self._structured_to_markdown(obj), obj))
+            else:
+                results.append(None)
+        return results
 
-            print(f"📄 Final AI response: {ai_response[:200]}...")
+    def _hf_payload(self, prompt: str) -> Dict:
+        return {
+            "inputs": prompt,
+            "parameters": {
+                "max_length": 200,
+                "temperature": 0.7,
+                "do_sample": True
+            }
+        }
 
-            # Parse and structure the response
-            structured_response = self._parse_ai_response(ai_response, subject)
+    def _call_hf_model(self, model: str, prompt: str, headers: Dict) -> str:
+        """Query one Hugging Face model; return its continuation ('' if unusable)."""
+        response = self._http.post(
+            f"https://api-inference.huggingface.co/models/{model}",
+            headers=headers,
+            json=self._hf_payload(prompt),
+            timeout=20
+        )
+        return self._hf_continuation(model, prompt, response.status_code, response.content)
+
+    async def _acall_hf_model(self, model: str, prompt: str, headers: Dict) -> str:
+        """Async _call_hf_model."""
+        response = await self._async_http().post(
+            f"https://api-inference.huggingface.co/models/{model}",
+            headers=headers,
+            json=self._hf_payload(prompt),
+            timeout=20
+        )
+        return self._hf_continuation(model, prompt, response.status_code, response.content)
+
+    def _hf_continuation(self, model: str, prompt: str, status_code: int, content: bytes) -> str:
+        """Extract the generated continuation from an inference API response body."""
+        log.debug("Hugging Face model %s status: %d", model, status_code)
+
+        if status_code == 200:
+            result = orjson.loads(content)
+            log.debug("Hugging Face raw response: %.200r", result)
+
+            if isinstance(result, list) and len(result) > 0:
+                generated = result[0].get('generated_text', '')
+                if generated and len(generated) > len(prompt):
+                    # Text-generation models echo the prompt, then continue it
+                    if generated.startswith(prompt):
+                        generated = generated[len(prompt):]
+                    return generated.strip()
+        return ""
 
-            # Generate practice question
-            practice_question = self._generate_practice_question(
-                subject, question)
+    def _generate_huggingface_response(self, subject: str, question: str) -> Dict:
+        """Generate response using Hugging Face Inference API with better error handling"""
+        try:
+            log.debug("Using Hugging Face Inference API")
 
-            return {
-                'answer': structured_response,
-                'quiz_question': practice_question['question'],
-                'quiz_options': practice_question['options'],
-                'quiz_answer': practice_question['correct_answer'],
-                'subject': subject,
-                'timestamp': datetime.now().isoformat(),
-                'ai_provider': 'huggingface'
+            prompt = self._huggingface_prompt(subject, question)
+            headers = {"Authorization": f"Bearer {self.huggingface_api_key}"}
+
+            # Race the candidate models; the first usable generation wins
+            futures = {
+                self._hf_pool.submit(self._call_hf_model, model, prompt, headers): model
+                for model in self._HF_MODELS
             }
+            ai_response = ""
+            try:
+                for future in as_completed(futures, timeout=25):
+                    model = futures[future]
+                    try:
+                        generated = future.result()
+                    except Exception as e:
+                        log.warning("Hugging Face model %s failed: %s", model, e)
+                        continue
+                    if len(generated) > 20:
+                        log.debug("Hugging Face model %s successful", model)
+                        ai_response = generated
+                        break
+            except FuturesTimeout:
+                log.warning("Hugging Face models timed out")
+            finally:
+                # Drop queued attempts; in-flight losers finish in the background
+                for future in futures:
+                    future.cancel()
+
+            return self._huggingface_result(subject, question, ai_response)
 
         except Exception as e:
-            print(f"❌ Hugging Face API error: {str(e)}")
+            log.error("Hugging Face API error: %s", e)
             raise e
 
-    def _create_teaching_prompt(self, subject: str, question: str) -> str:
-        """Create a structured prompt for AI teaching"""
+    async def _agenerate_huggingface_response(self, subject: str, question: str) -> Dict:
+        """Async _generate_huggingface_response; losing model requests are cancelled."""
+        try:
+            prompt = self._huggingface_prompt(subject, question)
+            headers = {"Authorization": f"Bearer {self.huggingface_api_key}"}
 
-        teaching_style = self.teaching_styles.get(
-            subject, self.teaching_styles['General'])
-        curriculum = self.curriculum_frameworks.get(
-            'KCSE', 'African high school curriculum')
+            tasks = {
+                asyncio.ensure_future(self._acall_hf_model(model, prompt, headers)): model
+                for model in self._HF_MODELS
+            }
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + 25
+            pending = set(tasks)
+            ai_response = ""
+            try:
+                while pending and not ai_response:
+                    done, pending = await asyncio.wait(pending, timeout=deadline - loop.time(),
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        log.warning("Hugging Face models timed out")
+                        break
+                    for task in done:
+                        model = tasks[task]
+                        if task.exception() is not None:
+                            log.warning("Hugging Face model %s failed: %s", model, task.exception())
+                            continue
+                        if not ai_response and len(task.result()) > 20:
+                            log.debug("Hugging Face model %s successful", model)
+                            ai_response = task.result()
+            finally:
+                for task in pending:
+                    task.cancel()
+
+            return self._huggingface_result(subject, question, ai_response)
 
-        prompt = f"""You are SmartLearn, an expert {subject} tutor for African high school students.
+        except Exception as e:
+            log.error("Hugging Face API error: %s", e)
+            raise e
 
-STUDENT QUESTION: {question}
+    def _huggingface_prompt(self, subject: str, question: str) -> str:
+        # Create a more structured prompt
+        return f"""You are SmartLearn, an expert {subject} tutor for African high school students.
 
-IMPORTANT: You MUST provide a COMPLETE and DETAILED explanation of the concept asked about. Do NOT give generic responses or acknowledgments. Actually TEACH the student about the topic.
+Question: {question}
 
-TEACHING REQUIREMENTS:
-- Subject: {subject}
-- Teaching Style: {teaching_style}
-- Curriculum: {curriculum}
-- Target Audience: African high school students (ages 14-18)
+Provide a clear explanation with:
+1. Key concepts
+2. Simple explanation
+3. One example
+4. Study tip
 
-RESPONSE STRUCTURE:
-You MUST structure your response exactly as follows:
+Answer:"""
 
-Key Points:
-- [List 3-4 main concepts related to the question]
+    def _huggingface_result(self, subject: str, question: str, ai_response: str) -> Dict:
+        """Validate the winning generation and build the /ask payload."""
+        # Validate response (ai_response is already stripped)
+        if len(ai_response) < 20:
+            raise Exception(
+                "No valid response from any Hugging Face model")
 
-Step-by-Step Explanation:
-[Provide a COMPLETE explanation of the concept. Break it down in simple, clear terms that a high school student can understand. Use examples and analogies.]
+        log.debug("Hugging Face response length: %d characters", len(ai_response))
 
-Real-world Example:
-[Give a specific, practical example relevant to African context or daily life]
+        # Parse and structure the response
+        structured_response = self._parse_ai_response(ai_response, subject)
 
-Common Mistakes:
-[Highlight 2-3 common errors students make when learning this concept and how to avoid them]
+        # Generate practice question
+        practice_question = self._generate_practice_question(
+            subject, question)
 
-Additional Tips:
-[Provide 1-2 helpful study tips or memory aids for this topic]
+        return {
+            'answer': structured_response,
+            'quiz_question': practice_question['question'],
+            'quiz_options': practice_question['options'],
+            'quiz_answer': practice_question['correct_answer'],
+            'subject': subject,
+            'timestamp': _now_iso(),
+            'ai_provider': 'huggingface'
+        }
 
-CRITICAL: Your response must be EDUCATIONAL and INFORMATIVE. Do not just acknowledge the question - actually explain the concept in detail. The student should learn something new from your response."""
+    def _build_prompt_frame(self, subject: str) -> Tuple[str, str]:
+        """Render the teaching prompt for a subject around the question slot"""
+        fields = {
+            'subject': subject,
+            'teaching_style': self.teaching_styles.get(subject) or self._general_style,
+            'curriculum': self.curriculum_frameworks.get('KCSE', 'African high school curriculum'),
+        }
+        head, _, tail = self._PROMPT_TEMPLATE.partition('{question}')
+        return head.format(**fields), tail.format(**fields)
 
-        return prompt
+    def _create_teaching_prompt(self, subject: str, question: str) -> str:
+        """Create a structured prompt for AI teaching"""
+        head, tail = self._prompt_by_subject.get(subject) or self._build_prompt_frame(subject)
+        return head + question + tail
 
     def _parse_ai_response(self, ai_response: str, subject: str) -> str:
         """Parse and clean the AI response with better formatting"""
@@ -356,7 +1458,7 @@ CRITICAL: Your response must be EDUCATIONAL and INFORMATIVE. Do not just acknowl
         cleaned_response = ai_response.strip()
 
         # Ensure proper structure
-        if not any(keyword in cleaned_response.lower() for keyword in ['key points', 'explanation', 'example']):
+        if not _STRUCTURE_KEYWORDS_RE.search(cleaned_response):
             # Add basic structure if missing
             cleaned_response = f"""**Key Points:**
 • Understanding {subject} concepts
@@ -370,16 +1472,8 @@ CRITICAL: Your response must be EDUCATIONAL and INFORMATIVE. Do not just acknowl
 • Ask questions when you don't understand something"""
 
         # Format markdown-style headers
-        cleaned_response = cleaned_response.replace(
-            '**Key Points:**', '### Key Points:')
-        cleaned_response = cleaned_response.replace(
-            '**Explanation:**', '### Step-by-Step Explanation:')
-        cleaned_response = cleaned_response.replace(
-            '**Real-world Example:**', '### Real-world Example:')
-        cleaned_response = cleaned_response.replace(
-            '**Common Mistakes:**', '### Common Mistakes:')
-        cleaned_response = cleaned_response.replace(
-            '**Additional Tips:**', '### Additional Tips:')
+        cleaned_response = _KEY_POINTS_RE.sub('### Key Points:', cleaned_response, count=1)
+        cleaned_response = _BOLD_HEADER_RE.sub(lambda m: _SECTION_HEADINGS[m.group(1)], cleaned_response)
 
         return cleaned_response
 
@@ -388,28 +1482,27 @@ CRITICAL: Your response must be EDUCATIONAL and INFORMATIVE. Do not just acknowl
         if not text or not text.strip():
             return None
 
-        # Try direct parse first
+        # Try direct parse first (orjson accepts str and is several times faster)
         try:
-            data = json.loads(text)
+            data = orjson.loads(text)
             if isinstance(data, dict):
                 return data
         except Exception:
             pass
 
         # Find first {...} block using regex (naive but effective for many cases)
-        match = re.search(r"\{[\s\S]*\}", text)
+        match = _RE_JSON_BLOCK.search(text)
         if match:
             candidate = match.group(0)
             try:
-                data = json.loads(candidate)
+                data = orjson.loads(candidate)
                 if isinstance(data, dict):
                     return data
             except Exception:
                 # Try to clean up common issues: trailing commas
-                cleaned = re.sub(r",\s*\}", "}", candidate)
-                cleaned = re.sub(r",\s*\]", "]", cleaned)
+                cleaned = _RE_TRAILING_COMMA.sub(r"\1", candidate)
                 try:
-                    data = json.loads(cleaned)
+                    data = orjson.loads(cleaned)
                     if isinstance(data, dict):
                         return data
                 except Exception:
@@ -433,68 +1526,38 @@ CRITICAL: Your response must be EDUCATIONAL and INFORMATIVE. Do not just acknowl
 
         for key, typ in schema.items():
             if key not in obj:
-                print(f"⚠️  Missing key in AI JSON: {key}")
+                log.warning("Missing key in AI JSON: %s", key)
                 return False
             if not isinstance(obj[key], typ):
-                print(f"⚠️  Key {key} has incorrect type: expected {typ}, got {type(obj[key])}")
+                log.warning("Key %s has incorrect type: expected %s, got %s", key, typ, type(obj[key]))
                 return False
 
         return True
 
     def _generate_practice_question(self, subject: str, topic: str) -> Dict:
         """Generate a practice question related to the topic"""
-
-        # Subject-specific practice questions
-        practice_questions = {
-            'Mathematics': {
-                'question': 'What is the value of x in the equation 2x + 5 = 13?',
-                'options': ['x = 3', 'x = 4', 'x = 5', 'x = 6'],
-                'correct_answer': 'x = 4'
-            },
-            'Physics': {
-                'question': 'What is the SI unit of force?',
-                'options': ['Newton (N)', 'Joule (J)', 'Watt (W)', 'Pascal (Pa)'],
-                'correct_answer': 'Newton (N)'
-            },
-            'Biology': {
-                'question': 'What is the powerhouse of the cell?',
-                'options': ['Mitochondria', 'Nucleus', 'Golgi apparatus', 'Endoplasmic reticulum'],
-                'correct_answer': 'Mitochondria'
-            },
-            'Chemistry': {
-                'question': 'What is the chemical symbol for gold?',
-                'options': ['Ag', 'Au', 'Fe', 'Cu'],
-                'correct_answer': 'Au'
-            },
-            'History': {
-                'question': 'What is the capital of Kenya?',
-                'options': ['Nairobi', 'Mombasa', 'Kisumu', 'Nakuru'],
-                'correct_answer': 'Nairobi'
-            },
-            'Geography': {
-                'question': 'What is the largest desert in Africa?',
-                'options': ['Sahara', 'Kalahari', 'Namib', 'Libyan'],
-                'correct_answer': 'Sahara'
-            },
-            'English': {
-                'question': 'Which of these is a proper noun?',
-                'options': ['city', 'London', 'river', 'mountain'],
-                'correct_answer': 'London'
-            }
-        }
-
         # Get question for the subject, or use general if not found
-        question_data = practice_questions.get(
-            subject, practice_questions['Mathematics'])
-
-        return question_data
+        question_data = self._PRACTICE_QUESTIONS.get(subject) or self._PRACTICE_QUESTIONS['Mathematics']
+        return {
+            'question': question_data['question'],
+            'options': list(question_data['options']),
+            'correct_answer': question_data['correct_answer']
+        }
 
     def _call_openai_chat(self, **kwargs):
         """Adapter to call OpenAI chat/completions across SDK versions.
 
-        Accepts model, messages, max_tokens, temperature, timeout.
-        Returns the raw response object.
+        Accepts model, messages, max_tokens, temperature, timeout, stream.
+        Returns the raw response object. With stream=True (or
+        SMARTLEARN_STREAM_OPENAI=1) the completion is streamed and reassembled,
+        so no single read waits on the whole generation (proxies such as
+        Cloudflare cut idle responses at ~100s); the result has the usual
+        choices[0].message.content shape.
         """
+        if kwargs.pop('stream', self._stream_openai):
+            content = "".join(self._stream_openai_chat(**kwargs))
+            return {'choices': [{'message': {'role': 'assistant', 'content': content}}]}
+
         # Prefer calling through the client if it's a proper SDK client
         try:
             if self.client and hasattr(self.client, 'chat') and hasattr(self.client.chat, 'completions'):
@@ -504,37 +1567,59 @@ CRITICAL: Your response must be EDUCATIONAL and INFORMATIVE. Do not just acknowl
 
         # Try top-level SDK calls if available
         try:
-            if hasattr(openai, 'ChatCompletion'):
-                return openai.ChatCompletion.create(**kwargs)
+            if hasattr(self._openai, 'ChatCompletion'):
+                return self._openai.ChatCompletion.create(**kwargs)
         except Exception:
             pass
 
         # As a robust fallback, call the OpenAI REST API directly
-        api_key = getattr(self, 'openai_api_key', None) or os.getenv('OPENAI_API_KEY')
+        headers, payload = self._openai_http_request(kwargs)
+
+        from requests import RequestException
+        try:
+            resp = self._http.post(_OPENAI_CHAT_URL, headers=headers, json=payload, timeout=kwargs.get('timeout', 30))
+            if resp.status_code == 200:
+                return orjson.loads(resp.content)
+            else:
+                snippet = resp.text[:300]
+                raise Exception(f'HTTP {resp.status_code}: {snippet}')
+        except RequestException as e:
+            raise Exception(f'Network error calling OpenAI: {e}')
+
+    async def _acall_openai_chat(self, **kwargs):
+        """Async _call_openai_chat; always goes over the REST API.
+
+        At most LLM_MAX_ASYNC calls are in flight per event loop, however many
+        requests are awaiting answers, so bursts queue here rather than
+        tripping OpenAI's rate limit.
+        """
+        import httpx
+        headers, payload = self._openai_http_request(kwargs)
+        client = self._async_http()
+        try:
+            async with self._llm_sem:
+                resp = await client.post(_OPENAI_CHAT_URL, headers=headers, json=payload,
+                                         timeout=kwargs.get('timeout', 30))
+        except httpx.HTTPError as e:
+            raise Exception(f'Network error calling OpenAI: {e}')
+        if resp.status_code == 200:
+            return orjson.loads(resp.content)
+        raise Exception(f'HTTP {resp.status_code}: {resp.text[:300]}')
+
+    def _openai_http_request(self, kwargs: Dict) -> Tuple[Dict, Dict]:
+        """(headers, payload) for a direct chat/completions POST."""
+        api_key = self.openai_api_key
         if not api_key:
             raise Exception('OPENAI_API_KEY not set for HTTP fallback')
-
-        url = 'https://api.openai.com/v1/chat/completions'
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        }
         payload = {
             'model': kwargs.get('model'),
             'messages': kwargs.get('messages'),
             'max_tokens': kwargs.get('max_tokens'),
             'temperature': kwargs.get('temperature', 0.7)
         }
-
-        try:
-            resp = requests.post(url, headers=headers, json=payload, timeout=kwargs.get('timeout', 30))
-            if resp.status_code == 200:
-                return resp.json()
-            else:
-                snippet = resp.text[:300]
-                raise Exception(f'HTTP {resp.status_code}: {snippet}')
-        except requests.RequestException as e:
-            raise Exception(f'Network error calling OpenAI: {e}')
+        if kwargs.get('response_format'):
+            payload['response_format'] = kwargs['response_format']
+        return {'Authorization': f'Bearer {api_key}'}, payload
 
     def _get_response_text(self, resp) -> Optional[str]:
         """Normalize different OpenAI response shapes to a text string."""
@@ -578,35 +1663,53 @@ CRITICAL: Your response must be EDUCATIONAL and INFORMATIVE. Do not just acknowl
 
     def _select_openai_model(self) -> str:
         """Select an OpenAI model name based on environment / legacy usage."""
-        # Prefer environment override
-        env_model = os.getenv('OPENAI_MODEL')
-        if env_model:
-            return env_model
-        # Fallback priority list (older API first for compatibility)
-        return 'gpt-3.5-turbo'
+        # OPENAI_MODEL override, else gpt-3.5-turbo for legacy compatibility (see reload_config)
+        return self._openai_model
+
+    @staticmethod
+    def _is_simple_question(question: str) -> bool:
+        """Short recall-style question with no request for reasoning."""
+        return len(question) < 60 and not _COMPLEX_QUESTION_RE.search(question)
+
+    def _route_model(self, question: str) -> Tuple[str, int]:
+        """Pick (model, max_tokens) for a question.
+
+        Simple questions go to the cheaper OPENAI_MODEL_LIGHT with a smaller
+        completion budget; anything long or asking for reasoning keeps the
+        full model.
+        """
+        if self._is_simple_question(question):
+            self.route_stats['light'] += 1
+            return self._openai_model_light, 500
+        self.route_stats['full'] += 1
+        return self._select_openai_model(), 1500
+
+    def _cache_key(self, subject: str, question: str) -> str:
+        """Answer-cache key, scoped to the model the question routes to."""
+        if self._is_simple_question(question):
+            model = self._openai_model_light
+        else:
+            model = self._select_openai_model()
+        return self.cache.make_key(subject, question, model)
 
     def _attempt_parse_with_repair(self, raw: str, subject: str, question: str) -> Optional[dict]:
         """Try to parse JSON (first block) and repair simple issues (quotes, trailing commas)."""
         if not raw:
             return None
         candidate = self._extract_json_from_text(raw)
-        if candidate and self._validate_ai_answer_schema(candidate):
-            return candidate
+        if candidate is not None:
+            # Parsed cleanly; quote/comma repair can't fix a wrong shape
+            return candidate if self._validate_ai_answer_schema(candidate) else None
         # Attempt mild repair: replace single quotes around keys with double quotes
         try:
-            # Only operate on extracted candidate if present
-            if candidate is None:
-                # naive brace extraction
-                m = re.search(r"\{[\s\S]*?\}", raw)
-                if not m:
-                    return None
-                text_block = m.group(0)
-            else:
-                text_block = json.dumps(candidate)
-            repaired = re.sub(r"'(\w+)':", r'"\1":', text_block)
-            repaired = re.sub(r"'([^']*)'", lambda m: '"'+m.group(1)+'"', repaired)
-            repaired = re.sub(r",\s*([}\]])", r"\1", repaired)
-            parsed = json.loads(repaired)
+            # naive brace extraction
+            m = _RE_JSON_BLOCK_NONGREEDY.search(raw)
+            if not m:
+                return None
+            repaired = _RE_SQ_KEY.sub(r'"\1":', m.group(0))
+            repaired = _RE_SQ_VAL.sub(r'"\1"', repaired)
+            repaired = _RE_TRAILING_COMMA.sub(r"\1", repaired)
+            parsed = orjson.loads(repaired)
             if self._validate_ai_answer_schema(parsed):
                 return parsed
         except Exception:
@@ -617,35 +1720,25 @@ CRITICAL: Your response must be EDUCATIONAL and INFORMATIVE. Do not just acknowl
         """Convert structured dict schema to markdown display."""
         if not data or not isinstance(data, dict):
             return ""
-        lines = []
-        kp = data.get('key_points') or []
-        if kp:
-            lines.append('### Key Points:')
-            for item in kp:
-                lines.append(f"- {item}")
-        step = data.get('step_by_step')
-        if step:
-            lines.append('\n### Step-by-Step Explanation:')
-            lines.append(step)
-        ex = data.get('real_world_example')
-        if ex:
-            lines.append('\n### Real-world Example:')
-            lines.append(ex)
-        cm = data.get('common_mistakes') or []
-        if cm:
-            lines.append('\n### Common Mistakes:')
-            for item in cm:
-                lines.append(f"- {item}")
-        tips = data.get('additional_tips') or []
-        if tips:
-            lines.append('\n### Additional Tips:')
-            for item in tips:
-                lines.append(f"- {item}")
-        return "\n".join(lines).strip()
-
-    def _generate_fallback_response(self, subject: str, question: str) -> Dict:
+        sections = []
+        if kp := data.get('key_points'):
+            sections.append('### Key Points:\n' + '\n'.join(f"- {item}" for item in kp))
+        if step := data.get('step_by_step'):
+            sections.append('### Step-by-Step Explanation:\n' + step)
+        if ex := data.get('real_world_example'):
+            sections.append('### Real-world Example:\n' + ex)
+        if cm := data.get('common_mistakes'):
+            sections.append('### Common Mistakes:\n' + '\n'.join(f"- {item}" for item in cm))
+        if tips := data.get('additional_tips'):
+            sections.append('### Additional Tips:\n' + '\n'.join(f"- {item}" for item in tips))
+        # A blank line between sections, same as the old '\n###' prefixes
+        return "\n\n".join(sections).strip()
+
+    def _generate_fallback_response(self, subject: str, question: str,
+                                    structured: Optional[dict] = None) -> Dict:
         """Generate fallback response when AI is unavailable"""
-        structured = self._rule_based_generation(subject, question)
+        if structured is None:
+            structured = self._rule_based_generation(subject, question)
         markdown = self._structured_to_markdown(structured)
         practice_question = self._generate_practice_question(subject, question)
         return {
@@ -656,35 +1749,86 @@ CRITICAL: Your response must be EDUCATIONAL and INFORMATIVE. Do not just acknowl
             'quiz_options': practice_question['options'],
             'quiz_answer': practice_question['correct_answer'],
             'subject': subject,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': _now_iso(),
             'fallback': True
         }
 
     # ---------------- internal helpers for provider cooldown & rule-based fallback -------------
     def _maybe_disable_openai(self, error_reason: str):
-        from time import time
+        """Record an OpenAI failure and open the circuit when warranted.
+
+        Quota and auth errors open it outright for a long cooldown. Other
+        errors count towards a sliding window: CIRCUIT_FAILURES within
+        CIRCUIT_WINDOW seconds opens it for the current cooldown. A failed
+        half-open trial re-opens it with the cooldown doubled.
+        """
         if not error_reason:
             return
-        if 'insufficient_quota' in error_reason or 'quota' in error_reason.lower():
-            # Disable for 30 minutes to avoid repeated failing calls
-            self._openai_disabled_until = time() + 1800
-            print("⏸️  Disabling OpenAI for 30 minutes due to quota errors")
-        elif 'HTTP 401' in error_reason or 'invalid_api_key' in error_reason.lower():
-            # Disable until restart for authentication issues
-            self._openai_disabled_until = time() + 3600
-            print("⏸️  Disabling OpenAI for 60 minutes due to auth errors")
+        now = time.time()
+        with self._circuit_lock:
+            if 'insufficient_quota' in error_reason or 'quota' in error_reason.lower():
+                # Disable for 30 minutes to avoid repeated failing calls
+                self._open_circuit(now + 1800)
+                log.warning("Disabling OpenAI for 30 minutes due to quota errors")
+            elif 'HTTP 401' in error_reason or 'invalid_api_key' in error_reason.lower():
+                # Disable until restart for authentication issues
+                self._open_circuit(now + 3600)
+                log.warning("Disabling OpenAI for 60 minutes due to auth errors")
+            elif self._circuit_state == 'half-open':
+                self._circuit_cooldown = min(self._circuit_cooldown * 2, 1800)
+                self._open_circuit(now + self._circuit_cooldown)
+                log.warning("OpenAI trial request failed, circuit re-opened for %ds", self._circuit_cooldown)
+            else:
+                self._err_times.append(now)
+                recent = sum(1 for t in self._err_times if now - t < self.CIRCUIT_WINDOW)
+                if recent >= self.CIRCUIT_FAILURES and self._circuit_state == 'closed':
+                    self._open_circuit(now + self._circuit_cooldown)
+                    log.warning("%d OpenAI failures in %ds, circuit opened for %ds",
+                                recent, self.CIRCUIT_WINDOW, self._circuit_cooldown)
+
+    def _open_circuit(self, until: float):
+        self._circuit_state = 'open'
+        self._openai_disabled_until = until
+
+    def _record_openai_success(self):
+        """Close the circuit after a successful OpenAI call."""
+        if self._circuit_state == 'closed' and not self._err_times:
+            return
+        with self._circuit_lock:
+            if self._circuit_state != 'closed':
+                log.info("OpenAI recovered, circuit closed")
+            self._circuit_state = 'closed'
+            self._circuit_cooldown = self.CIRCUIT_COOLDOWN
+            self._openai_disabled_until = None
+            self._err_times.clear()
 
     def _is_openai_temporarily_disabled(self) -> bool:
-        from time import time
-        if self._openai_disabled_until is None:
+        """True while the circuit is open, or while a half-open trial is in flight.
+
+        The first caller after the cooldown becomes the single trial request;
+        a trial that never reports back is superseded after CIRCUIT_WINDOW.
+        """
+        if self._circuit_state == 'closed':
+            return False
+        now = time.time()
+        with self._circuit_lock:
+            if self._circuit_state == 'open':
+                if now < self._openai_disabled_until:
+                    return True
+            elif self._circuit_state == 'half-open':
+                if now - self._circuit_trial_at < self.CIRCUIT_WINDOW:
+                    return True
+            else:
+                return False
+            self._circuit_state = 'half-open'
+            self._circuit_trial_at = now
             return False
-        if time() < self._openai_disabled_until:
-            return True
-        self._openai_disabled_until = None
-        return False
 
-    def _rule_based_generation(self, subject: str, question: str) -> dict:
-        """Produce a structured educational answer without external AI (core fields)."""
+    def _rule_based_generation(self, subject: str, question: str, result=None) -> dict:
+        """Produce a structured educational answer without external AI (core fields).
+
+        `result` is the question's arithmetic value when the caller already has it.
+        """
         key_points = []
         step = []
         example = ""
@@ -693,14 +1837,12 @@ CRITICAL: Your response must be EDUCATIONAL and INFORMATIVE. Do not just acknowl
 
         q_lower = question.lower().strip()
         # Simple arithmetic evaluator
-        import re as _re
         if subject.lower() in ('mathematics','math','arithmetic'):
-            expr = _re.sub(r"[^0-9+\-*/().^ ]","", q_lower)
+            expr = _RE_MATH_CLEAN.sub("", q_lower)
             expr = expr.replace('^','**')
-            result = None
             try:
-                if expr and any(ch.isdigit() for ch in expr):
-                    result = eval(expr, {"__builtins__": {}}, {})  # safe limited eval
+                if result is None and expr and len(expr) <= _MAX_ARITHMETIC_LEN and any(ch.isdigit() for ch in expr):
+                    result = _safe_eval(expr)
             except Exception:
                 pass
             key_points = ["Addition combines quantities", "Basic arithmetic is foundational"]
@@ -731,11 +1873,15 @@ CRITICAL: Your response must be EDUCATIONAL and INFORMATIVE. Do not just acknowl
 
 # Global instance - will be initialized when needed
 ai_tutor = None
+_ai_tutor_lock = threading.Lock()
 
 
 def get_ai_tutor():
     """Get or create AI tutor instance"""
     global ai_tutor
     if ai_tutor is None:
-        ai_tutor = SmartLearnTutor()
+        # Concurrent first requests must not each build a tutor (and its thread pools)
+        with _ai_tutor_lock:
+            if ai_tutor is None:
+                ai_tutor = SmartLearnTutor()
     return ai_tutor
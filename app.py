@@ -1,51 +1,101 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, jsonify, session, g, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from flask_compress import Compress
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+import msgspec
+import orjson
 import os
 import logging
 from dotenv import load_dotenv
 from ai_tutor import get_ai_tutor
 from student_session import StudentSession
-from quiz_generator import get_quiz_generator
-import uuid
+from session_store import session_store_from_env
+from quiz_generator import get_quiz_generator, AVAILABLE_QUIZZES, DIFFICULTY_LEVELS, QUIZ_TYPES
+from http_pool import shared_session, mount_host
+from request_schemas import AskRequest, GenerateQuizRequest, SubmitQuizRequest, QuizResultRequest
+import secrets
 from datetime import datetime
-import requests
 from payment_store import (
     init_payment_db,
     create_payment,
     update_payment_status,
     get_payment,
-    list_payments,
+    list_payments_page,
+    payments_revision,
     STATUS_COMPLETED,
     STATUS_FAILED,
     STATUS_PENDING
 )
+import base64
 import hmac
 import hashlib
-
-# Firebase imports with error handling
-try:
-    from firebase_config import (
-        initialize_firebase, require_auth, optional_auth,
-        get_user_data, create_user_profile, save_quiz_result,
-        save_learning_session, is_firebase_available
-    )
-    FIREBASE_ENABLED = True
-except ImportError:
-    FIREBASE_ENABLED = False
-    print("⚠️ Firebase not available - running without authentication")
-
-# Load environment variables
-load_dotenv()
+from bisect import bisect_right
+from functools import lru_cache, wraps
+from typing import Optional
+import threading
+from cachetools import TTLCache
+
+# Load environment variables (deployments that inject env directly set SMARTLEARN_SKIP_DOTENV=1)
+if os.getenv('SMARTLEARN_SKIP_DOTENV') != '1':
+    load_dotenv()
+
+# Firebase imports with error handling; FIREBASE_ENABLED=false skips Firebase
+# entirely, including the Admin SDK import on cold start
+FIREBASE_ENABLED = os.getenv('FIREBASE_ENABLED', 'true').lower() == 'true'
+if FIREBASE_ENABLED:
+    try:
+        from firebase_config import (
+            initialize_firebase, require_auth, optional_auth,
+            get_user_data, create_user_profile, save_quiz_result,
+            save_learning_session, is_firebase_available, USER_PROFILE_FIELDS
+        )
+    except ImportError:
+        FIREBASE_ENABLED = False
+        print("⚠️ Firebase not available - running without authentication")
 
 APP_PHASE = os.getenv('APP_PHASE', 'Phase 5 - Payments & Subscription')
 APP_VERSION = os.getenv('APP_VERSION', '0.1.0')
 
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonify / request.get_json backed by orjson's C encoder and decoder.
+
+    Keys stay sorted as with the stdlib provider; types orjson doesn't know
+    (Decimal, objects with __html__, ...) go through Flask's default hook.
+    Unlike the stdlib provider, datetimes serialize as ISO 8601.
+    """
+
+    _OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(self, obj, **kwargs) -> str:
+        return self._encode(obj, pretty=bool(kwargs.get('indent'))).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        # Hand bytes straight to the response; no str round trip
+        return self._app.response_class(
+            self._encode(obj, pretty, orjson.OPT_APPEND_NEWLINE), mimetype=self.mimetype)
+
+    def _encode(self, obj, pretty: bool, extra: int = 0) -> bytes:
+        option = self._OPTIONS | extra | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, default=self.default, option=option)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = os.getenv('SECRET_KEY', 'dev-secret-key-123')
 
 # Configure Flask-Session
 app.config['SESSION_TYPE'] = 'filesystem'
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour
 
+# zstd/brotli/gzip for JSON, HTML and static assets (SSE streams are left alone)
+Compress(app)
+
 # ----------------------------------------------------------------------------
 # Logging Configuration
 # ----------------------------------------------------------------------------
@@ -69,8 +119,81 @@ if FIREBASE_ENABLED:
 else:
     logger.info("Running without Firebase authentication")
 
-# In-memory storage for student sessions (in production, use Redis or database)
-student_sessions = {}
+# Student sessions: per-process memory, or Redis when SESSION_BACKEND=redis
+session_store = session_store_from_env(ttl=app.config['PERMANENT_SESSION_LIFETIME'])
+
+# Rate limits on the routes that call OpenAI, so one client can't drain the
+# shared RPM budget. Counters live in RATELIMIT_STORAGE_URI (e.g. REDIS_URL)
+# when set, so every worker enforces the same budget; otherwise per process.
+ASK_RATE_LIMIT = os.getenv('ASK_RATE_LIMIT', '20/minute')
+QUIZ_RATE_LIMIT = os.getenv('QUIZ_RATE_LIMIT', '5/minute')
+# Caps a single address however many sessions it opens (school networks share IPs)
+IP_RATE_LIMIT = os.getenv('IP_RATE_LIMIT', '120/minute')
+
+
+def rate_limit_key() -> str:
+    """Bucket by student session, falling back to the client IP for new visitors"""
+    return session.get('student_session_id') or get_remote_address()
+
+
+limiter = Limiter(
+    rate_limit_key,
+    app=app,
+    storage_uri=os.getenv('RATELIMIT_STORAGE_URI', 'memory://'),
+    headers_enabled=True,
+    # Keep serving if the limiter's storage is unreachable
+    swallow_errors=True,
+)
+ip_limit = limiter.shared_limit(IP_RATE_LIMIT, scope='ip', key_func=get_remote_address)
+
+
+@app.errorhandler(429)
+def rate_limited(error):
+    # Retry-After is added by the limiter (headers_enabled)
+    return jsonify({'error': 'Too many requests, please slow down and try again shortly',
+                    'limit': str(error.description)}), 429
+
+
+def _static_json(payload) -> str:
+    """Serialize a payload that never changes at runtime the way jsonify would."""
+    return app.json.dumps(payload) + '\n'
+
+
+@lru_cache(maxsize=None)
+def _error_body(fields: tuple) -> bytes:
+    return _static_json(dict(fields)).encode()
+
+
+def error_response(status: int, **payload) -> Response:
+    """A fixed JSON error, e.g. error_response(404, error='Quiz not found').
+
+    Each distinct body is serialized once. The Response itself is built per
+    request because after_request hooks (rate-limit headers, the session
+    cookie) add request-specific headers to it.
+    """
+    return Response(_error_body(tuple(payload.items())), status=status, mimetype='application/json')
+
+
+# Bodies for endpoints whose content is fixed once the app starts
+_AVAILABLE_QUIZZES_JSON = _static_json({
+    'available_quizzes': AVAILABLE_QUIZZES,
+    'difficulty_levels': DIFFICULTY_LEVELS,
+    'quiz_types': QUIZ_TYPES
+}).encode()
+_AVAILABLE_QUIZZES_ETAG = hashlib.blake2b(_AVAILABLE_QUIZZES_JSON, digest_size=8).hexdigest()
+# Accepted /quiz/generate options; anything else falls back to the default
+_DIFFICULTIES = frozenset(DIFFICULTY_LEVELS)
+_QUIZ_TYPES = frozenset(QUIZ_TYPES)
+# The catalog only changes with a deploy; browsers and CDNs may keep it a day
+_AVAILABLE_QUIZZES_MAX_AGE = 86400
+# /health: only active_sessions varies (and sorts first), so splice it in
+_HEALTH_JSON = _static_json({
+    'status': 'healthy',
+    'service': 'SmartLearn AI Tutor',
+    'phase': APP_PHASE,
+    'version': APP_VERSION
+})
+_HEALTH_JSON_TAIL = ',' + _HEALTH_JSON[1:]
 
 
 @app.route('/')
@@ -80,34 +203,26 @@ def index():
 
 
 @app.route('/ask', methods=['POST'])
+@limiter.limit(ASK_RATE_LIMIT)
+@ip_limit
 def ask_tutor():
     """AI-powered tutor route using OpenAI GPT-4o with session tracking"""
-    try:
-        data = request.get_json()
-        question = data.get('question', '')
-        subject = data.get('subject', 'General')
-
-        # Validate input
-        if not question.strip():
-            return jsonify({'error': 'Please provide a question'}), 400
-
-        # Get or create student session
-        student_session = get_or_create_student_session()
+    body, error = parse_body(AskRequest)
+    if error:
+        return error
+    question, subject = body.question, body.subject
 
-        # Generate AI-powered response
-        ai_tutor_instance = get_ai_tutor()
-        response = ai_tutor_instance.generate_answer(subject, question)
-
-        # Track the question in student session
-        student_session.add_question(subject, question, response)
-
-        # Add session data to response
-        response['session_id'] = student_session.session_id
-        response['learning_tip'] = get_learning_tip(student_session, subject)
+    # Validate input
+    if not question.strip():
+        return error_response(400, error='Please provide a question')
 
-        return jsonify(response)
+    # Get or create student session
+    student_session = get_or_create_student_session()
 
-    except Exception as e:
+    # Generate AI-powered response; only a failure here earns the fallback answer
+    try:
+        response = get_ai_tutor().generate_answer(subject, question)
+    except Exception:
         logger.exception("Error in ask_tutor route")
         # Fallback response
         fallback_response = {
@@ -119,48 +234,111 @@ def ask_tutor():
         }
         return jsonify(fallback_response)
 
+    # Track the question in student session
+    student_session.add_question(subject, question, response)
+
+    # Add session data to response
+    response['session_id'] = student_session.session_id
+    response['learning_tip'] = get_learning_tip(student_session, subject)
+
+    return jsonify(response)
+
+
+@app.route('/ask/stream', methods=['POST'])
+@limiter.limit(ASK_RATE_LIMIT)
+@ip_limit
+def ask_tutor_stream():
+    """Server-sent events variant of /ask.
+
+    Emits `data: {"delta": ...}` events as the answer is generated, then a
+    final `event: done` whose data is the full /ask payload; clients should
+    render that answer in place of the accumulated deltas.
+    """
+    body, error = parse_body(AskRequest)
+    if error:
+        return error
+    question, subject = body.question, body.subject
+
+    if not question.strip():
+        return error_response(400, error='Please provide a question')
+
+    student_session = get_or_create_student_session()
+    ai_tutor_instance = get_ai_tutor()
+
+    def events():
+        stream = ai_tutor_instance.stream_answer(subject, question)
+        try:
+            while True:
+                yield f"data: {app.json.dumps({'delta': next(stream)})}\n\n"
+        except StopIteration as done:
+            response = done.value
+
+        student_session.add_question(subject, question, response)
+        # after_request already ran before the stream started; persist the new question
+        session_store.save(student_session)
+        response['session_id'] = student_session.session_id
+        response['learning_tip'] = get_learning_tip(student_session, subject)
+        yield f"event: done\ndata: {app.json.dumps(response)}\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 
 @app.route('/quiz/generate', methods=['POST'])
+@limiter.limit(QUIZ_RATE_LIMIT)
+@ip_limit
 def generate_quiz():
     """Generate a new AI-powered quiz"""
+    body, error = parse_body(GenerateQuizRequest)
+    if error:
+        return error
+
     try:
-        data = request.get_json()
-        subject = data.get('subject', 'General')
-        topic = data.get('topic', 'General')
-        difficulty = data.get('difficulty', 'intermediate')
-        quiz_type = data.get('quiz_type', 'concept_check')
-        num_questions = data.get('num_questions', 5)
+        subject, topic = body.subject, body.topic
+        difficulty, quiz_type = body.difficulty, body.quiz_type
+        num_questions = body.num_questions
 
         # Validate inputs
         if not subject or not topic:
-            return jsonify({'error': 'Subject and topic are required'}), 400
+            return error_response(400, error='Subject and topic are required')
 
-        if difficulty not in ['beginner', 'intermediate', 'advanced']:
+        if difficulty not in _DIFFICULTIES:
             difficulty = 'intermediate'
 
-        if quiz_type not in ['concept_check', 'problem_solving', 'critical_thinking', 'application']:
+        if quiz_type not in _QUIZ_TYPES:
             quiz_type = 'concept_check'
 
-        if not isinstance(num_questions, int) or num_questions < 3 or num_questions > 10:
+        if num_questions < 3 or num_questions > 10:
             num_questions = 5
 
         # Get session (needed for gating)
         student_session = get_or_create_student_session()
 
-        # Enforce free plan quiz generation limit unless premium
-        if not student_session.can_generate_quiz():
-            remaining = student_session.remaining_free_quizzes()
-            return jsonify({
-                'success': False,
-                'error': 'Quiz generation limit reached for Free plan. Please upgrade to Premium to unlock unlimited quizzes.',
-                'plan': 'Free',
-                'remaining_free_quizzes': remaining
-            }), 402  # Payment Required semantic
+        # Enforce free plan quiz generation limit unless premium. The slot is
+        # reserved atomically in the session store, so concurrent requests
+        # (possibly on other workers) can't both take the last free quiz.
+        quota_key = None
+        if not student_session.is_premium:
+            quota_key = f'quiz_generations:{student_session.session_id}'
+            used = session_store.reserve_quota(quota_key, student_session.quiz_generations)
+            if used > student_session.free_quiz_limit:
+                session_store.release_quota(quota_key)
+                return jsonify({
+                    'success': False,
+                    'error': 'Quiz generation limit reached for Free plan. Please upgrade to Premium to unlock unlimited quizzes.',
+                    'plan': 'Free',
+                    'remaining_free_quizzes': max(student_session.free_quiz_limit - used + 1, 0)
+                }), 402  # Payment Required semantic
 
         # Generate quiz (allowed)
         quiz_generator_instance = get_quiz_generator()
-        quiz_data = quiz_generator_instance.generate_quiz(
-            subject, topic, difficulty, quiz_type, num_questions)
+        try:
+            quiz_data = quiz_generator_instance.generate_quiz(
+                subject, topic, difficulty, quiz_type, num_questions)
+        except Exception:
+            if quota_key:
+                session_store.release_quota(quota_key)
+            raise
 
         # Get quiz statistics
         quiz_stats = quiz_generator_instance.get_quiz_statistics(quiz_data)
@@ -176,7 +354,7 @@ def generate_quiz():
 
     except Exception as e:
         logger.exception("Error generating quiz")
-        return jsonify({'error': 'Failed to generate quiz'}), 500
+        return error_response(500, error='Failed to generate quiz')
 
 
 @app.route('/quiz/<quiz_id>/start', methods=['POST'])
@@ -188,7 +366,7 @@ def start_quiz(quiz_id):
         # Find the quiz in the session
         quiz_data = student_session.get_quiz(quiz_id)
         if not quiz_data:
-            return jsonify({'error': 'Quiz not found'}), 404
+            return error_response(404, error='Quiz not found')
 
         # Start quiz session
         quiz_session = student_session.start_quiz_session(quiz_id, quiz_data)
@@ -201,23 +379,25 @@ def start_quiz(quiz_id):
 
     except Exception as e:
         logger.exception("Error starting quiz")
-        return jsonify({'error': 'Failed to start quiz'}), 500
+        return error_response(500, error='Failed to start quiz')
 
 
 @app.route('/quiz/<quiz_id>/submit', methods=['POST'])
 def submit_quiz(quiz_id):
     """Submit completed quiz answers"""
+    body, error = parse_body(SubmitQuizRequest)
+    if error:
+        return error
+
     try:
-        data = request.get_json()
-        answers = data.get('answers', [])
-        time_taken = data.get('time_taken', 0)
+        answers, time_taken = body.answers, body.time_taken
 
         student_session = get_or_create_student_session()
 
         # Get quiz data
         quiz_data = student_session.get_quiz(quiz_id)
         if not quiz_data:
-            return jsonify({'error': 'Quiz not found'}), 404
+            return error_response(404, error='Quiz not found')
 
         # Grade the quiz
         quiz_generator_instance = get_quiz_generator()
@@ -243,18 +423,19 @@ def submit_quiz(quiz_id):
 
     except Exception as e:
         logger.exception("Error submitting quiz")
-        return jsonify({'error': 'Failed to submit quiz'}), 500
+        return error_response(500, error='Failed to submit quiz')
 
 
 @app.route('/quiz/result', methods=['POST'])
 def submit_quiz_result():
     """Submit quiz results and track performance (legacy endpoint)"""
+    body, error = parse_body(QuizResultRequest)
+    if error:
+        return error
+
     try:
-        data = request.get_json()
-        subject = data.get('subject', 'General')
-        quiz_data = data.get('quiz_data', {})
-        score = data.get('score', 0)
-        time_taken = data.get('time_taken', 0)
+        subject, quiz_data = body.subject, body.quiz_data
+        score, time_taken = body.score, body.time_taken
 
         # Get student session
         student_session = get_or_create_student_session()
@@ -270,56 +451,74 @@ def submit_quiz_result():
 
     except Exception as e:
         logger.exception("Error in submit_quiz_result")
-        return jsonify({'error': 'Failed to record quiz result'}), 500
+        return error_response(500, error='Failed to record quiz result')
 
 
 @app.route('/quiz/history')
 def get_quiz_history():
     """Get quiz history for the current session"""
     try:
-        student_session = get_or_create_student_session()
+        student_session = view_student_session()
         quiz_history = student_session.get_quiz_history()
 
-        return jsonify({
-            'quiz_history': quiz_history,
-            'session_id': student_session.session_id
-        })
+        return streamed_json(
+            (student_session.session_id, student_session.revision),
+            quiz_history=quiz_history,
+            session_id=student_session.session_id)
 
     except Exception as e:
         logger.exception("Error getting quiz history")
-        return jsonify({'error': 'Failed to load quiz history'}), 500
+        return error_response(500, error='Failed to load quiz history')
 
 
 @app.route('/quiz/available')
 def get_available_quizzes():
     """Get available quiz topics and subjects"""
     try:
-        # Define available quiz topics
-        available_quizzes = {
-            'Mathematics': ['Algebra', 'Geometry', 'Trigonometry', 'Calculus', 'Statistics'],
-            'Physics': ['Mechanics', 'Electricity', 'Waves', 'Optics', 'Modern Physics'],
-            'Biology': ['Cell Biology', 'Genetics', 'Ecology', 'Evolution', 'Human Biology'],
-            'Chemistry': ['Organic Chemistry', 'Inorganic Chemistry', 'Physical Chemistry', 'Analytical Chemistry'],
-            'History': ['Ancient History', 'Medieval History', 'Modern History', 'African History', 'World History'],
-            'Geography': ['Physical Geography', 'Human Geography', 'Economic Geography', 'Political Geography', 'Climate']
-        }
-
-        return jsonify({
-            'available_quizzes': available_quizzes,
-            'difficulty_levels': ['beginner', 'intermediate', 'advanced'],
-            'quiz_types': ['concept_check', 'problem_solving', 'critical_thinking', 'application']
-        })
+        if client_has_etag(_AVAILABLE_QUIZZES_ETAG):
+            response = Response(status=304)
+        else:
+            response = Response(_AVAILABLE_QUIZZES_JSON, mimetype='application/json')
+        response.set_etag(_AVAILABLE_QUIZZES_ETAG)
+        response.cache_control.public = True
+        response.cache_control.max_age = _AVAILABLE_QUIZZES_MAX_AGE
+        return response
 
     except Exception as e:
         logger.exception("Error getting available quizzes")
-        return jsonify({'error': 'Failed to load available quizzes'}), 500
+        return error_response(500, error='Failed to load available quizzes')
+
+
+# Serialized dashboards by (session id, revision, session minute), for polling clients
+_dashboard_cache = TTLCache(maxsize=2048, ttl=60)
+_dashboard_cache_lock = threading.Lock()
 
 
 @app.route('/learning/dashboard')
 def get_learning_dashboard():
-    """Get personalized learning dashboard data (student view)."""
+    """Get personalized learning dashboard data (student view).
+
+    The payload only changes when the session does (revision) or when its
+    duration ticks over a minute, so that triple keys both the ETag and a
+    short-lived cache of the serialized body.
+    """
     try:
-        student_session = get_or_create_student_session()
+        student_session = view_student_session()
+
+        version = (student_session.session_id, student_session.revision,
+                   student_session.session_duration_minutes())
+        etag = hashlib.blake2b(repr(version).encode(), digest_size=8).hexdigest()
+        if client_has_etag(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        with _dashboard_cache_lock:
+            body = _dashboard_cache.get(version)
+        if body is not None:
+            response = Response(body, mimetype='application/json')
+            response.set_etag(etag)
+            return response
 
         progress_summary = student_session.get_progress_summary()
         subject_analytics = student_session.get_subject_analytics()
@@ -343,37 +542,41 @@ def get_learning_dashboard():
             }
         }
 
-        return jsonify(dashboard_data)
+        response = jsonify(dashboard_data)
+        with _dashboard_cache_lock:
+            _dashboard_cache[version] = response.get_data()
+        response.set_etag(etag)
+        return response
 
     except Exception as e:
         logger.exception("Error in get_learning_dashboard")
-        return jsonify({'error': 'Failed to load dashboard data'}), 500
+        return error_response(500, error='Failed to load dashboard data')
 
 
 @app.route('/learning/history')
 def get_learning_history():
     """Get learning history for the current session"""
     try:
-        student_session = get_or_create_student_session()
+        student_session = view_student_session()
         limit = request.args.get('limit', 10, type=int)
 
         history = student_session.get_learning_history(limit)
 
-        return jsonify({
+        return conditional_json({
             'history': history,
             'session_id': student_session.session_id
         })
 
     except Exception as e:
         logger.exception("Error in get_learning_history")
-        return jsonify({'error': 'Failed to load learning history'}), 500
+        return error_response(500, error='Failed to load learning history')
 
 
 @app.route('/learning/recommendations')
 def get_learning_recommendations():
     """Get personalized learning recommendations"""
     try:
-        student_session = get_or_create_student_session()
+        student_session = view_student_session()
         recommendations = student_session.get_learning_recommendations()
 
         return jsonify({
@@ -383,7 +586,7 @@ def get_learning_recommendations():
 
     except Exception as e:
         logger.exception("Error in get_learning_recommendations")
-        return jsonify({'error': 'Failed to load recommendations'}), 500
+        return error_response(500, error='Failed to load recommendations')
 
 
 @app.route('/session/reset', methods=['POST'])
@@ -391,8 +594,8 @@ def reset_session():
     """Reset the current student session"""
     try:
         session_id = session.get('student_session_id')
-        if session_id and session_id in student_sessions:
-            del student_sessions[session_id]
+        if session_id:
+            session_store.delete(session_id)
 
         # Clear session
         session.pop('student_session_id', None)
@@ -404,36 +607,201 @@ def reset_session():
 
     except Exception as e:
         logger.exception("Error in reset_session")
-        return jsonify({'error': 'Failed to reset session'}), 500
+        return error_response(500, error='Failed to reset session')
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Answer cache hit/miss and model routing counters for this worker."""
+    tutor = get_ai_tutor()
+    cache = tutor.cache
+    lookups = cache.stats['hits'] + cache.stats['misses']
+    stats = {
+        'backend': cache.backend,
+        'hits': cache.stats['hits'],
+        'l1_hits': cache.stats['l1_hits'],
+        'misses': cache.stats['misses'],
+        'hit_rate': round(cache.stats['hits'] / lookups, 3) if lookups else 0.0,
+        # Approximate (up to a minute old) for the redis backend
+        'size': len(cache),
+        'model_routing': dict(tutor.route_stats)
+    }
+    semantic = tutor.semantic_cache
+    if semantic is not None:
+        stats['semantic'] = {
+            'available': semantic.available,
+            'hits': semantic.stats['hits'],
+            'misses': semantic.stats['misses'],
+            'size': len(semantic)
+        }
+    return jsonify(stats)
 
 
 @app.route('/health')
 def health_check():
-    """Health check endpoint for monitoring"""
-    return jsonify({
-        'status': 'healthy',
-        'service': 'SmartLearn AI Tutor',
-        'phase': APP_PHASE,
-        'version': APP_VERSION,
-        'active_sessions': len(student_sessions)
-    })
+    """Health check endpoint for monitoring
 
+    active_sessions is only reported for the in-memory store. Counting a
+    Redis keyspace on every probe would make liveness slower as traffic
+    grows and fail it whenever Redis is slow; /admin/sessions has the count.
+    """
+    if session_store.backend != 'memory':
+        return Response(_HEALTH_JSON, mimetype='application/json')
+    return Response(f'{{"active_sessions":{len(session_store)}{_HEALTH_JSON_TAIL}',
+                    mimetype='application/json')
 
-def get_or_create_student_session() -> StudentSession:
-    """Get existing student session or create a new one.
+
+def json_body():
+    """The request's JSON object, or None when the body is missing, malformed or not an object.
+
+    Parsed once (get_json caches it) and without raising, so routes can answer
+    a bad body with a plain 400 instead of falling into their error handlers.
+    """
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else None
+
+
+def client_has_etag(etag: str) -> bool:
+    """True when the request's If-None-Match already names this ETag."""
+    # Flask-Compress tags compressed variants "<etag>:<algorithm>"; match either form
+    return any(tag.partition(':')[0] == etag for tag in request.if_none_match.as_set(include_weak=True))
+
+
+def parse_body(schema):
+    """Decode the raw request body straight into a request_schemas struct.
+
+    Returns (struct, None), or (None, 400 response) when the body is not
+    valid JSON or doesn't match the schema; the message names the bad field.
+    """
+    try:
+        return msgspec.json.decode(request.get_data(cache=True), type=schema), None
+    except msgspec.DecodeError as e:  # ValidationError is a subclass
+        return None, (jsonify({'error': f'Invalid request body: {e}'}), 400)
+
+
+def conditional_json(payload):
+    """jsonify with an ETag, answering 304 when the client's copy is current.
+
+    Lets dashboards that poll skip re-downloading an unchanged payload.
+    """
+    response = jsonify(payload)
+    etag = hashlib.blake2b(response.get_data(), digest_size=8).hexdigest()
+    if client_has_etag(etag):
+        response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def streamed_json(version, **fields):
+    """Stream a JSON object whose list fields are encoded one element at a time.
+
+    Long histories go out as they're encoded instead of being buffered whole
+    first. The body isn't known up front, so the ETag comes from `version`,
+    which must change whenever the payload does (e.g. the session revision).
+    """
+    etag = hashlib.blake2b(repr(version).encode(), digest_size=8).hexdigest()
+    if client_has_etag(etag):
+        response = Response(status=304)
+    else:
+        response = Response(_stream_json_object(fields), mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+
+def _stream_json_object(fields: dict):
+    encode = app.json._encode
+    yield b'{'
+    # Sorted like jsonify's output
+    for position, key in enumerate(sorted(fields)):
+        value = fields[key]
+        yield (b',"' if position else b'"') + key.encode() + b'":'
+        if isinstance(value, list):
+            yield b'['
+            for index, item in enumerate(value):
+                yield (b',' if index else b'') + encode(item, False)
+            yield b']'
+        else:
+            yield encode(value, False)
+    yield b'}\n'
+
+
+def get_student_session(create: bool = False) -> Optional[StudentSession]:
+    """Get the visitor's student session, creating one only when asked to.
+
+    Args:
+        create: Start a new session if the visitor has none. Only routes that
+            record activity pass True, so crawlers and health checks hitting
+            read-only routes don't fill the session store with empty sessions.
 
     Returns:
-        StudentSession: The active (existing or newly created) session object.
+        Optional[StudentSession]: The active session, or None when absent and create is False.
     """
+    student_session = g.get('student_session')
+    if student_session is not None:
+        return student_session
+
     session_id = session.get('student_session_id')
+    student_session = session_store.get(session_id) if session_id else None
 
-    if not session_id or session_id not in student_sessions:
+    if student_session is None:
+        if not create:
+            return None
         # Create new session
-        session_id = str(uuid.uuid4())
+        session_id = secrets.token_urlsafe(16)
         session['student_session_id'] = session_id
-        student_sessions[session_id] = StudentSession(session_id)
+        student_session = StudentSession(session_id)
+
+    # Written back to the store by save_student_session once the request ends
+    g.student_session = student_session
+    return student_session
+
+
+def get_or_create_student_session() -> StudentSession:
+    """Get existing student session or create a new one."""
+    return get_student_session(create=True)
+
 
-    return student_sessions[session_id]
+def view_student_session() -> StudentSession:
+    """Session for read-only routes; visitors without one see a blank, unsaved session."""
+    return get_student_session() or StudentSession(None)
+
+
+@app.after_request
+def save_student_session(response):
+    """Persist the session a route loaded (and possibly changed) this request."""
+    student_session = g.pop('student_session', None)
+    if student_session is not None:
+        session_store.save(student_session)
+    return response
+
+
+def upgrade_student_session(session_id):
+    """Mark a stored session premium after its payment completes."""
+    if not session_id:
+        return
+    student_session = session_store.get(session_id)
+    if student_session is not None:
+        student_session.upgrade_to_premium()
+        session_store.save(student_session)
+
+
+# Learning tip per progress tier; the subject is filled in by _learning_tip_text
+_LEARNING_TIPS = {
+    'new': "Welcome to SmartLearn! Start by asking questions about {subject} to build your learning profile.",
+    'early': "Great start! Keep asking questions about {subject} to unlock personalized recommendations.",
+    'struggling': "Keep practicing {subject}! Review the basics and ask for clarification on difficult concepts.",
+    'progress': "Good progress in {subject}! Focus on areas where you scored lower to improve.",
+    'mastery': "Excellent work in {subject}! You're mastering the concepts. Try more challenging questions.",
+    'exploring': "Keep exploring {subject}! Every question helps us understand your learning needs better.",
+}
+# Average quiz score tiers: below 60, 60 to 79, 80 and up
+_SCORE_THRESHOLDS = (60, 80)
+_SCORE_TIERS = ('struggling', 'progress', 'mastery')
+
+
+@lru_cache(maxsize=512)
+def _learning_tip_text(tier: str, subject: str) -> str:
+    return _LEARNING_TIPS[tier].format(subject=subject)
 
 
 def get_learning_tip(student_session: StudentSession, subject: str) -> str:
@@ -446,27 +814,20 @@ def get_learning_tip(student_session: StudentSession, subject: str) -> str:
     Returns:
         str: A short learning tip.
     """
-    progress = student_session.get_progress_summary()
-
-    if progress['total_questions'] == 0:
-        return f"Welcome to SmartLearn! Start by asking questions about {subject} to build your learning profile."
-
-    if progress['total_questions'] < 3:
-        return f"Great start! Keep asking questions about {subject} to unlock personalized recommendations."
-
-    # Get subject-specific analytics
-    subject_analytics = student_session.get_subject_analytics()
-    if subject in subject_analytics:
-        avg_score = subject_analytics[subject]['average_quiz_score']
-        if avg_score > 0:
-            if avg_score >= 80:
-                return f"Excellent work in {subject}! You're mastering the concepts. Try more challenging questions."
-            elif avg_score >= 60:
-                return f"Good progress in {subject}! Focus on areas where you scored lower to improve."
-            else:
-                return f"Keep practicing {subject}! Review the basics and ask for clarification on difficult concepts."
-
-    return f"Keep exploring {subject}! Every question helps us understand your learning needs better."
+    # Only the question count and this subject's quiz average matter here,
+    # so skip building the full progress summary and per-subject analytics
+    total_questions = len(student_session.questions_asked)
+    if total_questions == 0:
+        tier = 'new'
+    elif total_questions < 3:
+        tier = 'early'
+    else:
+        tier = 'exploring'
+        if subject in student_session.subjects_explored:
+            avg_score = student_session.get_subject_average_score(subject)
+            if avg_score > 0:
+                tier = _SCORE_TIERS[bisect_right(_SCORE_THRESHOLDS, avg_score)]
+    return _learning_tip_text(tier, subject)
 
 
 # ====================================================================
@@ -479,8 +840,11 @@ if FIREBASE_ENABLED:
     @require_auth
     def create_user_api():
         """Create user profile in Firestore"""
+        data = json_body()
+        if data is None:
+            return error_response(400, success=False, message='Request body must be a JSON object')
+
         try:
-            data = request.get_json()
             uid = data.get('uid') or request.user['uid']
             email = data.get('email') or request.user['email']
             name = data.get('name') or request.user.get(
@@ -510,10 +874,21 @@ if FIREBASE_ENABLED:
     @app.route('/api/user-profile', methods=['GET'])
     @require_auth
     def get_user_profile_api():
-        """Get user profile data"""
+        """Get user profile data
+
+        ?fields=name,email returns only those top-level fields.
+        """
+        field_paths = [name.strip() for name in request.args.get('fields', '').split(',') if name.strip()]
+        unknown = sorted(set(field_paths) - USER_PROFILE_FIELDS)
+        if unknown:
+            return jsonify({
+                'success': False,
+                'message': f"Unknown profile fields: {', '.join(unknown)}"
+            }), 400
+
         try:
             uid = request.user['uid']
-            user_data = get_user_data(uid)
+            user_data = get_user_data(uid, field_paths=field_paths or None)
 
             if user_data:
                 return jsonify({
@@ -536,26 +911,37 @@ if FIREBASE_ENABLED:
     @require_auth
     def save_quiz_result_api():
         """Save quiz result for authenticated user"""
+        data = json_body()
+        if data is None:
+            return error_response(400, success=False, message='Request body must be a JSON object')
+        # score feeds a Firestore Increment, which only takes numbers; absent counts as 0
+        score = data.get('score')
+        total_questions = data.get('totalQuestions')
+        if not all(value is None or (isinstance(value, (int, float)) and not isinstance(value, bool))
+                   for value in (score, total_questions)):
+            return error_response(400, success=False, message='score and totalQuestions must be numbers')
+
         try:
             uid = request.user['uid']
-            data = request.get_json()
 
             quiz_data = {
                 'subject': data.get('subject'),
-                'score': data.get('score'),
-                'totalQuestions': data.get('totalQuestions'),
+                'score': score or 0,
+                'totalQuestions': total_questions or 0,
                 'timeTaken': data.get('timeTaken'),
                 'difficulty': data.get('difficulty', 'medium'),
                 'questions': data.get('questions', [])
             }
 
-            success = save_quiz_result(uid, quiz_data)
+            outcome = save_quiz_result(uid, quiz_data)
 
-            if success:
+            if outcome:
+                # 202 when the write is still queued for the background writers
                 return jsonify({
                     'success': True,
+                    'queued': outcome == 'queued',
                     'message': 'Quiz result saved successfully'
-                })
+                }), 202 if outcome == 'queued' else 200
             else:
                 return jsonify({
                     'success': False,
@@ -572,9 +958,12 @@ if FIREBASE_ENABLED:
     @require_auth
     def save_learning_session_api():
         """Save learning session for authenticated user"""
+        data = json_body()
+        if data is None:
+            return error_response(400, success=False, message='Request body must be a JSON object')
+
         try:
             uid = request.user['uid']
-            data = request.get_json()
 
             session_data = {
                 'question': data.get('question'),
@@ -583,13 +972,15 @@ if FIREBASE_ENABLED:
                 'sessionType': data.get('sessionType', 'question')
             }
 
-            success = save_learning_session(uid, session_data)
+            outcome = save_learning_session(uid, session_data)
 
-            if success:
+            if outcome:
+                # 202 when the write is still queued for the background writers
                 return jsonify({
                     'success': True,
+                    'queued': outcome == 'queued',
                     'message': 'Learning session saved successfully'
-                })
+                }), 202 if outcome == 'queued' else 200
             else:
                 return jsonify({
                     'success': False,
@@ -602,30 +993,55 @@ if FIREBASE_ENABLED:
                 'message': f'Error saving learning session: {str(e)}'
             }), 500
 
+    # Both possible bodies, by is_firebase_available()
+    _FIREBASE_STATUS_JSON = {
+        initialized: _static_json({
+            'firebase_enabled': True,
+            'firebase_initialized': initialized
+        }).encode()
+        for initialized in (True, False)
+    }
+
     @app.route('/api/firebase-status', methods=['GET'])
     def firebase_status():
         """Check Firebase status"""
-        return jsonify({
-            'firebase_enabled': FIREBASE_ENABLED,
-            'firebase_initialized': is_firebase_available()
-        })
+        return Response(_FIREBASE_STATUS_JSON[is_firebase_available()], mimetype='application/json')
 
 else:
     # Firebase disabled routes
+    _FIREBASE_DISABLED_JSON = _static_json({
+        'firebase_enabled': False,
+        'firebase_initialized': False,
+        'message': 'Firebase is not available'
+    }).encode()
+
     @app.route('/api/firebase-status', methods=['GET'])
     def firebase_status():
         """Check Firebase status"""
-        return jsonify({
-            'firebase_enabled': False,
-            'firebase_initialized': False,
-            'message': 'Firebase is not available'
-        })
+        return Response(_FIREBASE_DISABLED_JSON, mimetype='application/json')
 
 
 INTASEND_PUBLIC_KEY = os.getenv('INTASEND_PUBLIC_KEY')  # publishable key
 INTASEND_SECRET_KEY = os.getenv('INTASEND_SECRET_KEY')  # secret key for server
 # separate webhook signing secret (recommended)
 INTASEND_WEBHOOK_SECRET = os.getenv('INTASEND_WEBHOOK_SECRET')
+# HMAC key bytes, encoded once rather than per webhook delivery
+_INTASEND_WEBHOOK_KEY = INTASEND_WEBHOOK_SECRET.encode('utf-8') if INTASEND_WEBHOOK_SECRET else None
+# IntaSend status strings (lower-cased) that settle a payment, shared by the
+# verify and webhook routes; anything else leaves it pending
+_PROVIDER_STATUSES = {
+    'paid': STATUS_COMPLETED,
+    'completed': STATUS_COMPLETED,
+    'success': STATUS_COMPLETED,
+    'failed': STATUS_FAILED,
+    'cancelled': STATUS_FAILED,
+    'canceled': STATUS_FAILED,
+    'error': STATUS_FAILED,
+}
+# Webhook deliveries already applied, by (reference, transaction id, status);
+# IntaSend retries deliveries, and repeats needn't touch the store again
+_webhook_seen = TTLCache(maxsize=100000, ttl=3600)
+_webhook_seen_lock = threading.Lock()
 # Auto-detect environment based on key prefix
 if INTASEND_SECRET_KEY and INTASEND_SECRET_KEY.startswith('ISSecretKey_live_'):
     INTASEND_BASE_URL = os.getenv(
@@ -634,6 +1050,13 @@ else:
     INTASEND_BASE_URL = os.getenv(
         'INTASEND_BASE_URL', 'https://sandbox.intasend.com/api/v1')
 
+# IntaSend calls reuse keep-alive connections from the shared pool; checkout
+# POSTs are never replayed since the first attempt may have gone through
+mount_host(INTASEND_BASE_URL)
+# (connect, read) seconds: an unreachable host fails fast and its connect is
+# retried, while a slow but connected checkout still gets the full read window
+_INTASEND_CONNECT_TIMEOUT = 3.05
+
 
 def create_intasend_checkout(amount: float, email: str, reference: str):
     """Create an IntaSend checkout session.
@@ -664,8 +1087,9 @@ def create_intasend_checkout(amount: float, email: str, reference: str):
     try:
         logger.info('Creating IntaSend checkout: ref=%s amount=%.2f base=%s',
                     reference, amount, INTASEND_BASE_URL)
-        resp = requests.post(f'{INTASEND_BASE_URL}/checkout/',
-                             json=payload, headers=headers, timeout=20)
+        resp = shared_session().post(f'{INTASEND_BASE_URL}/checkout/',
+                                     json=payload, headers=headers,
+                                     timeout=(_INTASEND_CONNECT_TIMEOUT, 20))
         logger.info('IntaSend response status: %d', resp.status_code)
         if resp.status_code not in (200, 201):
             snippet = resp.text[:500]
@@ -696,7 +1120,7 @@ def start_upgrade():
         if student_session.is_premium:
             return jsonify({'success': True, 'message': 'Already Premium', 'already_premium': True})
 
-        data = request.get_json() or {}
+        data = json_body() or {}
         email = data.get('email') or 'student@example.com'
 
         amount = float(os.getenv('PREMIUM_PRICE', '100'))  # KES 100 default
@@ -706,7 +1130,7 @@ def start_upgrade():
         if not INTASEND_SECRET_KEY:
             logger.error(
                 'IntaSend not configured - missing INTASEND_SECRET_KEY')
-            return jsonify({'success': False, 'error': 'Payment system not configured. Please contact support.'}), 500
+            return error_response(500, success=False, error='Payment system not configured. Please contact support.')
 
         result = create_intasend_checkout(amount, email, reference)
         if not result.get('success'):
@@ -726,7 +1150,6 @@ def payment_complete():
     """Landing page / redirect after payment (simplified).
     In a real app you'd verify transaction via IntaSend API before upgrading.
     """
-    student_session = get_or_create_student_session()
     # DO NOT auto-upgrade here; rely on webhook or manual verification
     return render_template('index.html')
 
@@ -734,7 +1157,7 @@ def payment_complete():
 @app.route('/payment/status')
 def payment_status():
     """Return current subscription status."""
-    student_session = get_or_create_student_session()
+    student_session = view_student_session()
     reference = request.args.get('reference')
     payment_info = get_payment(reference) if reference else None
     return jsonify({
@@ -754,11 +1177,11 @@ def payment_verify(reference):
     """
     try:
         if not INTASEND_SECRET_KEY:
-            return jsonify({'success': False, 'error': 'Not configured'}), 500
+            return error_response(500, success=False, error='Not configured')
         # Basic lookup only if currently pending
         local = get_payment(reference)
         if not local:
-            return jsonify({'success': False, 'error': 'Unknown reference'}), 404
+            return error_response(404, success=False, error='Unknown reference')
         if local['status'] == STATUS_COMPLETED:
             return jsonify({'success': True, 'status': local['status'], 'already_completed': True})
         headers = {
@@ -766,11 +1189,12 @@ def payment_verify(reference):
         }
         # Attempt a generic GET - adjust path according to real API (placeholder)
         verify_url = f"{INTASEND_BASE_URL}/checkout/{reference}/"
-        resp = requests.get(verify_url, headers=headers, timeout=15)
+        resp = shared_session().get(verify_url, headers=headers,
+                                    timeout=(_INTASEND_CONNECT_TIMEOUT, 15))
         logger.info('Verify call ref=%s status=%s',
                     reference, resp.status_code)
         if resp.status_code == 404:
-            return jsonify({'success': False, 'error': 'Provider reference not found'}), 404
+            return error_response(404, success=False, error='Provider reference not found')
         if resp.status_code >= 400:
             return jsonify({'success': False, 'error': f'Provider error {resp.status_code}'}), 502
         data = {}
@@ -781,21 +1205,17 @@ def payment_verify(reference):
         # Heuristics for status keys
         provider_status = (data.get('status') or data.get(
             'payment_status') or '').lower()
-        if provider_status in ('paid', 'completed', 'success'):
-            update_payment_status(reference, STATUS_COMPLETED, data.get(
-                'transaction_id') or data.get('id'), data)
-            # Upgrade session if possible
-            refreshed = get_payment(reference)
-            sid = refreshed.get('session_id') if refreshed else None
-            if sid and sid in student_sessions:
-                student_sessions[sid].upgrade_to_premium()
-        elif provider_status in ('failed', 'cancelled', 'canceled', 'error'):
-            update_payment_status(reference, STATUS_FAILED, data.get(
-                'transaction_id') or data.get('id'), data)
-        return jsonify({'success': True, 'provider_status': provider_status, 'local_status': get_payment(reference)['status'], 'provider_raw': data})
+        settled_status = _PROVIDER_STATUSES.get(provider_status)
+        if settled_status is not None:
+            local = update_payment_status(reference, settled_status, data.get(
+                'transaction_id') or data.get('id'), data) or local
+            if settled_status == STATUS_COMPLETED:
+                # Upgrade session if possible
+                upgrade_student_session(local.get('session_id'))
+        return jsonify({'success': True, 'provider_status': provider_status, 'local_status': local['status'], 'provider_raw': data})
     except Exception:
         logger.exception('Manual verify failed ref=%s', reference)
-        return jsonify({'success': False, 'error': 'Verification failed'}), 500
+        return error_response(500, success=False, error='Verification failed')
 
 
 @app.route('/payment/webhook', methods=['POST'])
@@ -803,69 +1223,128 @@ def payment_webhook():
     """Handle IntaSend webhook (simplified – add signature verification in prod)."""
     try:
         raw_body = request.get_data()  # bytes
-        sig_header = request.headers.get(
-            'X-IntaSend-Signature') or request.headers.get('X-INTASEND-SIGNATURE')
+        # Header lookup is case-insensitive
+        sig_header = request.headers.get('X-IntaSend-Signature')
         # Optional signature verification if secret configured
-        if INTASEND_WEBHOOK_SECRET:
+        if _INTASEND_WEBHOOK_KEY:
             if not sig_header:
                 logger.warning('Webhook rejected: missing signature header')
-                return jsonify({'success': False, 'error': 'Missing signature'}), 400
+                return error_response(400, success=False, error='Missing signature')
             try:
-                expected = hmac.new(INTASEND_WEBHOOK_SECRET.encode(
-                    'utf-8'), raw_body, hashlib.sha256).hexdigest()
-                if not hmac.compare_digest(expected, sig_header.strip()):
-                    logger.warning(
-                        'Webhook signature mismatch expected=%s got=%s', expected, sig_header)
-                    return jsonify({'success': False, 'error': 'Invalid signature'}), 400
+                # One-shot C HMAC; compare the raw 32-byte digests in constant time
+                expected = hmac.digest(_INTASEND_WEBHOOK_KEY, raw_body, 'sha256')
+                try:
+                    received = bytes.fromhex(sig_header.strip())
+                except ValueError:
+                    received = b''  # not hex, so it can't match
+                if not hmac.compare_digest(expected, received):
+                    # Never log the expected MAC: it is a valid signature for this body
+                    logger.warning('Webhook signature mismatch')
+                    return error_response(400, success=False, error='Invalid signature')
             except Exception:
                 logger.exception('Error verifying webhook signature')
-                return jsonify({'success': False, 'error': 'Signature verification error'}), 400
+                return error_response(400, success=False, error='Signature verification error')
         payload = request.get_json(silent=True) or {}
         reference = payload.get('reference') or payload.get('invoice')
         status = payload.get('status')
         transaction_id = payload.get('transaction_id') or payload.get('id')
         if not reference:
-            return jsonify({'success': False, 'error': 'Missing reference'}), 400
+            return error_response(400, success=False, error='Missing reference')
         normalized_status = STATUS_PENDING
         if status and isinstance(status, str):
-            status_l = status.lower()
-            if status_l in ('paid', 'completed', 'success'):
-                normalized_status = STATUS_COMPLETED
-            elif status_l in ('failed', 'cancelled', 'canceled', 'error'):
-                normalized_status = STATUS_FAILED
-        update_payment_status(reference, normalized_status,
-                              transaction_id, payload)
+            normalized_status = _PROVIDER_STATUSES.get(status.lower(), STATUS_PENDING)
+        delivery = (reference, transaction_id, normalized_status)
+        with _webhook_seen_lock:
+            duplicate = delivery in _webhook_seen
+        if duplicate:
+            return jsonify({'success': True, 'duplicate': True})
+        payment_record = update_payment_status(reference, normalized_status,
+                                               transaction_id, payload)
         # Auto-upgrade associated session if completed
-        if normalized_status == STATUS_COMPLETED:
-            payment_record = get_payment(reference)
-            if payment_record:
-                sid = payment_record.get('session_id')
-                if sid and sid in student_sessions:
-                    student_sessions[sid].upgrade_to_premium()
+        if normalized_status == STATUS_COMPLETED and payment_record:
+            upgrade_student_session(payment_record.get('session_id'))
+        # Only once applied, so a delivery that failed part way is redone on retry
+        with _webhook_seen_lock:
+            _webhook_seen[delivery] = True
         return jsonify({'success': True})
     except Exception:
         logger.exception('Webhook processing failed')
-        return jsonify({'success': False, 'error': 'Webhook processing failed'}), 500
+        return error_response(500, success=False, error='Webhook processing failed')
+
+
+# Bearer token for the admin and debug routes; unset keeps them disabled
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+
+def require_admin(f):
+    """Allow only requests carrying `Authorization: Bearer <ADMIN_TOKEN>`."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return error_response(404, error='Not found')
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme != 'Bearer' or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return error_response(401, error='Admin token required')
+        return f(*args, **kwargs)
+    return decorated_function
 
 
 @app.route('/admin/payments')
+@require_admin
 def admin_list_payments():
-    payments = list_payments(100)
-    return jsonify({'payments': payments})
+    """Payments newest first, ?limit= (1-100, default 50) per page.
+
+    Pass a response's next_cursor back as ?cursor= for the following page;
+    next_cursor is null on the last page.
+    """
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 100)
+    cursor = request.args.get('cursor', '')
+    before = None
+    if cursor:
+        try:
+            before = int(base64.urlsafe_b64decode(cursor.encode()))
+        except ValueError:
+            return error_response(400, error='Invalid cursor')
+    # Polls of an unchanged table get a 304 from one single-row read
+    # Built from the decoded position, never the raw ?cursor= text, which
+    # may carry characters an ETag can't hold
+    etag = f'payments-{payments_revision()}-{limit}-{before}'
+    if client_has_etag(etag):
+        response = Response(status=304)
+    else:
+        payments, next_id = list_payments_page(limit, before)
+        next_cursor = base64.urlsafe_b64encode(str(next_id).encode()).decode() if next_id is not None else None
+        response = jsonify({'payments': payments, 'next_cursor': next_cursor})
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = 5
+    return response
+
+
+@app.route('/admin/sessions')
+@require_admin
+def admin_session_count():
+    """Student sessions held by the store (a full keyspace SCAN on the redis backend)."""
+    return jsonify({'backend': session_store.backend, 'active_sessions': len(session_store)})
+
+
+# Everything /debug/config reports is fixed at startup
+_DEBUG_CONFIG_JSON = _static_json({
+    'intasend_secret_key_configured': bool(INTASEND_SECRET_KEY),
+    'intasend_secret_key_prefix': INTASEND_SECRET_KEY[:20] + '...' if INTASEND_SECRET_KEY else None,
+    'intasend_base_url': INTASEND_BASE_URL,
+    'premium_price': os.getenv('PREMIUM_PRICE', '100'),
+    'is_live_mode': INTASEND_SECRET_KEY.startswith('ISSecretKey_live_') if INTASEND_SECRET_KEY else False,
+    'public_key_configured': bool(INTASEND_PUBLIC_KEY),
+    'webhook_signature_enforced': bool(INTASEND_WEBHOOK_SECRET)
+}).encode()
 
 
 @app.route('/debug/config')
+@require_admin
 def debug_config():
     """Debug endpoint to check IntaSend configuration."""
-    return jsonify({
-        'intasend_secret_key_configured': bool(INTASEND_SECRET_KEY),
-        'intasend_secret_key_prefix': INTASEND_SECRET_KEY[:20] + '...' if INTASEND_SECRET_KEY else None,
-        'intasend_base_url': INTASEND_BASE_URL,
-        'premium_price': os.getenv('PREMIUM_PRICE', '100'),
-        'is_live_mode': INTASEND_SECRET_KEY.startswith('ISSecretKey_live_') if INTASEND_SECRET_KEY else False,
-        'public_key_configured': bool(INTASEND_PUBLIC_KEY),
-        'webhook_signature_enforced': bool(INTASEND_WEBHOOK_SECRET)
-    })
+    return Response(_DEBUG_CONFIG_JSON, mimetype='application/json')
 
 
 if __name__ == '__main__':
@@ -5,18 +5,53 @@ Handles Firebase Admin SDK initialization and user management
 
 import os
 import json
+import atexit
+import hashlib
+import importlib.util
 import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
+from types import MappingProxyType
 from datetime import datetime
 
-# Import Firebase modules with error handling
-try:
+from cachetools import TTLCache
+
+# The Admin SDK and Firestore client take a few hundred ms to import, so they
+# are only loaded by FirebaseManager.initialize (see _import_sdk); processes
+# that never initialize Firebase don't pay for them on a cold start
+FIREBASE_AVAILABLE = importlib.util.find_spec('firebase_admin') is not None
+if not FIREBASE_AVAILABLE:
+    print("⚠️  Firebase Admin SDK not installed. Run: pip install firebase-admin")
+firebase_admin = credentials = auth = firestore = AlreadyExists = None
+
+
+def _import_sdk():
+    """Bind the Firebase SDK modules to this module's globals (idempotent)."""
+    global firebase_admin, credentials, auth, firestore, AlreadyExists
     import firebase_admin
     from firebase_admin import credentials, auth, firestore
-    FIREBASE_AVAILABLE = True
-except ImportError:
-    FIREBASE_AVAILABLE = False
-    print("⚠️  Firebase Admin SDK not installed. Run: pip install firebase-admin")
+    from google.api_core.exceptions import AlreadyExists
+
+# Starting values for a new profile's plan and quiz totals
+_USER_PROFILE_DEFAULTS = MappingProxyType({
+    'subscriptionStatus': 'free',
+    'totalQuizzes': 0,
+    'scoreSum': 0,
+    'averageScore': 0
+})
+
+# Top-level fields a profile document can hold; older profiles may also
+# carry the quizScores / learningHistory arrays
+USER_PROFILE_FIELDS = frozenset({
+    'uid', 'email', 'name', 'createdAt', 'lastActivity',
+    *_USER_PROFILE_DEFAULTS, 'quizScores', 'learningHistory'
+})
+
+# Profile fields _with_average_score derives averageScore from
+_AVERAGE_SCORE_INPUTS = ('scoreSum', 'totalQuizzes', 'quizScores')
 
 from flask import request, jsonify
 
@@ -24,13 +59,152 @@ from flask import request, jsonify
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class FirestoreWriteQueue:
+    """Applies Firestore document writes from background threads in batches.
+
+    Requests enqueue groups of (document ref, data, method) writes and return
+    at once; `method` is 'update' for existing documents or 'set' for new
+    ones. Each worker gathers whatever arrives within `linger` seconds (up to
+    Firestore's 500-write batch limit) and commits it as one RPC; a group is
+    never split across batches, so its writes land together or not at all.
+    If a batch is rejected, its groups are retried separately (and
+    concurrently) so a single bad document doesn't drop the others. Updates
+    to the same document within a batch are merged into one mutation (see
+    _coalesce), so a busy profile costs one write per batch. `after_commit`
+    is a (function, *args) tuple run once per batch after a successful
+    write, e.g. to evict a cached copy.
+    """
+
+    MAX_BATCH = 500
+
+    def __init__(self, db, workers: int = 4, linger: float = 0.1, maxsize: int = 10000,
+                 retry_workers: int = 10):
+        self._db = db
+        self.linger = linger
+        self._queue = queue.Queue(maxsize=maxsize)
+        # Retries of a rejected batch are independent commits; run them side by
+        # side so one bad document costs a round trip, not one per group
+        self._retry_pool = ThreadPoolExecutor(max_workers=retry_workers, thread_name_prefix='firestore-retry')
+        for i in range(workers):
+            threading.Thread(target=self._run, name=f'firestore-writer-{i}', daemon=True).start()
+        atexit.register(self.flush, 5)
+
+    def submit_group(self, writes: list, after_commit: tuple = None) -> bool:
+        """Queue (ref, data, method) writes to commit atomically; False when the queue is full (caller should write directly)."""
+        if len(writes) > self.MAX_BATCH:
+            raise ValueError(f"A write group is limited to {self.MAX_BATCH} writes")
+        try:
+            self._queue.put_nowait((tuple(writes), after_commit))
+            return True
+        except queue.Full:
+            return False
+
+    def flush(self, timeout: float = None):
+        """Wait (up to timeout seconds) for queued writes to be committed."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            time.sleep(0.05)
+
+    def _run(self):
+        carry = None  # a group that didn't fit in the previous batch
+        while True:
+            groups = [carry or self._queue.get()]
+            carry = None
+            size = len(groups[0][0])
+            deadline = time.monotonic() + self.linger
+            while size < self.MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    group = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if size + len(group[0]) > self.MAX_BATCH:
+                    carry = group
+                    break
+                groups.append(group)
+                size += len(group[0])
+            try:
+                self._commit(groups, size)
+            except Exception as e:
+                # Log and keep going: a dead worker would strand everything queued behind it
+                logger.exception(f"Firestore writer failed on a batch of {size} writes: {e}")
+            finally:
+                for _ in groups:
+                    self._queue.task_done()
+
+    def _apply(self, groups):
+        batch = self._db.batch()
+        for ref, data, method in self._coalesce(w for writes, _ in groups for w in writes):
+            getattr(batch, method)(ref, data)
+        batch.commit()
+
+    @staticmethod
+    def _coalesce(writes):
+        """Merge successive updates of one document: Increments add up, other fields last-write-wins."""
+        latest = {}  # document path -> its last write in `merged`
+        merged = []
+        for ref, data, method in writes:
+            previous = latest.get(ref.path)
+            if method == 'update' and previous is not None and previous[2] == 'update':
+                combined = dict(previous[1])
+                for field, value in data.items():
+                    earlier = combined.get(field)
+                    if isinstance(value, firestore.Increment) and isinstance(earlier, firestore.Increment):
+                        value = firestore.Increment(earlier.value + value.value)
+                    combined[field] = value
+                previous[1] = combined
+                continue
+            write = [ref, data, method]
+            latest[ref.path] = write
+            merged.append(write)
+        return merged
+
+    def _commit(self, groups, size: int):
+        try:
+            self._apply(groups)
+            committed = groups
+        except Exception as e:
+            logger.warning(f"Batched Firestore write of {size} failed, retrying groups singly: {e}")
+            retries = [self._retry_pool.submit(self._apply, [group]) for group in groups]
+            committed = []
+            for group, retry in zip(groups, retries):
+                try:
+                    retry.result()
+                    committed.append(group)
+                except Exception as e:
+                    paths = ', '.join(ref.path for ref, _, _ in group[0])
+                    logger.error(f"Firestore write to {paths} failed: {e}")
+
+        # Once per distinct follow-up, however many groups in the batch asked for it
+        for after_commit in {group[1] for group in committed if group[1]}:
+            func, *args = after_commit
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"Follow-up {func.__name__} after a Firestore write failed: {e}")
+
+
 class FirebaseManager:
     """Firebase Manager class to handle all Firebase operations"""
     
     def __init__(self):
         self.app = None
         self.db = None
+        self.writes = None  # FirestoreWriteQueue, unless FIRESTORE_ASYNC_WRITES=false
         self.initialized = False
+        # Recently read user documents by uid; every write through this
+        # manager evicts the entry, so the TTL only bounds outside edits
+        self._user_cache = TTLCache(maxsize=10000, ttl=int(os.getenv('FIRESTORE_USER_CACHE_TTL', '60')))
+        self._user_cache_lock = threading.Lock()
+        # Verified ID token claims by token digest (raw tokens aren't kept);
+        # an entry is trusted until the token's exp or the cache TTL, whichever
+        # is sooner, so a revoked session is honoured within the TTL
+        self._token_cache = TTLCache(maxsize=50000, ttl=int(os.getenv('FIREBASE_TOKEN_CACHE_TTL', '300')))
+        self._token_cache_lock = threading.Lock()
         
     def initialize(self):
         """Initialize Firebase Admin SDK with multiple fallback options"""
@@ -43,6 +217,8 @@ class FirebaseManager:
             if self.initialized:
                 logger.info("Firebase already initialized")
                 return True
+
+            _import_sdk()
                 
             # Option 1: Service Account Key File
             service_key_path = os.path.join(os.getcwd(), 'serviceAccountKey.json')
@@ -79,6 +255,8 @@ class FirebaseManager:
             
             # Initialize Firestore
             self.db = firestore.client()
+            if os.getenv('FIRESTORE_ASYNC_WRITES', 'true').lower() == 'true':
+                self.writes = FirestoreWriteQueue(self.db)
             self.initialized = True
             logger.info("✅ Firebase initialized successfully")
             return True
@@ -96,51 +274,86 @@ class FirebaseManager:
             # Remove 'Bearer ' prefix if present
             if token and token.startswith('Bearer '):
                 token = token[7:]
-                
+
+            key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+            with self._token_cache_lock:
+                cached = self._token_cache.get(key)
+            if cached is not None and cached['exp'] > time.time():
+                return cached
+
+            # Signature check, and a fetch of Google's signing keys when they rotate
             decoded_token = auth.verify_id_token(token)
+            with self._token_cache_lock:
+                self._token_cache[key] = decoded_token
             return decoded_token
         except Exception as e:
             logger.error(f"Token verification failed: {str(e)}")
             raise Exception("Invalid token")
     
-    def get_user_data(self, uid):
-        """Get user data from Firestore"""
+    def get_user_data(self, uid, fresh=False, field_paths=None):
+        """Get user data from Firestore
+
+        Served from the local cache when possible; pass fresh=True to read
+        through to Firestore. Callers must not mutate the returned dict.
+        field_paths (top-level field names) limits the read to those fields,
+        so large fields (e.g. the quizScores array of older profiles) are
+        only transferred when asked for.
+        """
         if not self.db:
             return None
-            
+
+        if not fresh:
+            with self._user_cache_lock:
+                user_data = self._user_cache.get(uid)
+            if user_data is not None:
+                if field_paths is None:
+                    return user_data
+                return {field: user_data[field] for field in field_paths if field in user_data}
+
         try:
             user_ref = self.db.collection('users').document(uid)
-            user_doc = user_ref.get()
+            read_paths = field_paths
+            if field_paths is not None and 'averageScore' in field_paths:
+                # The stored averageScore is only the profile default; read what it derives from
+                read_paths = list(dict.fromkeys([*field_paths, *_AVERAGE_SCORE_INPUTS]))
+            user_doc = user_ref.get(field_paths=read_paths)
             
             if user_doc.exists:
-                return user_doc.to_dict()
+                user_data = _with_average_score(user_doc.to_dict())
+                # Only whole documents can answer later reads
+                if field_paths is None:
+                    with self._user_cache_lock:
+                        self._user_cache[uid] = user_data
+                    return user_data
+                return {field: user_data[field] for field in field_paths if field in user_data}
             return None
         except Exception as e:
             logger.error(f"Error getting user data: {str(e)}")
             return None
     
     def create_user_profile(self, uid, email, name, additional_data=None):
-        """Create user profile in Firestore"""
+        """Create user profile in Firestore
+
+        An existing profile keeps its plan, quiz totals and createdAt; only
+        the identity fields (and additional_data) are merged into it. Returns
+        the fields written.
+        """
         if not self.db:
             return None
             
         try:
-            user_data = {
-                'uid': uid,
-                'email': email,
-                'name': name,
-                'createdAt': firestore.SERVER_TIMESTAMP,
-                'quizScores': [],
-                'learningHistory': [],
-                'subscriptionStatus': 'free',
-                'totalQuizzes': 0,
-                'averageScore': 0
-            }
-            
+            user_ref = self.db.collection('users').document(uid)
+            identity = {'uid': uid, 'email': email, 'name': name}
             if additional_data:
-                user_data.update(additional_data)
-            
-            self.db.collection('users').document(uid).set(user_data, merge=True)
+                identity.update(additional_data)
+            user_data = {**_USER_PROFILE_DEFAULTS, 'createdAt': firestore.SERVER_TIMESTAMP, **identity}
+
+            try:
+                user_ref.create(user_data)
+            except AlreadyExists:
+                user_ref.set(identity, merge=True)
+                user_data = identity
+            self._forget_user(uid)
             logger.info(f"User profile created for {email}")
             return user_data
         except Exception as e:
@@ -148,67 +361,94 @@ class FirebaseManager:
             return None
     
     def save_quiz_result(self, uid, quiz_data):
-        """Save quiz result to user's profile"""
+        """Save quiz result to user's profile
+
+        The result becomes its own document under users/{uid}/quizzes and the
+        profile only keeps running totals, so each save writes a fixed amount
+        however many quizzes the user has taken.
+
+        Returns 'queued' (committed shortly by the background writers) or
+        'saved' on success, False on failure.
+        """
         if not self.db:
             return False
             
         try:
             user_ref = self.db.collection('users').document(uid)
+            quiz_ref = user_ref.collection('quizzes').document()
             
             # Add timestamp to quiz data
             quiz_data['timestamp'] = firestore.SERVER_TIMESTAMP
             
-            # Update user's quiz scores and statistics
-            user_ref.update({
-                'quizScores': firestore.ArrayUnion([quiz_data]),
+            # Update user's quiz statistics; averageScore is derived on read
+            update = {
                 'totalQuizzes': firestore.Increment(1),
+                'scoreSum': firestore.Increment(quiz_data.get('score', 0)),
                 'lastActivity': firestore.SERVER_TIMESTAMP
-            })
-            
-            # Update average score
-            self._update_average_score(uid)
-            
-            logger.info(f"Quiz result saved for user {uid}")
-            return True
+            }
+            outcome = self._write_user(uid, [(quiz_ref, quiz_data, 'set'), (user_ref, update, 'update')])
+            logger.info(f"Quiz result {outcome} for user {uid}")
+            return outcome
         except Exception as e:
             logger.error(f"Error saving quiz result: {str(e)}")
             return False
     
     def save_learning_session(self, uid, session_data):
-        """Save learning session to user's history"""
+        """Save learning session to user's history (users/{uid}/learningSessions)
+
+        Returns 'queued' or 'saved' on success, False on failure.
+        """
         if not self.db:
             return False
             
         try:
             user_ref = self.db.collection('users').document(uid)
+            session_ref = user_ref.collection('learningSessions').document()
             
             # Add timestamp to session data
             session_data['timestamp'] = firestore.SERVER_TIMESTAMP
             
-            user_ref.update({
-                'learningHistory': firestore.ArrayUnion([session_data]),
-                'lastActivity': firestore.SERVER_TIMESTAMP
-            })
-            
-            logger.info(f"Learning session saved for user {uid}")
-            return True
+            update = {'lastActivity': firestore.SERVER_TIMESTAMP}
+            outcome = self._write_user(uid, [(session_ref, session_data, 'set'), (user_ref, update, 'update')])
+            logger.info(f"Learning session {outcome} for user {uid}")
+            return outcome
         except Exception as e:
             logger.error(f"Error saving learning session: {str(e)}")
             return False
-    
-    def _update_average_score(self, uid):
-        """Update user's average quiz score"""
-        try:
-            user_data = self.get_user_data(uid)
-            if user_data and user_data.get('quizScores'):
-                scores = [quiz.get('score', 0) for quiz in user_data['quizScores']]
-                if scores:
-                    average = sum(scores) / len(scores)
-                    self.db.collection('users').document(uid).update({
-                        'averageScore': round(average, 2)
-                    })
-        except Exception as e:
-            logger.error(f"Error updating average score: {str(e)}")
+
+    def _write_user(self, uid, writes):
+        """Apply (ref, data, method) writes for a user as one atomic batch.
+
+        Queued for the background writers when possible, otherwise (queue
+        disabled or full) committed here. The cached profile is evicted once
+        the writes land. Returns 'queued' or 'saved' accordingly.
+        """
+        if self.writes and self.writes.submit_group(writes, (self._forget_user, uid)):
+            return 'queued'
+        batch = self.db.batch()
+        for ref, data, method in writes:
+            getattr(batch, method)(ref, data)
+        batch.commit()
+        self._forget_user(uid)
+        return 'saved'
+
+    def _forget_user(self, uid):
+        """Drop the cached copy of a user document after writing to it"""
+        with self._user_cache_lock:
+            self._user_cache.pop(uid, None)
+
+def _with_average_score(user_data):
+    """Fill in averageScore from the running totals kept by save_quiz_result.
+
+    Profiles written before quizzes moved to a subcollection still hold their
+    earlier results in a quizScores array; those scores count towards the sum
+    (and were already counted in totalQuizzes).
+    """
+    total = user_data.get('totalQuizzes')
+    if 'scoreSum' in user_data and total:
+        score_sum = user_data['scoreSum'] + sum(quiz.get('score', 0) for quiz in user_data.get('quizScores', ()))
+        user_data['averageScore'] = round(score_sum / total, 2)
+    return user_data
 
 # Global Firebase manager instance
 firebase_manager = FirebaseManager()
@@ -257,8 +497,8 @@ def optional_auth(f):
     return decorated_function
 
 # Convenience functions
-def get_user_data(uid):
-    return firebase_manager.get_user_data(uid)
+def get_user_data(uid, field_paths=None):
+    return firebase_manager.get_user_data(uid, field_paths=field_paths)
 
 def create_user_profile(uid, email, name, additional_data=None):
     return firebase_manager.create_user_profile(uid, email, name, additional_data)
@@ -0,0 +1,72 @@
+"""SmartLearn Shared HTTP Pool
+One keep-alive requests.Session for every outbound API call (OpenAI, through
+the SDK or its REST fallback, Hugging Face and IntaSend), so the tutor, the
+quiz generator and the payment routes reuse warm TLS connections instead of
+each opening their own."""
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HUGGINGFACE_API = 'https://api-inference.huggingface.co'
+
+_session: requests.Session = None
+_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    # Only failed connects are retried here: the request never left, so a
+    # replay can't repeat it. A 5xx on a completion may already have been
+    # processed and billed, and the OpenAI callers back off on 429/5xx
+    # themselves (_openai_retry_delay), so status retries stay with them
+    retry = Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.5)
+    # pool_maxsize is per host; sized for the tutor's I/O workers plus quiz traffic
+    session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=50, max_retries=retry))
+    # Inference calls have no side effects and HF answers 503 while a model
+    # loads, so its POSTs are retried with backoff on 429/5xx
+    session.mount(HUGGINGFACE_API, _host_adapter(frozenset({'POST'})))
+    session.headers.update({
+        'Content-Type': 'application/json',
+        'User-Agent': f"smartlearn/{os.getenv('APP_VERSION', '0.1.0')}"
+    })
+    return session
+
+
+def shared_session() -> requests.Session:
+    """The process-wide session; auth headers differ per host and are passed per request."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def mount_host(base_url: str, retry_methods=frozenset({'GET'})):
+    """Give one API its own keep-alive pool on the shared session.
+
+    Only `retry_methods` are retried on 429/5xx, for services where a
+    replayed POST could repeat a side effect (e.g. creating a checkout).
+    """
+    shared_session().mount(base_url, _host_adapter(retry_methods))
+
+
+def _host_adapter(retry_methods) -> HTTPAdapter:
+    retry = Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=[429, 502, 503, 504],
+        allowed_methods=retry_methods,
+        raise_on_status=False
+    )
+    return HTTPAdapter(pool_connections=1, pool_maxsize=20, max_retries=retry)
+
+
+def use_for_openai_sdk(openai_module):
+    """Route the legacy openai SDK (0.x) through the shared session as well."""
+    if hasattr(openai_module, 'requestssession'):
+        openai_module.requestssession = shared_session()
@@ -1,5 +1,12 @@
 import functions_framework
+from ai_tutor import get_ai_tutor
 from app import app
+from quiz_generator import get_quiz_generator
+
+# Build the tutor and quiz generator while the instance starts, not on the
+# first student's request
+get_ai_tutor()
+get_quiz_generator()
 
 
 @functions_framework.http
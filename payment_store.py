@@ -5,10 +5,13 @@ In production, consider a full ORM and user authentication.
 from __future__ import annotations
 import sqlite3
 from pathlib import Path
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime
-import json
 import os
+import threading
+from contextlib import contextmanager
+
+import orjson
 
 DB_PATH = Path(os.getenv('PAYMENTS_DB_PATH', 'payments.db'))
 
@@ -25,58 +28,142 @@ CREATE TABLE IF NOT EXISTS payments (
     updated_at TEXT NOT NULL,
     raw_payload TEXT
 );
+CREATE TABLE IF NOT EXISTS payments_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    revision INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO payments_meta(id, revision) VALUES (1, 0);
+CREATE TRIGGER IF NOT EXISTS payments_revision_insert AFTER INSERT ON payments
+BEGIN UPDATE payments_meta SET revision = revision + 1 WHERE id = 1; END;
+CREATE TRIGGER IF NOT EXISTS payments_revision_update AFTER UPDATE ON payments
+BEGIN UPDATE payments_meta SET revision = revision + 1 WHERE id = 1; END;
 """
 
 STATUS_COMPLETED = 'completed'
 STATUS_PENDING = 'pending'
 STATUS_FAILED = 'failed'
 
+PAYMENT_COLUMNS = ["reference","email","amount","session_id","status","transaction_id","created_at","updated_at"]
+_SELECT_PAYMENT = f"SELECT {','.join(PAYMENT_COLUMNS)} FROM payments"
+
+
+# Per-connection settings; journal_mode=WAL is persistent and set once in init_payment_db
+_CONNECTION_PRAGMAS = """
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-64000;
+PRAGMA foreign_keys=ON;
+"""
+
+_local = threading.local()
+
 
 def _connect():
-    return sqlite3.connect(DB_PATH)
+    """This thread's connection, opened (and tuned) on first use and then reused.
+
+    The connection is in autocommit mode: reads run on their own, and writes
+    go through _write_transaction.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        # timeout is SQLite's busy wait for another process's write lock
+        conn = sqlite3.connect(DB_PATH, timeout=5, isolation_level=None)
+        conn.executescript(_CONNECTION_PRAGMAS)
+        _local.conn = conn
+    return conn
+
+
+@contextmanager
+def _write_transaction():
+    """BEGIN IMMEDIATE ... COMMIT on this thread's connection, rolled back on error.
+
+    Taking the write lock up front means a concurrent writer waits for it at
+    BEGIN, instead of failing with SQLITE_BUSY when a deferred read
+    transaction tries to upgrade.
+    """
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
 
 
 def init_payment_db():
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with _connect() as conn:
-        conn.execute(PAYMENT_SCHEMA)
-        conn.commit()
+    # WAL: readers (verify, admin listing) don't wait on a webhook's write
+    _connect().execute("PRAGMA journal_mode=WAL")
+    with _write_transaction() as conn:
+        # executescript would commit the open transaction first; run statement by statement
+        for statement in _schema_statements():
+            conn.execute(statement)
+
+
+def _schema_statements():
+    statement = ''
+    for line in PAYMENT_SCHEMA.strip().splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ''
 
 
 def create_payment(reference: str, email: str, amount: float, session_id: str):
     now = datetime.utcnow().isoformat()
-    with _connect() as conn:
+    with _write_transaction() as conn:
         conn.execute(
             "INSERT OR IGNORE INTO payments(reference,email,amount,session_id,status,created_at,updated_at) VALUES (?,?,?,?,?,?,?)",
             (reference, email, amount, session_id, STATUS_PENDING, now, now)
         )
-        conn.commit()
 
 
-def update_payment_status(reference: str, status: str, transaction_id: Optional[str] = None, raw_payload: Optional[Dict[str, Any]] = None):
+def update_payment_status(reference: str, status: str, transaction_id: Optional[str] = None, raw_payload: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Update a payment and return the updated record (None for an unknown reference)."""
     now = datetime.utcnow().isoformat()
-    payload_json = json.dumps(raw_payload) if raw_payload else None
-    with _connect() as conn:
+    payload_json = orjson.dumps(raw_payload).decode() if raw_payload else None
+    with _write_transaction() as conn:
         conn.execute(
             "UPDATE payments SET status=?, transaction_id=COALESCE(?, transaction_id), raw_payload=COALESCE(?, raw_payload), updated_at=? WHERE reference=?",
             (status, transaction_id, payload_json, now, reference)
         )
-        conn.commit()
+        # Read back inside the same transaction, so callers need no second lookup
+        record = _fetch_payment(conn, reference)
+    return record
+
+
+def _fetch_payment(conn, reference: str) -> Optional[Dict[str, Any]]:
+    row = conn.execute(f"{_SELECT_PAYMENT} WHERE reference=?", (reference,)).fetchone()
+    return dict(zip(PAYMENT_COLUMNS, row)) if row else None
 
 
 def get_payment(reference: str) -> Optional[Dict[str, Any]]:
-    with _connect() as conn:
-        cur = conn.execute("SELECT reference,email,amount,session_id,status,transaction_id,created_at,updated_at FROM payments WHERE reference=?", (reference,))
-        row = cur.fetchone()
-        if not row:
-            return None
-        keys = ["reference","email","amount","session_id","status","transaction_id","created_at","updated_at"]
-        return dict(zip(keys, row))
-
-
-def list_payments(limit: int = 50) -> List[Dict[str, Any]]:
-    with _connect() as conn:
-        cur = conn.execute("SELECT reference,email,amount,session_id,status,transaction_id,created_at,updated_at FROM payments ORDER BY id DESC LIMIT ?", (limit,))
-        rows = cur.fetchall()
-        keys = ["reference","email","amount","session_id","status","transaction_id","created_at","updated_at"]
-        return [dict(zip(keys, r)) for r in rows]
+    return _fetch_payment(_connect(), reference)
+
+
+def payments_revision() -> int:
+    """Counter bumped (by trigger) on every payment insert or update, in any process."""
+    return _connect().execute("SELECT revision FROM payments_meta WHERE id = 1").fetchone()[0]
+
+
+def list_payments(limit: int = 50, before: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Newest payments first; `before` (a page's next_id) continues after that page."""
+    return list_payments_page(limit, before)[0]
+
+
+def list_payments_page(limit: int = 50, before: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """One page of payments, newest first, and the `before` value for the next page (None on the last).
+
+    Keyset pagination on the primary key: each page is an index range scan,
+    however deep into the table it starts.
+    """
+    query = f"SELECT id,{','.join(PAYMENT_COLUMNS)} FROM payments"
+    params: tuple = ()
+    if before is not None:
+        query += " WHERE id < ?"
+        params = (before,)
+    # One extra row tells whether another page follows
+    rows = _connect().execute(query + " ORDER BY id DESC LIMIT ?", params + (limit + 1,)).fetchall()
+    next_id = rows[limit - 1][0] if len(rows) > limit else None
+    return [dict(zip(PAYMENT_COLUMNS, r[1:])) for r in rows[:limit]], next_id
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Pre-generate the /quiz/available catalog with the OpenAI Batch API
+
+    python prebuild_quizzes.py submit              # upload requests and start a batch
+    python prebuild_quizzes.py collect BATCH_ID    # store finished quizzes in the catalog
+
+Batch requests cost about half as much as live calls and complete within
+24 hours, so the common (subject, topic, difficulty, quiz type) combinations
+are built overnight and /quiz/generate serves them from QuizCatalog.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import requests
+from dotenv import load_dotenv
+
+from quiz_generator import AVAILABLE_QUIZZES, QuizCatalog, QuizGenerator
+
+OPENAI_API = 'https://api.openai.com/v1'
+
+# Stored quizzes hold the maximum /quiz/generate allows; requests sample from them
+CATALOG_QUESTIONS = 10
+
+
+def _headers() -> dict:
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        sys.exit("OPENAI_API_KEY is not set")
+    return {'Authorization': f'Bearer {api_key}'}
+
+
+def build_requests(generator: QuizGenerator) -> list:
+    """One chat/completions request per catalog combination"""
+    batch = []
+    for subject, topics in AVAILABLE_QUIZZES.items():
+        for topic in topics:
+            for difficulty in generator.difficulty_levels:
+                for quiz_type in generator.quiz_types:
+                    prompt = generator._create_quiz_prompt(
+                        subject, topic, difficulty, quiz_type, CATALOG_QUESTIONS)
+                    batch.append({
+                        'custom_id': QuizCatalog.key(subject, topic, difficulty, quiz_type),
+                        'method': 'POST',
+                        'url': '/v1/chat/completions',
+                        'body': {
+                            'model': 'gpt-4o',
+                            'messages': [
+                                {'role': 'system', 'content': generator.SYSTEM_PROMPT},
+                                {'role': 'user', 'content': prompt}
+                            ],
+                            'max_tokens': 4000,
+                            'temperature': 0.7,
+                            'response_format': {'type': 'json_object'}
+                        }
+                    })
+    return batch
+
+
+def submit(generator: QuizGenerator, jsonl_path: str, dry_run: bool):
+    batch = build_requests(generator)
+    with open(jsonl_path, 'w', encoding='utf-8') as f:
+        for item in batch:
+            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    print(f"📝 Wrote {len(batch)} quiz requests to {jsonl_path}")
+    if dry_run:
+        return
+
+    with open(jsonl_path, 'rb') as f:
+        upload = requests.post(f"{OPENAI_API}/files", headers=_headers(),
+                               files={'file': (os.path.basename(jsonl_path), f)},
+                               data={'purpose': 'batch'}, timeout=120)
+    upload.raise_for_status()
+
+    created = requests.post(f"{OPENAI_API}/batches", headers=_headers(), json={
+        'input_file_id': upload.json()['id'],
+        'endpoint': '/v1/chat/completions',
+        'completion_window': '24h'
+    }, timeout=30)
+    created.raise_for_status()
+    batch_id = created.json()['id']
+    print(f"🚀 Started batch {batch_id}; run `python prebuild_quizzes.py collect {batch_id}` once it completes")
+
+
+def collect(generator: QuizGenerator, batch_id: str):
+    status = requests.get(f"{OPENAI_API}/batches/{batch_id}", headers=_headers(), timeout=30)
+    status.raise_for_status()
+    info = status.json()
+    if info['status'] != 'completed':
+        sys.exit(f"⏸ Batch {batch_id} is {info['status']} ({info.get('request_counts')})")
+
+    output = requests.get(f"{OPENAI_API}/files/{info['output_file_id']}/content",
+                          headers=_headers(), timeout=120)
+    output.raise_for_status()
+
+    quizzes = {}
+    rejected = 0
+    for line in output.text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        subject, topic, difficulty, quiz_type = result['custom_id'].split('|')
+        response = result.get('response') or {}
+        if response.get('status_code') != 200:
+            rejected += 1
+            continue
+        text = generator._get_response_text(response['body']) or ''
+        quiz = generator._parse_quiz_json(text, subject, topic, difficulty, quiz_type)
+        if quiz is None or not generator._validate_quiz(quiz, CATALOG_QUESTIONS):
+            rejected += 1
+            continue
+        quizzes[result['custom_id']] = quiz
+
+    generator.catalog.put_many(quizzes)
+    print(f"✅ Stored {len(quizzes)} quizzes in the {generator.catalog.backend} catalog ({rejected} rejected)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    submit_parser = commands.add_parser('submit', help='write the request file and start a batch')
+    submit_parser.add_argument('--jsonl', default='quiz_batch.jsonl', help='where to write the batch input')
+    submit_parser.add_argument('--dry-run', action='store_true', help='only write the batch input file')
+    collect_parser = commands.add_parser('collect', help='store a completed batch in the catalog')
+    collect_parser.add_argument('batch_id')
+    args = parser.parse_args()
+
+    load_dotenv()
+    generator = QuizGenerator()
+    if args.command == 'submit':
+        submit(generator, args.jsonl, args.dry_run)
+    else:
+        collect(generator, args.batch_id)
+
+
+if __name__ == '__main__':
+    main()
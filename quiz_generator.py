@@ -4,24 +4,144 @@ Handles AI-generated quiz creation, quiz sessions, and automated grading
 """
 
 import os
-import openai
-import requests
+import asyncio
+import logging
 from typing import Dict, List, Tuple, Optional
 from datetime import datetime
 import random
-import json
+import orjson
+import threading
+from bisect import bisect_right
 from dotenv import load_dotenv
 
+from http_pool import shared_session, use_for_openai_sdk
+
+log = logging.getLogger('smartlearn.quiz')
+
+# Subjects and topics offered by /quiz/available (and pre-generated by prebuild_quizzes.py)
+AVAILABLE_QUIZZES = {
+    'Mathematics': ['Algebra', 'Geometry', 'Trigonometry', 'Calculus', 'Statistics'],
+    'Physics': ['Mechanics', 'Electricity', 'Waves', 'Optics', 'Modern Physics'],
+    'Biology': ['Cell Biology', 'Genetics', 'Ecology', 'Evolution', 'Human Biology'],
+    'Chemistry': ['Organic Chemistry', 'Inorganic Chemistry', 'Physical Chemistry', 'Analytical Chemistry'],
+    'History': ['Ancient History', 'Medieval History', 'Modern History', 'African History', 'World History'],
+    'Geography': ['Physical Geography', 'Human Geography', 'Economic Geography', 'Political Geography', 'Climate']
+}
+DIFFICULTY_LEVELS = ('beginner', 'intermediate', 'advanced')
+QUIZ_TYPES = ('concept_check', 'problem_solving', 'critical_thinking', 'application')
+
+# Post-quiz feedback by score band: below 60, 60-69, 70-79, 80-89, 90 and up
+_FEEDBACK_THRESHOLDS = (60, 70, 80, 90)
+_SCORE_FEEDBACK = (
+    ("📖 This topic needs more attention.",
+     "🔄 Consider reviewing the basics and asking the AI tutor for help."),
+    ("⚠️ You're making progress, but there's room for improvement.",
+     "🎯 Review the fundamental concepts before moving forward."),
+    ("✅ Good effort! You're on the right track.",
+     "📚 Focus on the areas where you made mistakes."),
+    ("👍 Great job! You have a solid understanding of this topic.",
+     "🔍 Review the incorrect answers to strengthen your knowledge."),
+    ("🎉 Excellent work! You've mastered this topic.",
+     "💡 Consider exploring more advanced concepts in this subject."),
+)
+_SUBJECT_FEEDBACK = {
+    'Mathematics': ("🧮 Practice more problems to improve your mathematical thinking.",),
+    'Physics': ("⚡ Focus on understanding the underlying principles.",),
+    'Biology': ("🔬 Try to connect concepts to real-world examples.",),
+}
+
+
+class QuizCatalog:
+    """Pre-generated quizzes keyed by subject, topic, difficulty and quiz type.
+
+    Filled offline by prebuild_quizzes.py. SMARTLEARN_QUIZ_CATALOG picks the
+    backend: 'file' (JSON at SMARTLEARN_QUIZ_CATALOG_PATH, the default),
+    'redis' (REDIS_URL) or 'none'.
+    """
+
+    REDIS_PREFIX = 'smartlearn:quiz:'
+
+    def __init__(self, backend: str = 'file', path: str = 'quiz_catalog.json'):
+        self.backend = backend
+        self.path = path
+        self._quizzes = {}
+        self._redis = None
+
+        if backend == 'redis':
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+                self._redis.ping()
+            except Exception as e:
+                log.warning("Quiz catalog: Redis unavailable, catalog disabled: %s", e)
+                self._redis = None
+                self.backend = 'none'
+        elif backend == 'file' and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    self._quizzes = orjson.loads(f.read())
+            except Exception as e:
+                log.warning("Quiz catalog: could not read %s: %s", path, e)
+
+    @classmethod
+    def from_env(cls) -> 'QuizCatalog':
+        return cls(
+            backend=os.getenv('SMARTLEARN_QUIZ_CATALOG', 'file').lower(),
+            path=os.getenv('SMARTLEARN_QUIZ_CATALOG_PATH', 'quiz_catalog.json')
+        )
+
+    @staticmethod
+    def key(subject: str, topic: str, difficulty: str, quiz_type: str) -> str:
+        return f"{subject}|{topic}|{difficulty}|{quiz_type}"
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return a private copy of the stored quiz, or None"""
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(self.REDIS_PREFIX + key)
+                return orjson.loads(raw) if raw else None
+            except Exception as e:
+                log.warning("Quiz catalog read failed: %s", e)
+                return None
+        quiz = self._quizzes.get(key)
+        # A JSON round trip copies plain quiz data several times faster than deepcopy
+        return orjson.loads(orjson.dumps(quiz)) if quiz is not None else None
+
+    def put_many(self, quizzes: Dict[str, Dict]):
+        if self._redis is not None:
+            pipe = self._redis.pipeline()
+            for key, quiz in quizzes.items():
+                pipe.set(self.REDIS_PREFIX + key, orjson.dumps(quiz))
+            pipe.execute()
+        elif self.backend == 'file':
+            self._quizzes.update(quizzes)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(self._quizzes))
+            os.replace(tmp_path, self.path)
+
+    def __len__(self) -> int:
+        if self._redis is not None:
+            return sum(1 for _ in self._redis.scan_iter(match=self.REDIS_PREFIX + '*', count=1000))
+        return len(self._quizzes)
+
+
 class QuizGenerator:
+    # Shared by live generation and the offline batch in prebuild_quizzes.py
+    SYSTEM_PROMPT = "You are SmartLearn, an expert quiz creator for African high school students. Create engaging, curriculum-aligned multiple-choice questions. Always answer with a JSON object."
+
     def __init__(self):
         """Initialize the quiz generator with OpenAI client"""
-        # Load environment variables from .env file
-        load_dotenv()
+        # Load environment variables from .env file (skipped when the deployment injects them)
+        if os.getenv('SMARTLEARN_SKIP_DOTENV') != '1':
+            load_dotenv()
         
         self.client = None
+        self._openai = None  # openai module, imported on first client init
         self.huggingface_api_key = os.getenv('HUGGINGFACE_API_KEY')
         self.use_huggingface = os.getenv(
             'USE_HUGGINGFACE', 'false').lower() == 'true'
+        self.catalog = QuizCatalog.from_env()
         self._initialize_client()
         
         # Quiz difficulty levels
@@ -44,6 +164,9 @@ class QuizGenerator:
         try:
             api_key = os.getenv('OPENAI_API_KEY')
             if api_key and api_key.startswith('sk-'):
+                import openai
+                self._openai = openai
+                use_for_openai_sdk(openai)
                 try:
                     self.client = openai.OpenAI(api_key=api_key)
                     print("✅ Quiz Generator OpenAI client initialized successfully")
@@ -85,6 +208,11 @@ class QuizGenerator:
         print(f"🔍 OpenAI client status: {self.client is not None}")
         print(f"� Hugging Face enabled: {self.use_huggingface}")
         
+        # Pre-generated by the offline batch job, if this combination was built
+        prebuilt = self._catalog_quiz(subject, topic, difficulty, quiz_type, num_questions)
+        if prebuilt is not None:
+            return prebuilt
+        
         # Try OpenAI first
         if self.client:
             try:
@@ -105,6 +233,109 @@ class QuizGenerator:
         print("⚠️  All AI services failed, using fallback quiz")
         return self._generate_fallback_quiz(subject, topic, difficulty, num_questions)
 
+    def _catalog_quiz(self, subject: str, topic: str, difficulty: str,
+                      quiz_type: str, num_questions: int) -> Optional[Dict]:
+        """Draw num_questions from the pre-generated quiz, or None if there isn't one"""
+        stored = self.catalog.get(QuizCatalog.key(subject, topic, difficulty, quiz_type))
+        if not stored or len(stored.get('questions', [])) < num_questions:
+            return None
+        
+        # Sample so repeat takers don't always see the same set
+        stored['questions'] = random.sample(stored['questions'], num_questions)
+        stored['metadata'] = {
+            'subject': subject,
+            'topic': topic,
+            'difficulty': difficulty,
+            'quiz_type': quiz_type,
+            'num_questions': num_questions,
+            'generated_at': datetime.now().isoformat(),
+            'time_limit': self._calculate_time_limit(difficulty, num_questions),
+            'ai_provider': 'catalog'
+        }
+        log.debug("Serving pre-generated quiz for %s / %s", subject, topic)
+        return stored
+
+    async def agenerate_quiz(self, subject: str, topic: str, difficulty: str = 'intermediate',
+                             quiz_type: str = 'concept_check', num_questions: int = 5) -> Dict:
+        """Async twin of generate_quiz for event-loop (ASGI) callers.
+
+        All questions come from one provider call, so there is nothing to
+        fan out; the blocking call runs on a worker thread so the loop can
+        serve other students meanwhile.
+        """
+        return await asyncio.to_thread(
+            self.generate_quiz, subject, topic, difficulty, quiz_type, num_questions)
+
+    async def agenerate_quizzes(self, items: List[Tuple[str, str, str, str, int]],
+                                max_concurrent: int = 10) -> List[Dict]:
+        """Generate several quizzes concurrently, in input order.
+
+        Each item is (subject, topic, difficulty, quiz_type, num_questions);
+        max_concurrent bounds in-flight provider calls.
+        """
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        async def _generate(args) -> Dict:
+            async with semaphore:
+                return await self.agenerate_quiz(*args)
+
+        return await asyncio.gather(*(_generate(args) for args in items))
+
+    def _call_openai_chat(self, **kwargs):
+        """Adapter to call OpenAI chat/completions across SDK versions for quiz_generator."""
+        if not self.client:
+            raise Exception("OpenAI client not initialized")
+
+        try:
+            if hasattr(self.client, 'chat') and hasattr(self.client.chat, 'completions'):
+                return self.client.chat.completions.create(**kwargs)
+        except Exception:
+            pass
+
+        try:
+            return self._openai.ChatCompletion.create(**kwargs)
+        except Exception as e:
+            try:
+                return self._openai.Completion.create(**kwargs)
+            except Exception:
+                raise e
+
+    def _get_response_text(self, resp) -> Optional[str]:
+        """Normalize different OpenAI response shapes to a text string for quiz_generator."""
+        if resp is None:
+            return None
+
+        try:
+            if hasattr(resp, 'choices'):
+                choice = resp.choices[0]
+                if hasattr(choice, 'message') and hasattr(choice.message, 'content'):
+                    return choice.message.content
+                if isinstance(choice, dict) and 'message' in choice and 'content' in choice['message']:
+                    return choice['message']['content']
+                if 'text' in choice:
+                    return choice['text']
+        except Exception:
+            pass
+
+        try:
+            if isinstance(resp, dict):
+                if 'choices' in resp and len(resp['choices']) > 0:
+                    ch = resp['choices'][0]
+                    if isinstance(ch, dict):
+                        if 'message' in ch and 'content' in ch['message']:
+                            return ch['message']['content']
+                        if 'text' in ch:
+                            return ch['text']
+                if 'generated_text' in resp:
+                    return resp['generated_text']
+        except Exception:
+            pass
+
+        try:
+            return str(resp)
+        except Exception:
+            return None
+
     def _generate_openai_quiz(self, subject: str, topic: str, difficulty: str, 
                              quiz_type: str, num_questions: int) -> Dict:
         """Generate quiz using OpenAI with improved error handling"""
@@ -117,15 +348,17 @@ class QuizGenerator:
             max_retries = 3
             for attempt in range(max_retries):
                 try:
-                    response = self.client.chat.completions.create(
+                    # One request for every question; JSON mode so it parses in one pass
+                    response = self._call_openai_chat(
                         model="gpt-4o",
                         messages=[
-                            {"role": "system", "content": "You are SmartLearn, an expert quiz creator for African high school students. Create engaging, curriculum-aligned multiple-choice questions."},
+                            {"role": "system", "content": self.SYSTEM_PROMPT},
                             {"role": "user", "content": prompt}
                         ],
                         max_tokens=2000,
                         temperature=0.7,
-                        timeout=30  # Add timeout
+                        timeout=30,  # Add timeout
+                        response_format={"type": "json_object"}
                     )
                     break  # Success, exit retry loop
                 except Exception as e:
@@ -137,15 +370,17 @@ class QuizGenerator:
             
             print("✅ Quiz Generator OpenAI API call successful!")
             # Extract the response content
-            ai_response = response.choices[0].message.content
+            ai_response = self._get_response_text(response) or ""
             print(f"📄 AI quiz response length: {len(ai_response)} characters")
             
             # Validate response
             if not ai_response or len(ai_response.strip()) < 100:
                 raise Exception("AI quiz response too short or empty")
             
-            # Parse the quiz from AI response
-            quiz_data = self._parse_quiz_response(ai_response, subject, topic, difficulty, quiz_type)
+            # Parse the quiz from AI response (text format if the model ignored JSON mode)
+            quiz_data = self._parse_quiz_json(ai_response, subject, topic, difficulty, quiz_type)
+            if quiz_data is None:
+                quiz_data = self._parse_quiz_response(ai_response, subject, topic, difficulty, quiz_type)
             
             # Validate quiz data
             if not self._validate_quiz(quiz_data, num_questions):
@@ -214,7 +449,7 @@ Make questions educational for African high school students."""
                         }
                     }
 
-                    response = requests.post(
+                    response = shared_session().post(
                         f"https://api-inference.huggingface.co/models/{model}",
                         headers=headers,
                         json=payload,
@@ -284,7 +519,7 @@ QUIZ REQUIREMENTS:
 - Number of questions: {num_questions}
 - Quiz type: {quiz_type} ({quiz_type_info})
 - Difficulty: {difficulty} (suitable for {difficulty_info['complexity']} understanding)
-- Format: Multiple choice with 4 options (A, B, C, D)
+- Format: Multiple choice with 4 options
 - Target audience: African high school students (KCSE/WAEC level)
 
 QUESTION GUIDELINES:
@@ -295,34 +530,71 @@ QUESTION GUIDELINES:
 5. Use real-world examples relevant to African context when possible
 
 RESPONSE FORMAT:
-Please structure your response exactly as follows:
-
-QUIZ TITLE: [Engaging quiz title]
-
-QUESTION 1:
-[Question text]
-A) [Option A]
-B) [Option B]
-C) [Option C]
-D) [Option D]
-CORRECT ANSWER: [A/B/C/D]
-EXPLANATION: [Brief explanation of why this is correct]
-
-QUESTION 2:
-[Question text]
-A) [Option A]
-B) [Option B]
-C) [Option C]
-D) [Option D]
-CORRECT ANSWER: [A/B/C/D]
-EXPLANATION: [Brief explanation of why this is correct]
-
-[Continue for all {num_questions} questions]
+Respond with a single JSON object and nothing else:
+{{
+  "title": "Engaging quiz title",
+  "questions": [
+    {{
+      "question": "Question text",
+      "options": ["Option A", "Option B", "Option C", "Option D"],
+      "correct_answer": "The correct option, copied exactly from options",
+      "explanation": "Brief explanation of why this is correct"
+    }}
+  ]
+}}
+
+The "questions" array must contain exactly {num_questions} questions.
 
 Remember: Make questions engaging, educational, and appropriate for {difficulty} level students."""
 
         return prompt
     
+    def _parse_quiz_json(self, ai_response: str, subject: str, topic: str,
+                         difficulty: str, quiz_type: str) -> Optional[Dict]:
+        """Parse a JSON-mode quiz response; None if it isn't usable JSON"""
+        start, end = ai_response.find('{'), ai_response.rfind('}')
+        if start == -1 or end <= start:
+            return None
+        try:
+            data = orjson.loads(ai_response[start:end + 1])
+        except ValueError:
+            return None
+        if not isinstance(data, dict) or not isinstance(data.get('questions'), list):
+            return None
+        
+        questions = []
+        for item in data['questions']:
+            if not isinstance(item, dict):
+                continue
+            questions.append({
+                'question': str(item.get('question', '')).strip(),
+                'options': [str(option).strip() for option in item.get('options') or []],
+                'correct_answer': str(item.get('correct_answer', '')).strip(),
+                'explanation': str(item.get('explanation', '')).strip()
+            })
+        
+        return self._normalize_correct_answers({
+            'title': str(data.get('title', '')).strip(),
+            'questions': questions,
+            'subject': subject,
+            'topic': topic,
+            'difficulty': difficulty,
+            'quiz_type': quiz_type
+        })
+    
+    def _normalize_correct_answers(self, quiz_data: Dict) -> Dict:
+        """Store correct answers as option text, which is what the front end submits"""
+        for question in quiz_data['questions']:
+            options = question['options']
+            answer = question['correct_answer']
+            if answer in options or len(options) != 4 or not answer:
+                continue
+            # "B", "B)" or "B) option text" -> the second option
+            letter = answer[0].upper()
+            if letter in 'ABCD' and (len(answer) == 1 or answer[1] in ').:'):
+                question['correct_answer'] = options['ABCD'.index(letter)]
+        return quiz_data
+    
     def _parse_quiz_response(self, ai_response: str, subject: str, topic: str, 
                            difficulty: str, quiz_type: str) -> Dict:
         """Parse the AI response to extract quiz data"""
@@ -398,7 +670,7 @@ Remember: Make questions engaging, educational, and appropriate for {difficulty}
                 'explanation': current_explanation
             })
         
-        return quiz_data
+        return self._normalize_correct_answers(quiz_data)
     
     def _validate_quiz(self, quiz_data: Dict, expected_questions: int) -> bool:
         """Validate that the quiz data is complete and correct"""
@@ -557,29 +829,29 @@ Remember: Make questions engaging, educational, and appropriate for {difficulty}
             'topic': quiz_data.get('topic', 'Unknown')
         }
         
-        for i, (question, student_answer) in enumerate(zip(quiz_data['questions'], student_answers)):
-            correct_answer = question['correct_answer']
-            is_correct = student_answer == correct_answer
-            
-            if is_correct:
-                results['correct_answers'] += 1
-            else:
-                results['incorrect_answers'] += 1
-            
-            question_result = {
-                'question_number': i + 1,
+        questions = quiz_data['questions']
+        # Mark every answer in one pass; the counts and score derive from the marks
+        marks = [student_answer == question['correct_answer']
+                 for question, student_answer in zip(questions, student_answers)]
+        correct = sum(marks)
+        results['correct_answers'] = correct
+        results['incorrect_answers'] = len(marks) - correct
+        results['question_results'] = [
+            {
+                'question_number': i,
                 'question': question['question'],
                 'student_answer': student_answer,
-                'correct_answer': correct_answer,
+                'correct_answer': question['correct_answer'],
                 'is_correct': is_correct,
                 'explanation': question['explanation'],
                 'options': question['options']
             }
-            
-            results['question_results'].append(question_result)
+            for i, (question, student_answer, is_correct)
+            in enumerate(zip(questions, student_answers, marks), start=1)
+        ]
         
         # Calculate score
-        results['score_percentage'] = (results['correct_answers'] / results['total_questions']) * 100
+        results['score_percentage'] = (correct / results['total_questions']) * 100
         
         # Generate feedback based on performance
         results['feedback'] = self._generate_performance_feedback(results)
@@ -589,32 +861,9 @@ Remember: Make questions engaging, educational, and appropriate for {difficulty}
     def _generate_performance_feedback(self, results: Dict) -> List[str]:
         """Generate personalized feedback based on quiz performance"""
         
-        feedback = []
-        score = results['score_percentage']
-        
-        if score >= 90:
-            feedback.append("🎉 Excellent work! You've mastered this topic.")
-            feedback.append("💡 Consider exploring more advanced concepts in this subject.")
-        elif score >= 80:
-            feedback.append("👍 Great job! You have a solid understanding of this topic.")
-            feedback.append("🔍 Review the incorrect answers to strengthen your knowledge.")
-        elif score >= 70:
-            feedback.append("✅ Good effort! You're on the right track.")
-            feedback.append("📚 Focus on the areas where you made mistakes.")
-        elif score >= 60:
-            feedback.append("⚠️ You're making progress, but there's room for improvement.")
-            feedback.append("🎯 Review the fundamental concepts before moving forward.")
-        else:
-            feedback.append("📖 This topic needs more attention.")
-            feedback.append("🔄 Consider reviewing the basics and asking the AI tutor for help.")
-        
+        feedback = list(_SCORE_FEEDBACK[bisect_right(_FEEDBACK_THRESHOLDS, results['score_percentage'])])
         # Subject-specific feedback
-        if results['subject'] == 'Mathematics':
-            feedback.append("🧮 Practice more problems to improve your mathematical thinking.")
-        elif results['subject'] == 'Physics':
-            feedback.append("⚡ Focus on understanding the underlying principles.")
-        elif results['subject'] == 'Biology':
-            feedback.append("🔬 Try to connect concepts to real-world examples.")
+        feedback.extend(_SUBJECT_FEEDBACK.get(results['subject'], ()))
         
         return feedback
     
@@ -656,65 +905,13 @@ Remember: Make questions engaging, educational, and appropriate for {difficulty}
 
 # Global instance - will be initialized when needed
 quiz_generator = None
+_quiz_generator_lock = threading.Lock()
 
 def get_quiz_generator():
     """Get or create quiz generator instance"""
     global quiz_generator
     if quiz_generator is None:
-        quiz_generator = QuizGenerator()
+        with _quiz_generator_lock:
+            if quiz_generator is None:
+                quiz_generator = QuizGenerator()
     return quiz_generator
-
-    def _call_openai_chat(self, **kwargs):
-        """Adapter to call OpenAI chat/completions across SDK versions for quiz_generator."""
-        if not self.client:
-            raise Exception("OpenAI client not initialized")
-
-        try:
-            if hasattr(self.client, 'chat') and hasattr(self.client.chat, 'completions'):
-                return self.client.chat.completions.create(**kwargs)
-        except Exception:
-            pass
-
-        try:
-            return openai.ChatCompletion.create(**kwargs)
-        except Exception as e:
-            try:
-                return openai.Completion.create(**kwargs)
-            except Exception:
-                raise e
-
-    def _get_response_text(self, resp) -> Optional[str]:
-        """Normalize different OpenAI response shapes to a text string for quiz_generator."""
-        if resp is None:
-            return None
-
-        try:
-            if hasattr(resp, 'choices'):
-                choice = resp.choices[0]
-                if hasattr(choice, 'message') and hasattr(choice.message, 'content'):
-                    return choice.message.content
-                if isinstance(choice, dict) and 'message' in choice and 'content' in choice['message']:
-                    return choice['message']['content']
-                if 'text' in choice:
-                    return choice['text']
-        except Exception:
-            pass
-
-        try:
-            if isinstance(resp, dict):
-                if 'choices' in resp and len(resp['choices']) > 0:
-                    ch = resp['choices'][0]
-                    if isinstance(ch, dict):
-                        if 'message' in ch and 'content' in ch['message']:
-                            return ch['message']['content']
-                        if 'text' in ch:
-                            return ch['text']
-                if 'generated_text' in resp:
-                    return resp['generated_text']
-        except Exception:
-            pass
-
-        try:
-            return str(resp)
-        except Exception:
-            return None
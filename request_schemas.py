@@ -0,0 +1,39 @@
+"""SmartLearn Request Schemas
+Typed bodies for the JSON POST routes. msgspec decodes and validates the raw
+request bytes in one C-level pass, so routes get a struct with defaults
+filled in instead of a dict to pick apart with .get()."""
+
+from typing import Any, Dict, List, Optional, Union
+
+import msgspec
+
+Number = Union[int, float]
+
+
+class AskRequest(msgspec.Struct):
+    """/ask and /ask/stream"""
+    question: str = ''
+    subject: str = 'General'
+
+
+class GenerateQuizRequest(msgspec.Struct):
+    """/quiz/generate; unknown difficulty / quiz_type values fall back to defaults in the route"""
+    subject: str = 'General'
+    topic: str = 'General'
+    difficulty: str = 'intermediate'
+    quiz_type: str = 'concept_check'
+    num_questions: int = 5
+
+
+class SubmitQuizRequest(msgspec.Struct):
+    """/quiz/<quiz_id>/submit; unanswered questions arrive as null"""
+    answers: List[Optional[str]] = []
+    time_taken: Number = 0
+
+
+class QuizResultRequest(msgspec.Struct):
+    """/quiz/result (legacy)"""
+    subject: str = 'General'
+    quiz_data: Dict[str, Any] = {}
+    score: Number = 0
+    time_taken: Number = 0
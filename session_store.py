@@ -0,0 +1,261 @@
+"""SmartLearn Student Session Store
+Keeps StudentSession objects between requests. In-process memory by default;
+SESSION_BACKEND=redis shares sessions across workers and survives restarts."""
+
+import logging
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import orjson
+from cachetools import TTLCache
+
+from student_session import StudentSession
+
+log = logging.getLogger('smartlearn.sessions')
+
+
+class MemorySessionStore:
+    """Sessions held by this process, dropped after ttl seconds without a save.
+
+    About maxsize sessions are kept (rounded up to a multiple of SHARDS);
+    past that the least recently used go first, so memory stays bounded
+    however many visitors arrive. Sessions are striped over SHARDS caches
+    with a lock each, so concurrent requests for different students rarely
+    wait on one another.
+
+    TTLCache only purges expired sessions when its shard is next written, so
+    a daemon thread sweeps every shard each sweep_interval seconds (0 disables)
+    to free sessions in shards that have gone quiet.
+    """
+
+    backend = 'memory'
+    SHARDS = 64  # power of two, see _shard
+
+    def __init__(self, ttl: int = 3600, maxsize: int = 10000, sweep_interval: float = 60):
+        per_shard = max(1, -(-maxsize // self.SHARDS))
+        self._shards = [(TTLCache(maxsize=per_shard, ttl=ttl), threading.Lock())
+                        for _ in range(self.SHARDS)]
+        self._quotas = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._quota_lock = threading.Lock()
+        if sweep_interval > 0:
+            threading.Thread(target=self._sweep_forever, args=(sweep_interval,),
+                             name='session-sweeper', daemon=True).start()
+
+    def sweep(self) -> int:
+        """Drop every expired session now; returns how many were removed."""
+        removed = 0
+        for sessions, lock in self._shards:
+            with lock:
+                removed += len(sessions.expire())
+        return removed
+
+    def _sweep_forever(self, interval: float):
+        while True:
+            time.sleep(interval)
+            removed = self.sweep()
+            if removed:
+                log.debug("Swept %d expired sessions", removed)
+
+    def _shard(self, session_id: str):
+        return self._shards[hash(session_id) & (self.SHARDS - 1)]
+
+    def get(self, session_id: str) -> Optional[StudentSession]:
+        sessions, lock = self._shard(session_id)
+        with lock:
+            return sessions.get(session_id)
+
+    def save(self, student_session: StudentSession):
+        sessions, lock = self._shard(student_session.session_id)
+        # Re-inserting restarts the TTL, so active students are never evicted
+        with lock:
+            sessions[student_session.session_id] = student_session
+
+    def delete(self, session_id: str):
+        sessions, lock = self._shard(session_id)
+        with lock:
+            sessions.pop(session_id, None)
+
+    def reserve_quota(self, key: str, used: int = 0) -> int:
+        """Atomically take one unit of a per-key quota; returns the count including it.
+
+        `used` seeds a key seen for the first time (e.g. a session's existing
+        quiz count). Call release_quota if the reserved work doesn't happen.
+        """
+        with self._quota_lock:
+            count = self._quotas.get(key, used) + 1
+            self._quotas[key] = count
+            return count
+
+    def release_quota(self, key: str):
+        with self._quota_lock:
+            if self._quotas.get(key, 0) > 0:
+                self._quotas[key] -= 1
+
+    def __len__(self) -> int:
+        total = 0
+        for sessions, lock in self._shards:
+            with lock:
+                total += len(sessions)
+        return total
+
+
+class RedisSessionStore:
+    """Sessions serialized with StudentSession.to_dict under a sliding Redis TTL.
+
+    save() snapshots the session on the caller's thread and leaves the network
+    write to a background thread, so responses don't wait on Redis. Until a
+    write lands, get() in this process answers from the pending snapshot.
+
+    Sessions this process reads or saves are also kept in memory for
+    local_ttl seconds (0 disables), so a student's back-to-back requests skip
+    the Redis round trip and decode. Every write is announced on a pub/sub
+    channel and other processes drop their copy; local_ttl bounds staleness
+    should an announcement be missed while a subscriber reconnects.
+    """
+
+    backend = 'redis'
+    PREFIX = 'smartlearn:session:'
+    QUOTA_PREFIX = 'smartlearn:quota:'
+    CHANNEL = 'smartlearn:session-invalidate'
+
+    def __init__(self, client, ttl: int = 3600, local_ttl: float = 5, local_maxsize: int = 10000):
+        self._redis = client
+        self.ttl = ttl
+        # One writer keeps successive saves of a session in order
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-write')
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._local = TTLCache(maxsize=local_maxsize, ttl=local_ttl) if local_ttl > 0 else None
+        # Tags this process's announcements so it doesn't evict its own writes
+        self._origin = secrets.token_hex(8)
+        if self._local is not None:
+            threading.Thread(target=self._listen_for_invalidations,
+                             name='session-invalidations', daemon=True).start()
+
+    def get(self, session_id: str) -> Optional[StudentSession]:
+        try:
+            with self._lock:
+                if self._local is not None:
+                    student_session = self._local.get(session_id)
+                    if student_session is not None:
+                        return student_session
+                raw = self._pending.get(session_id)
+            if raw is None:
+                raw = self._redis.get(self.PREFIX + session_id)
+            if not raw:
+                return None
+            student_session = StudentSession.from_dict(orjson.loads(raw))
+            self._remember(student_session)
+            return student_session
+        except Exception as e:
+            log.warning("Session read failed for %s: %s", session_id, e)
+            return None
+
+    def save(self, student_session: StudentSession):
+        session_id = student_session.session_id
+        raw = orjson.dumps(student_session.to_dict())
+        with self._lock:
+            self._pending[session_id] = raw
+        self._remember(student_session)
+        self._writer.submit(self._write, session_id, raw)
+
+    def _remember(self, student_session: StudentSession):
+        if self._local is not None:
+            with self._lock:
+                self._local[student_session.session_id] = student_session
+
+    def _write(self, session_id: str, raw: bytes):
+        try:
+            self._redis.setex(self.PREFIX + session_id, self.ttl, raw)
+            self._announce(session_id)
+        except Exception as e:
+            log.warning("Session write failed for %s: %s", session_id, e)
+        with self._lock:
+            # A newer save may have queued meanwhile; leave its snapshot in place
+            if self._pending.get(session_id) is raw:
+                del self._pending[session_id]
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._pending.pop(session_id, None)
+            if self._local is not None:
+                self._local.pop(session_id, None)
+        # Queued behind any pending write so that write can't resurrect the key
+        self._writer.submit(self._delete, session_id)
+
+    def _delete(self, session_id: str):
+        try:
+            self._redis.delete(self.PREFIX + session_id)
+            self._announce(session_id)
+        except Exception as e:
+            log.warning("Session delete failed for %s: %s", session_id, e)
+
+    def _announce(self, session_id: str):
+        if self._local is not None:
+            self._redis.publish(self.CHANNEL, f'{self._origin}:{session_id}')
+
+    def _listen_for_invalidations(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.CHANNEL)
+                for message in pubsub.listen():
+                    origin, _, session_id = message['data'].decode().partition(':')
+                    if origin != self._origin:
+                        with self._lock:
+                            self._local.pop(session_id, None)
+            except Exception as e:
+                log.warning("Session invalidation feed lost, reconnecting: %s", e)
+            # Announcements may have been missed while disconnected
+            with self._lock:
+                self._local.clear()
+            time.sleep(1)
+
+    def reserve_quota(self, key: str, used: int = 0) -> int:
+        """MemorySessionStore.reserve_quota as one pipelined SET NX / INCR / EXPIRE."""
+        redis_key = self.QUOTA_PREFIX + key
+        pipe = self._redis.pipeline()
+        pipe.set(redis_key, used, nx=True, ex=self.ttl)
+        pipe.incr(redis_key)
+        pipe.expire(redis_key, self.ttl)
+        return int(pipe.execute()[1])
+
+    def release_quota(self, key: str):
+        try:
+            self._redis.decr(self.QUOTA_PREFIX + key)
+        except Exception as e:
+            log.warning("Quota release failed for %s: %s", key, e)
+
+    def __len__(self) -> int:
+        # SCAN rather than KEYS so a large keyspace doesn't block Redis
+        return sum(1 for _ in self._redis.scan_iter(match=self.PREFIX + '*', count=1000))
+
+
+def session_store_from_env(ttl: int = 3600):
+    """Build the store named by SESSION_BACKEND (memory | redis).
+
+    SESSION_MAXSIZE caps the in-memory store (default 10000 sessions);
+    SESSION_REDIS_MAX_CONNECTIONS bounds the Redis pool (default 64) and
+    SESSION_LOCAL_TTL is how long Redis-backed sessions are also held in
+    process memory (default 5 seconds, 0 disables).
+    """
+    if os.getenv('SESSION_BACKEND', 'memory').lower() == 'redis':
+        try:
+            import redis
+            # Bounded pool: under a burst, workers wait briefly for a connection
+            # instead of opening one per thread against Redis' maxclients
+            pool = redis.BlockingConnectionPool.from_url(
+                os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+                max_connections=int(os.getenv('SESSION_REDIS_MAX_CONNECTIONS', '64')),
+                timeout=5)
+            client = redis.Redis(connection_pool=pool)
+            client.ping()
+            return RedisSessionStore(client, ttl=ttl,
+                                     local_ttl=float(os.getenv('SESSION_LOCAL_TTL', '5')))
+        except Exception as e:
+            log.warning("Redis session store unavailable, falling back to memory: %s", e)
+    return MemorySessionStore(ttl=ttl, maxsize=int(os.getenv('SESSION_MAXSIZE', '10000')))
@@ -47,6 +47,37 @@ def test_fallback():
         return False
 
 
+def test_safe_eval_limits():
+    """Test that oversized arithmetic is refused quickly instead of hanging"""
+    import time
+    from ai_tutor import _safe_eval
+
+    try:
+        assert _safe_eval('2+3*4') == 14
+        assert _safe_eval('2**100') == 2 ** 100
+        oversized = [
+            '9**9**9',
+            '((9**99)**99)**99',
+            '(((9**99)**99)**99)**99',
+            '*'.join(['(10**100)'] * 400),
+            '*'.join(['99999999999'] * 200),
+        ]
+        for expr in oversized:
+            start = time.perf_counter()
+            try:
+                _safe_eval(expr)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError(f"{expr[:30]} was evaluated")
+            assert time.perf_counter() - start < 1, f"{expr[:30]} took too long"
+        print("✅ Safe arithmetic evaluation bounded")
+        return True
+    except Exception as e:
+        print(f"❌ Test failed: {e}")
+        return False
+
+
 if __name__ == "__main__":
     print("🚀 SmartLearn AI Test")
     print("=" * 30)
@@ -54,6 +85,8 @@ if __name__ == "__main__":
     success = test_imports()
     if success:
         success = test_fallback()
+    if success:
+        success = test_safe_eval_limits()
 
     print("=" * 30)
     if success:
@@ -90,7 +90,8 @@ function handleAuthStateChange(user) {
 
 async function createUserProfileIfNeeded(user) {
   try {
-    const response = await makeAuthenticatedRequest('/api/user-profile', {
+    // Only existence matters here; skip downloading the quiz/learning history
+    const response = await makeAuthenticatedRequest('/api/user-profile?fields=uid', {
       method: 'GET'
     });
 
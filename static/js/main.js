@@ -76,7 +76,7 @@ async function askTutor() {
   showLoading();
 
   try {
-    const response = await fetch('/ask', {
+    const response = await fetch('/ask/stream', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -92,7 +92,11 @@ async function askTutor() {
       throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
     }
 
-    const data = await response.json();
+    // Show the answer as it is written, then swap in the formatted final payload
+    const data = await readAnswerStream(response, showStreamingAnswer);
+    if (!data) {
+      throw new Error('The answer stream ended unexpectedly');
+    }
     displayResponse(data);
 
     // Auto-load dashboard after asking a question
@@ -106,6 +110,66 @@ async function askTutor() {
   }
 }
 
+// Read the /ask/stream server-sent events: "data: {delta}" chunks while the
+// answer is generated, then "event: done" carrying the full /ask payload
+async function readAnswerStream(response, onDelta) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) {
+      return null;
+    }
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let eventName = 'message';
+      let payload = '';
+      for (const line of rawEvent.split('\n')) {
+        if (line.startsWith('event:')) {
+          eventName = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+          payload += line.slice(5).trim();
+        }
+      }
+      if (!payload) {
+        continue;
+      }
+
+      const message = JSON.parse(payload);
+      if (eventName === 'done') {
+        reader.cancel();
+        return message;
+      }
+      if (message.delta) {
+        onDelta(message.delta);
+      }
+    }
+  }
+}
+
+// Append a streamed chunk of the answer (plain text until the final payload arrives)
+function showStreamingAnswer(delta) {
+  let streamingText = document.getElementById('streaming-answer');
+  if (!streamingText) {
+    const responseArea = document.getElementById('response');
+    responseArea.innerHTML = `
+        <div class="response-content">
+            <h3>Answer:</h3>
+            <div id="streaming-answer" class="answer-content" style="white-space: pre-wrap;"></div>
+        </div>
+    `;
+    streamingText = document.getElementById('streaming-answer');
+  }
+  streamingText.textContent += delta;
+}
+
 // Display the AI response
 function displayResponse(data) {
   console.log('displayResponse called with data:', data);
@@ -6,7 +6,7 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 from collections import defaultdict
 import random
-import uuid
+import secrets
 
 
 class StudentSession:
@@ -15,6 +15,8 @@ class StudentSession:
         self.session_id = session_id
         self.created_at = datetime.now()
         self.last_activity = datetime.now()
+        # Bumped by every change, so readers can tell whether derived views are stale
+        self.revision = 0
 
         # Learning data
         self.questions_asked: List[Dict] = []
@@ -23,6 +25,17 @@ class StudentSession:
         self.learning_strengths = defaultdict(int)
         self.learning_gaps = defaultdict(int)
 
+        # Running per-subject tallies of the lists above, kept as events are
+        # recorded so dashboards and learning tips don't rescan the history
+        self._question_counts = defaultdict(int)
+        self._score_totals = defaultdict(int)
+        self._score_counts = defaultdict(int)
+        # Same for quiz_history (completed generated quizzes)
+        self._history_totals = defaultdict(int)
+        self._history_counts = defaultdict(int)
+        # (version, summary) memo for get_progress_summary
+        self._summary_cache = None
+
         # Quiz management (Phase 4)
         self.generated_quizzes: Dict[str, Dict] = {}
         self.quiz_sessions: Dict[str, Dict] = {}
@@ -40,9 +53,10 @@ class StudentSession:
 
     def add_question(self, subject: str, question: str, ai_response: Dict):
         """Record a new question and AI response."""
+        now = datetime.now()
         question_data = {
             'id': len(self.questions_asked) + 1,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': now.isoformat(),
             'subject': subject,
             'question': question,
             'ai_response': ai_response,
@@ -51,14 +65,16 @@ class StudentSession:
         }
         self.questions_asked.append(question_data)
         self.subjects_explored.add(subject)
-        self.last_activity = datetime.now()
+        self._question_counts[subject] += 1
+        self._touch(now)
         self._update_learning_analytics(question_data)
 
     def add_quiz_attempt(self, subject: str, quiz_data: Dict, score: int, time_taken: int):
         """Record a quiz attempt."""
+        now = datetime.now()
         quiz_attempt = {
             'id': len(self.quiz_attempts) + 1,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': now.isoformat(),
             'subject': subject,
             'quiz_data': quiz_data,
             'score': score,
@@ -66,15 +82,18 @@ class StudentSession:
             'topic': quiz_data.get('topic', 'General')
         }
         self.quiz_attempts.append(quiz_attempt)
-        self.last_activity = datetime.now()
+        self._score_totals[subject] += score
+        self._score_counts[subject] += 1
+        self._touch(now)
         self._update_performance_analytics(quiz_attempt)
 
     def add_generated_quiz(self, quiz_data: Dict) -> str:
         """Add a generated quiz to the session and return quiz ID."""
-        quiz_id = str(uuid.uuid4())
+        quiz_id = secrets.token_urlsafe(16)
+        now = datetime.now()
         quiz_record = {
             'id': quiz_id,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': now.isoformat(),
             'quiz_data': quiz_data,
             'status': 'generated',
             'started_at': None,
@@ -82,7 +101,7 @@ class StudentSession:
             'results': None
         }
         self.generated_quizzes[quiz_id] = quiz_record
-        self.last_activity = datetime.now()
+        self._touch(now)
         self.quiz_generations += 1
         return quiz_id
 
@@ -99,7 +118,8 @@ class StudentSession:
 
         quiz_record = self.generated_quizzes[quiz_id]
         quiz_record['status'] = 'started'
-        quiz_record['started_at'] = datetime.now().isoformat()
+        now = datetime.now()
+        quiz_record['started_at'] = now.isoformat()
 
         # Create quiz session
         quiz_session = {
@@ -108,11 +128,11 @@ class StudentSession:
             'time_limit': quiz_data.get('metadata', {}).get('time_limit', 600),
             'current_question': 0,
             'answers': [],
-            'start_time': datetime.now()
+            'start_time': now
         }
 
         self.quiz_sessions[quiz_id] = quiz_session
-        self.last_activity = datetime.now()
+        self._touch(now)
 
         return quiz_session
 
@@ -123,7 +143,8 @@ class StudentSession:
 
         quiz_record = self.generated_quizzes[quiz_id]
         quiz_record['status'] = 'completed'
-        quiz_record['completed_at'] = datetime.now().isoformat()
+        now = datetime.now()
+        quiz_record['completed_at'] = now.isoformat()
         quiz_record['results'] = results
 
         # Remove from active sessions
@@ -144,7 +165,9 @@ class StudentSession:
         }
 
         self.quiz_history.append(history_entry)
-        self.last_activity = datetime.now()
+        self._history_totals[history_entry['subject']] += history_entry['score']
+        self._history_counts[history_entry['subject']] += 1
+        self._touch(now)
 
         # Update learning analytics based on quiz performance
         self._update_quiz_analytics(history_entry)
@@ -194,29 +217,39 @@ class StudentSession:
 
     def get_subject_analytics(self) -> Dict:
         """Get analytics by subject including quiz performance"""
+        # Bucket questions and quizzes by subject in one pass each, rather than
+        # rescanning both lists for every subject explored
+        questions_by_subject = defaultdict(list)
+        for q in self.questions_asked:
+            questions_by_subject[q['subject']].append(q)
+        quizzes_by_subject = defaultdict(list)
+        for q in self.quiz_attempts:
+            quizzes_by_subject[q['subject']].append(q)
+
         analytics = {}
 
         for subject in self.subjects_explored:
-            subject_questions = [
-                q for q in self.questions_asked if q['subject'] == subject]
-            subject_quizzes = [
-                q for q in self.quiz_attempts if q['subject'] == subject]
+            subject_questions = questions_by_subject.get(subject, [])
+            subject_quizzes = quizzes_by_subject.get(subject, [])
 
             # Get quiz performance for this subject
             quiz_scores = [q['score'] for q in subject_quizzes]
             avg_quiz_score = sum(quiz_scores) / \
                 len(quiz_scores) if quiz_scores else 0
 
+            timestamps = [q['timestamp'] for q in subject_questions]
+            timestamps.extend(q['timestamp'] for q in subject_quizzes)
+
             analytics[subject] = {
                 'questions_asked': len(subject_questions),
                 'quiz_attempts': len(subject_quizzes),
                 'average_quiz_score': avg_quiz_score,
-                'topics_covered': list(set(q['topic'] for q in subject_questions)),
-                'last_activity': max([q['timestamp'] for q in subject_questions + subject_quizzes]) if subject_questions or subject_quizzes else None,
+                'topics_covered': list(dict.fromkeys(q['topic'] for q in subject_questions)),
+                'last_activity': max(timestamps) if timestamps else None,
                 'quiz_performance': {
                     'total_quizzes': len(subject_quizzes),
-                    'high_scores': len([s for s in quiz_scores if s >= 80]),
-                    'improvement_needed': len([s for s in quiz_scores if s < 60])
+                    'high_scores': sum(1 for s in quiz_scores if s >= 80),
+                    'improvement_needed': sum(1 for s in quiz_scores if s < 60)
                 }
             }
 
@@ -305,20 +338,21 @@ class StudentSession:
         return recommendations[:5]  # Return top 5 recommendations
 
     def get_progress_summary(self) -> Dict:
-        """Return aggregate session progress summary."""
+        """Return aggregate session progress summary.
+
+        Memoized per (revision, session minute); callers must not mutate the result.
+        """
+        session_duration_minutes = self.session_duration_minutes()
+        version = (self.revision, session_duration_minutes)
+        if self._summary_cache is not None and self._summary_cache[0] == version:
+            return self._summary_cache[1]
         total_questions = len(self.questions_asked)
         total_quizzes = len(self.quiz_attempts)
-        quiz_scores = [q['score'] for q in self.quiz_attempts]
-        average_quiz_score = sum(quiz_scores) / len(quiz_scores) if quiz_scores else 0
-        # Calculate session duration
-        session_duration_minutes = int((datetime.now() - self.created_at).total_seconds() / 60)
+        average_quiz_score = sum(self._score_totals.values()) / total_quizzes if total_quizzes else 0
         # Determine most active subject
-        subject_counts = defaultdict(int)
-        for q in self.questions_asked:
-            subject_counts[q['subject']] += 1
         most_active_subject = None
-        if subject_counts:
-            most_active_subject = max(subject_counts.items(), key=lambda x: x[1])[0]
+        if self._question_counts:
+            most_active_subject = max(self._question_counts.items(), key=lambda x: x[1])[0]
         progress = {
             'total_questions': total_questions,
             'total_quizzes': total_quizzes,
@@ -335,6 +369,7 @@ class StudentSession:
             'quizzes_generated': len(self.generated_quizzes),
             'best_performing_subject': self._get_best_performing_subject()
         }
+        self._summary_cache = (version, progress)
         return progress
 
     # ---------------- Subscription helpers (Phase 6) -----------------
@@ -351,6 +386,16 @@ class StudentSession:
 
     def upgrade_to_premium(self):
         self.is_premium = True
+        self.revision += 1
+
+    def _touch(self, now: datetime):
+        """Mark the session as changed by activity at `now`."""
+        self.last_activity = now
+        self.revision += 1
+
+    def session_duration_minutes(self) -> int:
+        """Whole minutes since the session started."""
+        return int((datetime.now() - self.created_at).total_seconds() / 60)
 
     def _extract_topic(self, question: str, subject: str) -> str:
         """Extract topic from question (simplified)"""
@@ -424,17 +469,8 @@ class StudentSession:
 
     def _identify_weak_subjects(self) -> List[str]:
         """Identify subjects where student needs improvement"""
-        subject_scores = defaultdict(list)
-
-        for quiz in self.quiz_attempts:
-            subject_scores[quiz['subject']].append(quiz['score'])
-
-        weak_subjects = []
-        for subject, scores in subject_scores.items():
-            if len(scores) >= 2 and sum(scores) / len(scores) < 70:
-                weak_subjects.append(subject)
-
-        return weak_subjects
+        return [subject for subject, count in self._score_counts.items()
+                if count >= 2 and self._score_totals[subject] / count < 70]
 
     def _identify_unexplored_topics(self) -> List[str]:
         """Identify topics the student hasn't explored yet"""
@@ -500,19 +536,12 @@ class StudentSession:
 
     def _get_best_performing_subject(self) -> Optional[str]:
         """Get the subject with the best quiz performance"""
-        subject_scores = defaultdict(list)
-
-        for quiz in self.quiz_history:
-            subject_scores[quiz['subject']].append(quiz['score'])
-
-        if not subject_scores:
-            return None
-
         best_subject = None
         best_average = 0
 
-        for subject, scores in subject_scores.items():
-            average = sum(scores) / len(scores)
+        # Subjects iterate in order of first quiz, as the history scan did
+        for subject, count in self._history_counts.items():
+            average = self._history_totals[subject] / count
             if average > best_average:
                 best_average = average
                 best_subject = subject
@@ -542,10 +571,31 @@ class StudentSession:
             return 0.0
         return sum(q['score'] for q in quizzes) / len(quizzes)
 
+    def get_subject_average_score(self, subject: str) -> float:
+        """Average quiz score for one subject (0 when no quizzes taken)"""
+        count = self._score_counts.get(subject)
+        return self._score_totals[subject] / count if count else 0.0
+
     def _calculate_overall_average_score(self) -> float:
         """Calculate overall average quiz score"""
         return self._calculate_average_score(self.quiz_attempts)
 
+    def _tally_history(self):
+        """Rebuild the per-subject tallies from questions_asked, quiz_attempts and quiz_history."""
+        self._question_counts.clear()
+        self._score_totals.clear()
+        self._score_counts.clear()
+        self._history_totals.clear()
+        self._history_counts.clear()
+        for q in self.questions_asked:
+            self._question_counts[q['subject']] += 1
+        for q in self.quiz_attempts:
+            self._score_totals[q['subject']] += q['score']
+            self._score_counts[q['subject']] += 1
+        for q in self.quiz_history:
+            self._history_totals[q['subject']] += q['score']
+            self._history_counts[q['subject']] += 1
+
     def to_dict(self) -> Dict:
         """Convert session to dictionary for storage"""
         return {
@@ -562,7 +612,11 @@ class StudentSession:
             'quiz_history': self.quiz_history,
             'preferred_subjects': self.preferred_subjects,
             'difficulty_level': self.difficulty_level,
-            'learning_style': self.learning_style
+            'learning_style': self.learning_style,
+            'is_premium': self.is_premium,
+            'quiz_generations': self.quiz_generations,
+            'free_quiz_limit': self.free_quiz_limit,
+            'revision': self.revision
         }
 
     @classmethod
@@ -580,7 +634,12 @@ class StudentSession:
         session.generated_quizzes = data.get('generated_quizzes', {})
         session.quiz_sessions = data.get('quiz_sessions', {})
         session.quiz_history = data.get('quiz_history', [])
+        session._tally_history()
         session.preferred_subjects = data['preferred_subjects']
         session.difficulty_level = data['difficulty_level']
         session.learning_style = data['learning_style']
+        session.is_premium = data.get('is_premium', False)
+        session.quiz_generations = data.get('quiz_generations', 0)
+        session.free_quiz_limit = data.get('free_quiz_limit', session.free_quiz_limit)
+        session.revision = data.get('revision', 0)
         return session